@@ -0,0 +1,86 @@
+"""Cart manager throughput and latency under a growing number of concurrent users.
+
+    python -m benchmarks.cart_manager_contention --idle-carts 200000
+    python -m benchmarks.cart_manager_contention --stripes 1 --persistence-directory /tmp/carts
+
+Every simulated user keeps adding and removing products from its own cart
+while the session sweeper runs in the background next to `--idle-carts` other carts.
+With `--persistence-directory` each mutation also waits for its log record to
+be fsynced, which is where more concurrent users pay off the most.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16, 64, 256])
+parser.add_argument("--duration", type=float, default=3.0)
+parser.add_argument("--products", type=int, default=1000)
+parser.add_argument("--idle-carts", type=int, default=100_000)
+parser.add_argument("--stripes", type=int, default=1024)
+parser.add_argument("--persistence-directory")
+args = parser.parse_args()
+
+os.environ.setdefault("ACCESS_TOKEN", "benchmark")
+os.environ["SESSION_REFRESH_INTERVAL_IN_SECONDS"] = "1"
+os.environ["LOCK_STRIPE_COUNT"] = str(args.stripes)
+if args.persistence_directory is not None:
+    os.environ["PERSISTENCE_DIRECTORY"] = tempfile.mkdtemp(dir=args.persistence_directory)
+
+from cart_manager import main as cart_manager  # noqa: E402
+
+
+async def simulate_user(user_id: int, deadline: float, latencies: list[float]):
+    while time.perf_counter() < deadline:
+        product_id = random.randrange(args.products)
+        started_at = time.perf_counter()
+        await cart_manager.increment_amount_in_cart(user_id, product_id)
+        await cart_manager.decrement_amount_in_cart(user_id, product_id)
+        latencies.append((time.perf_counter() - started_at) / 2)
+
+
+async def run():
+    background_tasks = [asyncio.create_task(cart_manager.discard_old_session_data())]
+    if cart_manager.journal is not None:
+        cart_manager.journal.recover()
+        cart_manager.journal.start()
+        background_tasks.append(asyncio.create_task(cart_manager.journal.run()))
+    await cart_manager.overwrite_state(
+        cart_manager.State(
+            state_by_product={
+                product_id: cart_manager.ProductState(
+                    product_id=product_id, total_count=1_000_000
+                )
+                for product_id in range(args.products)
+            },
+            cart_by_user_id={
+                -user_id: cart_manager.Cart() for user_id in range(1, args.idle_carts + 1)
+            },
+        )
+    )
+
+    print(f"{'users':>6} {'ops/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for user_count in args.users:
+        latencies: list[float] = []
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(
+            *(simulate_user(user_id, deadline, latencies) for user_id in range(user_count))
+        )
+        latencies.sort()
+        print(
+            f"{user_count:>6} {2 * len(latencies) / args.duration:>10.0f}"
+            f" {statistics.median(latencies) * 1000:>8.2f}"
+            f" {latencies[int(len(latencies) * 0.99)] * 1000:>8.2f}"
+            f" {latencies[-1] * 1000:>8.2f}"
+        )
+
+    for task in background_tasks:
+        task.cancel()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
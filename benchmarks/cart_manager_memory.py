@@ -0,0 +1,103 @@
+"""Cart manager memory used by carts kept as pydantic models and as compact store objects.
+
+    python -m benchmarks.cart_manager_memory
+    python -m benchmarks.cart_manager_memory --carts 100000 --entries-per-cart 20
+
+Each layout is built in a fresh interpreter, so one does not reuse memory
+freed by the other. `pydantic` is how carts were kept before `CartStore`:
+a `Cart` model per cart and a `CartEntry` model per product in it.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+LAYOUTS = ("pydantic", "store")
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument("--carts", type=int, default=1_000_000)
+parser.add_argument("--entries-per-cart", type=int, default=5)
+parser.add_argument("--products", type=int, default=10_000)
+parser.add_argument("--layout", choices=LAYOUTS, help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+os.environ.setdefault("ACCESS_TOKEN", "benchmark")
+
+from cart_manager import main as cart_manager  # noqa: E402
+from cart_manager.store import StoredCart, StoredProduct  # noqa: E402
+
+
+def product_ids_in_cart(user_id: int) -> range:
+    first_product_id = user_id * args.entries_per_cart % args.products
+    return range(first_product_id, first_product_id + args.entries_per_cart)
+
+
+def build_pydantic_layout() -> tuple[dict, dict]:
+    return (
+        {
+            user_id: cart_manager.Cart(
+                entries_by_product_id={
+                    product_id: cart_manager.CartEntry(unit_count=1)
+                    for product_id in product_ids_in_cart(user_id)
+                }
+            )
+            for user_id in range(args.carts)
+        },
+        {
+            product_id: cart_manager.ProductState(
+                product_id=product_id, total_count=1_000_000
+            )
+            for product_id in range(args.products + args.entries_per_cart)
+        },
+    )
+
+
+def build_store_layout() -> tuple[dict, dict]:
+    now = time.time()
+    return (
+        {
+            user_id: StoredCart(
+                now, {product_id: 1 for product_id in product_ids_in_cart(user_id)}
+            )
+            for user_id in range(args.carts)
+        },
+        {
+            product_id: StoredProduct(product_id, total_count=1_000_000)
+            for product_id in range(args.products + args.entries_per_cart)
+        },
+    )
+
+
+def peak_resident_memory_in_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure(layout: str):
+    build = build_pydantic_layout if layout == "pydantic" else build_store_layout
+    memory_before = peak_resident_memory_in_bytes()
+    started_at = time.perf_counter()
+    state = build()
+    build_time = time.perf_counter() - started_at
+    used_memory = peak_resident_memory_in_bytes() - memory_before
+    print(
+        f"{layout:>9} {used_memory / 2**20:>10.0f}"
+        f" {used_memory / args.carts:>11.0f} {build_time:>8.2f}"
+    )
+    del state
+
+
+if __name__ == "__main__":
+    if args.layout is not None:
+        measure(args.layout)
+    else:
+        print(f"{args.carts} carts x {args.entries_per_cart} entries")
+        print(f"{'layout':>9} {'MiB':>10} {'bytes/cart':>11} {'build s':>8}", flush=True)
+        for layout in LAYOUTS:
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.cart_manager_memory", *sys.argv[1:]]
+                + ["--layout", layout],
+                check=True,
+            )
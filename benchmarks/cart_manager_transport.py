@@ -0,0 +1,125 @@
+"""Cart manager latency and throughput over the TCP loopback and over a Unix domain socket.
+
+    python -m benchmarks.cart_manager_transport
+    python -m benchmarks.cart_manager_transport --requests 5000 --clients 1 16
+
+Starts two cart managers, one listening on a local TCP port and one on a
+Unix domain socket, and sends both the same increment, get_cart and products
+requests through the pooled `CartManagerClient` of the main server, from
+`--clients` threads at a time.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from zwpa.workflows.retail.CartManagerClient import CartManagerClient
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument("--requests", type=int, default=2000)
+parser.add_argument("--clients", type=int, nargs="+", default=[1, 8])
+parser.add_argument("--products", type=int, default=100)
+args = parser.parse_args()
+
+
+def start_cart_manager(*listen_arguments: str) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "cart_manager.main:app", "--log-level", "warning"]
+        + list(listen_arguments),
+        env={**os.environ, "ACCESS_TOKEN": "benchmark"},
+    )
+
+
+def wait_until_ready(client: CartManagerClient, url: str):
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            client.request("ready", "GET", f"{url}/products")
+            return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure(client: CartManagerClient, client_count: int, send) -> tuple[float, list[float]]:
+    def timed(request_index: int) -> float:
+        started_at = time.perf_counter()
+        send(request_index)
+        return time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(client_count) as executor:
+        latencies = sorted(executor.map(timed, range(args.requests)))
+    return args.requests / (time.perf_counter() - started_at), latencies
+
+
+def run(transport: str, client: CartManagerClient, url: str):
+    wait_until_ready(client, url)
+    client.request(
+        "initialize",
+        "PUT",
+        f"{url}/state",
+        json={
+            "state_by_product": {
+                product_id: {"product_id": product_id, "total_count": 10**9}
+                for product_id in range(args.products)
+            }
+        },
+    )
+    operations = {
+        "increment": lambda i: client.request(
+            "increment", "POST", f"{url}/cart/{i % 1000}/{i % args.products}/increment"
+        ),
+        "get_cart": lambda i: client.request("get_cart", "GET", f"{url}/cart/{i % 1000}"),
+        "products": lambda i: client.request("products", "GET", f"{url}/products"),
+    }
+    for operation, send in operations.items():
+        for client_count in args.clients:
+            throughput, latencies = measure(client, client_count, send)
+            print(
+                f"{transport:>9} {operation:>10} {client_count:>8}"
+                f" {throughput:>10.0f}"
+                f" {statistics.median(latencies) * 1e6:>8.0f}"
+                f" {latencies[int(len(latencies) * 0.99)] * 1e6:>8.0f}"
+            )
+
+
+def main():
+    port = free_port()
+    socket_path = os.path.join(tempfile.mkdtemp(), "cart_manager.sock")
+    cart_managers = [
+        start_cart_manager("--port", str(port)),
+        start_cart_manager("--uds", socket_path),
+    ]
+    pool_size = max(args.clients)
+    tcp_client = CartManagerClient(pool_size=pool_size)
+    uds_client = CartManagerClient(pool_size=pool_size, unix_socket_path=socket_path)
+    try:
+        print(
+            f"{'transport':>9} {'operation':>10} {'clients':>8}"
+            f" {'ops/s':>10} {'p50 us':>8} {'p99 us':>8}"
+        )
+        run("tcp", tcp_client, f"http://127.0.0.1:{port}")
+        run("uds", uds_client, "http://localhost")
+    finally:
+        tcp_client.close()
+        uds_client.close()
+        for cart_manager in cart_managers:
+            cart_manager.terminate()
+            cart_manager.wait()
+
+
+if __name__ == "__main__":
+    main()
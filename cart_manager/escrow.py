@@ -0,0 +1,142 @@
+import asyncio
+from itertools import count
+from logging import getLogger
+import threading
+import time
+from uuid import uuid4
+
+import requests
+
+
+class Escrow:
+    """Borrows unused product units from the other shards of a sharded cart manager.
+
+    Every shard is only allowed to put into carts the slice of a product's
+    `total_count` it holds. When a shard runs short, it asks its peers, one
+    after another, to release some of their unused units, at least
+    `borrow_batch_size` at a time so a busy shard does not come back for
+    every single unit. A peer never releases units that are in carts.
+
+    A product that runs short again within `hot_product_interval_in_seconds`
+    of its previous borrow is hot: every borrow in such a row asks for twice
+    as many units as the one before, up to `max_borrow_batch_size`, so a
+    shard busy with a hot product comes back to its peers less and less
+    often. A shard gives a peer only half of the unused units of a product
+    that is hot on this shard as well, so shards that are both busy with
+    the product do not keep passing all of its units back and forth.
+
+    A peer takes released units out of its slice before answering, so every
+    release carries a borrow id and is retried up to `release_attempts`
+    times; the peer releases units only once per borrow id. A release still
+    unanswered after that is asked again with the same borrow id on the next
+    borrow of the product, so units a peer gave away are never lost.
+    """
+
+    def __init__(
+        self,
+        peer_urls: list[str],
+        borrow_batch_size: int = 1,
+        max_borrow_batch_size: int = 1000,
+        hot_product_interval_in_seconds: float = 1.0,
+        request_timeout_in_seconds: float = 1.0,
+        release_attempts: int = 3,
+    ) -> None:
+        self.peer_urls = peer_urls
+        self.borrow_batch_size = borrow_batch_size
+        self.max_borrow_batch_size = max(max_borrow_batch_size, borrow_batch_size)
+        self.hot_product_interval_in_seconds = hot_product_interval_in_seconds
+        self.request_timeout_in_seconds = request_timeout_in_seconds
+        self.release_attempts = release_attempts
+
+        self._first_peer = count()
+        # batch size and monotonic time of the latest borrow of every product
+        self._latest_borrow_by_product_id: dict[int, tuple[int, float]] = {}
+        # peer URL, product id and amount of releases by borrow id, that a
+        # peer may have made without the answer getting here
+        self._unconfirmed_releases: dict[str, tuple[str, int, int]] = {}
+        self._unconfirmed_releases_lock = threading.Lock()
+        self._logger = getLogger("cart-escrow")
+
+    def is_hot(self, product_id: int) -> bool:
+        _, borrowed_at = self._latest_borrow_by_product_id.get(
+            product_id, (0, float("-inf"))
+        )
+        return time.monotonic() - borrowed_at < self.hot_product_interval_in_seconds
+
+    def releasable_count(self, product_id: int, available_count: int) -> int:
+        """How many of the unused units of a product may be given to a peer."""
+        if self.is_hot(product_id):
+            return available_count // 2
+        return available_count
+
+    async def borrow(self, product_id: int, missing_count: int) -> int:
+        """Returns how many units were released by peers; may be fewer than missing."""
+        wanted_count = max(missing_count, self._next_batch_size(product_id))
+        borrowed_count = await asyncio.to_thread(
+            self._confirm_unconfirmed_releases, product_id
+        )
+        # peers are asked starting from a different one each time, so borrowing
+        # does not drain the first peer on the list before touching the others
+        first_peer = next(self._first_peer) % len(self.peer_urls)
+        for peer_url in self.peer_urls[first_peer:] + self.peer_urls[:first_peer]:
+            if borrowed_count >= missing_count:
+                break
+            borrowed_count += await asyncio.to_thread(
+                self._release_from_peer,
+                peer_url,
+                product_id,
+                wanted_count - borrowed_count,
+                uuid4().hex,
+            )
+        return borrowed_count
+
+    def _next_batch_size(self, product_id: int) -> int:
+        batch_size = self.borrow_batch_size
+        if self.is_hot(product_id):
+            previous_batch_size, _ = self._latest_borrow_by_product_id[product_id]
+            batch_size = min(2 * previous_batch_size, self.max_borrow_batch_size)
+        self._latest_borrow_by_product_id[product_id] = (batch_size, time.monotonic())
+        return batch_size
+
+    def _release_from_peer(
+        self, peer_url: str, product_id: int, amount: int, borrow_id: str
+    ) -> int:
+        for _ in range(self.release_attempts):
+            released_count = self._request_release(peer_url, product_id, amount, borrow_id)
+            if released_count is not None:
+                return released_count
+        with self._unconfirmed_releases_lock:
+            self._unconfirmed_releases[borrow_id] = (peer_url, product_id, amount)
+        return 0
+
+    def _confirm_unconfirmed_releases(self, product_id: int) -> int:
+        with self._unconfirmed_releases_lock:
+            unconfirmed_releases = [
+                (borrow_id, peer_url, amount)
+                for borrow_id, (peer_url, released_product_id, amount)
+                in self._unconfirmed_releases.items()
+                if released_product_id == product_id
+            ]
+        confirmed_count = 0
+        for borrow_id, peer_url, amount in unconfirmed_releases:
+            released_count = self._request_release(peer_url, product_id, amount, borrow_id)
+            if released_count is not None:
+                with self._unconfirmed_releases_lock:
+                    del self._unconfirmed_releases[borrow_id]
+                confirmed_count += released_count
+        return confirmed_count
+
+    def _request_release(
+        self, peer_url: str, product_id: int, amount: int, borrow_id: str
+    ) -> int | None:
+        try:
+            response = requests.post(
+                f"{peer_url}/product/{product_id}/escrow/release",
+                params={"amount": amount, "borrow_id": borrow_id},
+                timeout=self.request_timeout_in_seconds,
+            )
+            response.raise_for_status()
+            return response.json()["released"]
+        except (requests.RequestException, ValueError, KeyError) as e:
+            self._logger.warning(f"Could not borrow {product_id=} from {peer_url}: {e}")
+            return None
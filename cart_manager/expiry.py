@@ -0,0 +1,59 @@
+import heapq
+from typing import Hashable, Mapping, Protocol
+
+
+class Expiring(Protocol):
+    last_update: float
+
+
+class ExpiryIndex:
+    """Min-heap of (last update POSIX timestamp, key) pairs with lazy deletion.
+
+    Every update pushes a new pair instead of moving the old one, so the heap
+    holds stale pairs too. A popped pair counts only if its timestamp is still
+    the item's current one. `needs_compaction` tells when stale pairs start to
+    outnumber live ones.
+    """
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[float, Hashable]] = []
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def touch(self, key: Hashable, last_update: float) -> None:
+        heapq.heappush(self._heap, (last_update, key))
+
+    def rebuild(self, items: Mapping[Hashable, Expiring]) -> None:
+        self._heap = [(item.last_update, key) for key, item in items.items()]
+        heapq.heapify(self._heap)
+
+    def needs_compaction(self, live_count: int) -> bool:
+        return len(self._heap) > 2 * live_count + 1024
+
+    def seconds_until_next_expiry(self, now: float, ttl_in_seconds: float) -> float:
+        if not self._heap:
+            return float("inf")
+        return max(self._heap[0][0] + ttl_in_seconds - now, 0.0)
+
+    def pop_oldest(
+        self, items: Mapping[Hashable, Expiring]
+    ) -> tuple[float, Hashable] | None:
+        """Pops the pair of the least recently updated item still in `items`."""
+        while self._heap:
+            last_update, key = heapq.heappop(self._heap)
+            item = items.get(key)
+            if item is not None and item.last_update == last_update:
+                return last_update, key
+        return None
+
+    def pop_expired(
+        self, oldest_allowed: float, items: Mapping[Hashable, Expiring]
+    ) -> list[Hashable]:
+        expired_keys = []
+        while self._heap and self._heap[0][0] < oldest_allowed:
+            last_update, key = heapq.heappop(self._heap)
+            item = items.get(key)
+            if item is not None and item.last_update == last_update:
+                expired_keys.append(key)
+        return expired_keys
@@ -1,12 +1,33 @@
 import asyncio
-from datetime import datetime, timedelta, timezone
+from contextlib import AsyncExitStack
+from datetime import datetime, timezone
+import json
 from logging import INFO, getLogger
 import os
-from typing import Callable, NewType
-from fastapi import FastAPI
+import time
+from typing import Any
+from fastapi import FastAPI, HTTPException, Query, status
 from fastapi.concurrency import asynccontextmanager
 from pydantic import BaseModel, Field
 
+from cart_manager.escrow import Escrow
+from cart_manager.persistence import CartJournal
+from cart_manager.shared_counters import SharedAvailabilityCounters
+from cart_manager.store import (
+    CART_ENTRY_HANDLERS,
+    CartEntryHandler,
+    CartStore,
+    NotEnoughProductCountAvailableException,
+    ProductId,
+    ProductNotFoundException,
+    StoredCart,
+    StoredProduct,
+    UserId,
+    decrement_count,
+    increment_count,
+    reset_count,
+)
+
 
 ACCESS_TOKEN = os.environ["ACCESS_TOKEN"]
 SESSION_REFRESH_INTERVAL_IN_SECONDS = int(
@@ -15,10 +36,34 @@ SESSION_REFRESH_INTERVAL_IN_SECONDS = int(
 SESSION_EXPIRATION_TIME_IN_SECONDS = int(
     os.environ.get("SESSION_EXPIRATION_TIME_IN_SECONDS", "900")
 )
+PERSISTENCE_DIRECTORY = os.environ.get("PERSISTENCE_DIRECTORY")
+WAL_FSYNC_INTERVAL_IN_MILLISECONDS = int(
+    os.environ.get("WAL_FSYNC_INTERVAL_IN_MILLISECONDS", "10")
+)
+SNAPSHOT_INTERVAL_IN_SECONDS = int(os.environ.get("SNAPSHOT_INTERVAL_IN_SECONDS", "60"))
+LOCK_STRIPE_COUNT = int(os.environ.get("LOCK_STRIPE_COUNT", "1024"))
+SHARD_PEER_URLS = [
+    url for url in os.environ.get("SHARD_PEER_URLS", "").split(",") if url.strip()
+]
+ESCROW_BORROW_BATCH_SIZE = int(os.environ.get("ESCROW_BORROW_BATCH_SIZE", "10"))
+ESCROW_MAX_BORROW_BATCH_SIZE = int(os.environ.get("ESCROW_MAX_BORROW_BATCH_SIZE", "1000"))
+HOT_PRODUCT_INTERVAL_IN_MILLISECONDS = int(
+    os.environ.get("HOT_PRODUCT_INTERVAL_IN_MILLISECONDS", "1000")
+)
+SHARED_MEMORY_NAME = os.environ.get("SHARED_MEMORY_NAME")
+SHARED_MEMORY_CAPACITY = int(os.environ.get("SHARED_MEMORY_CAPACITY", "100000"))
+SHARED_MEMORY_HEARTBEAT_INTERVAL_IN_SECONDS = 1
+CART_MEMORY_BUDGET_IN_BYTES = (
+    int(os.environ["CART_MEMORY_BUDGET_IN_MEGABYTES"]) * 2**20
+    if "CART_MEMORY_BUDGET_IN_MEGABYTES" in os.environ
+    else None
+)
+# once over budget, carts are evicted until they take this share of it
+CART_MEMORY_EVICTION_TARGET = 0.9
 
 
-ProductId = NewType("ProductId", int)
-UserId = NewType("UserId", int)
+# the models below only describe requests and responses, the state itself is
+# kept in `store` as compact objects and converted at the boundary
 
 
 class CartEntry(BaseModel):
@@ -36,145 +81,489 @@ class ProductState(BaseModel):
     already_put: int = 0
 
 
+class CartChange(BaseModel):
+    product_id: ProductId
+    delta: int | None = None
+    quantity: int | None = Field(default=None, ge=0)
+
+
+class CartChanges(BaseModel):
+    changes: list[CartChange]
+
+
+class CartChangesResult(BaseModel):
+    cart: Cart
+    state_by_product: dict[ProductId, ProductState]
+
+
+class CheckoutResult(BaseModel):
+    unit_count_by_product_id: dict[ProductId, int]
+
+
 class State(BaseModel):
     cart_by_user_id: dict[UserId, Cart] = dict()
     state_by_product: dict[ProductId, ProductState] = dict()
 
 
-class ProductNotFoundException(Exception):
-    def __init__(self, product_id: int, *args: object) -> None:
-        super().__init__(*args)
-        self.product_id = product_id
+class ProductUpserts(BaseModel):
+    total_count_by_product_id: dict[ProductId, int]
+    base_version: int | None = None
+
+
+class AvailabilityDeltas(BaseModel):
+    delta_by_product_id: dict[ProductId, int]
+    base_version: int | None = None
+
+
+class StateVersion(BaseModel):
+    version: int
 
 
-class NotEnoughProductCountAvailableException(Exception):
-    def __init__(self, product_id: int, *args: object) -> None:
-        super().__init__(*args)
-        self.product_id = product_id
+class AvailabilityChanges(BaseModel):
+    version: int
+    complete: bool
+    total_count_by_product_id: dict[ProductId, int]
+
+
+class StateDigest(BaseModel):
+    version: int
+    product_count: int
+    availability_checksums: list[int]
+    membership_checksums: list[int]
+
+
+class Stats(BaseModel):
+    cart_count: int
+    cart_memory_in_bytes: int
+    cart_memory_budget_in_bytes: int | None
+    compacted_cart_count: int
+    evicted_cart_count: int
 
 
 class Locks:
+    """Fixed pools of locks; a cart or a product is guarded by the stripe its id hashes to.
+
+    Stripes are never created or removed, so there is no registry of per-id
+    locks to guard. Locks are always taken cart stripe first, then product
+    stripes, which is also the order `all_stripes` takes them in.
+    """
+
+    def __init__(self, stripe_count: int = LOCK_STRIPE_COUNT) -> None:
+        self.cart_lock_stripes = [asyncio.Lock() for _ in range(stripe_count)]
+        self.product_lock_stripes = [asyncio.Lock() for _ in range(stripe_count)]
+
+    def cart_lock(self, user_id: UserId) -> asyncio.Lock:
+        return self.cart_lock_stripes[hash(user_id) % len(self.cart_lock_stripes)]
+
+    def product_lock(self, product_id: ProductId) -> asyncio.Lock:
+        return self.product_lock_stripes[self._product_stripe(product_id)]
+
+    @asynccontextmanager
+    async def product_locks(self, product_ids: list[ProductId]):
+        async with AsyncExitStack() as stack:
+            for stripe in sorted(set(map(self._product_stripe, product_ids))):
+                await stack.enter_async_context(self.product_lock_stripes[stripe])
+            yield
+
+    def _product_stripe(self, product_id: ProductId) -> int:
+        return hash(product_id) % len(self.product_lock_stripes)
+
+    @asynccontextmanager
+    async def all_stripes(self):
+        async with AsyncExitStack() as stack:
+            for lock in self.cart_lock_stripes + self.product_lock_stripes:
+                await stack.enter_async_context(lock)
+            yield
+
+
+class VersionWatch:
+    """Lets requests wait until the state version changes."""
+
     def __init__(self) -> None:
-        self.state_lock = asyncio.Lock()
-        self.cart_locks: dict[UserId, asyncio.Lock] = dict()
-        self.product_locks: dict[ProductId, asyncio.Lock] = dict()
+        self._changed = asyncio.Event()
+
+    def notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self, timeout_in_seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout_in_seconds)
+        except asyncio.TimeoutError:
+            pass
+
 
+class CartMemoryBudget:
+    """Lets eviction wait until carts take more memory than the budget, and
+    counts the carts compacted and evicted since startup."""
 
-state = State()
+    def __init__(self, budget_in_bytes: int | None) -> None:
+        self.budget_in_bytes = budget_in_bytes
+        self.compacted_cart_count = 0
+        self.evicted_cart_count = 0
+        self._exceeded = asyncio.Event()
+
+    def check(self, memory_in_bytes: int) -> None:
+        if self.budget_in_bytes is not None and memory_in_bytes > self.budget_in_bytes:
+            self._exceeded.set()
+
+    async def wait_until_exceeded(self) -> None:
+        await self._exceeded.wait()
+        self._exceeded.clear()
+
+
+store = CartStore()
 locks = Locks()
+memory_budget = CartMemoryBudget(CART_MEMORY_BUDGET_IN_BYTES)
+version_watch = VersionWatch()
+store.on_version_change = version_watch.notify
+journal = (
+    CartJournal(
+        PERSISTENCE_DIRECTORY,
+        fsync_interval_in_seconds=WAL_FSYNC_INTERVAL_IN_MILLISECONDS / 1000,
+    )
+    if PERSISTENCE_DIRECTORY is not None
+    else None
+)
+escrow = (
+    Escrow(
+        SHARD_PEER_URLS,
+        borrow_batch_size=ESCROW_BORROW_BATCH_SIZE,
+        max_borrow_batch_size=ESCROW_MAX_BORROW_BATCH_SIZE,
+        hot_product_interval_in_seconds=HOT_PRODUCT_INTERVAL_IN_MILLISECONDS / 1000,
+    )
+    if SHARD_PEER_URLS
+    else None
+)
+borrowing_by_product_id: dict[ProductId, asyncio.Task[int]] = {}
+shared_counters = (
+    SharedAvailabilityCounters(SHARED_MEMORY_NAME, capacity=SHARED_MEMORY_CAPACITY)
+    if SHARED_MEMORY_NAME is not None
+    else None
+)
+
+
+def to_cart_model(cart: StoredCart | None) -> Cart:
+    if cart is None:
+        return Cart()
+    return Cart(
+        entries_by_product_id={
+            product_id: CartEntry(unit_count=unit_count)
+            for product_id, unit_count in cart.unit_count_by_product_id.items()
+        },
+        last_update=datetime.fromtimestamp(cart.last_update, tz=timezone.utc),
+    )
+
+
+def to_product_state_model(product: StoredProduct) -> ProductState:
+    return ProductState(
+        product_id=product.product_id,
+        total_count=product.total_count,
+        already_put=product.already_put,
+    )
+
+
+def log_mutation(**record: Any) -> asyncio.Future[None] | None:
+    # has to be called in the same step as the mutation it describes, with no
+    # await in between, so records are in the order mutations were applied
+    if journal is None:
+        return None
+    return journal.append(record)
+
+
+async def wait_until_durable(durability: asyncio.Future[None] | None) -> None:
+    if durability is not None:
+        await durability
+
+
+async def borrow_from_peers(product_id: ProductId, missing_count: int) -> bool:
+    # must not be called with any lock held, peers take their own product locks
+    # to release units and may be borrowing from this shard at the same time
+    if escrow is None:
+        return False
+    # requests running short of the same product wait for a single borrow
+    # together rather than each asking the peers, which matters for hot products
+    borrowing = borrowing_by_product_id.get(product_id)
+    if borrowing is None:
+        borrowing = borrowing_by_product_id[product_id] = asyncio.create_task(
+            borrow_into_slice(product_id, missing_count)
+        )
+        borrowing.add_done_callback(lambda _: borrowing_by_product_id.pop(product_id))
+    return await asyncio.shield(borrowing) > 0
+
+
+async def borrow_into_slice(product_id: ProductId, missing_count: int) -> int:
+    assert escrow is not None
+    borrowed_count = await escrow.borrow(product_id, missing_count)
+    if borrowed_count > 0:
+        await increase_amount_available(product_id, borrowed_count)
+    return borrowed_count
 
 
 async def discard_old_session_data():
     logger = getLogger("old-session-discarder")
     logger.setLevel(INFO)
     while True:
-        logger.info(
-            f"Sleeping for the next {SESSION_REFRESH_INTERVAL_IN_SECONDS} seconds..."
+        # wakes up at least every SESSION_REFRESH_INTERVAL_IN_SECONDS, so that
+        # carts restored with an older last_update do not wait for the next expiry
+        await asyncio.sleep(
+            min(
+                SESSION_REFRESH_INTERVAL_IN_SECONDS,
+                store.expiry_index.seconds_until_next_expiry(
+                    time.time(), SESSION_EXPIRATION_TIME_IN_SECONDS
+                ),
+            )
         )
-        await asyncio.sleep(SESSION_REFRESH_INTERVAL_IN_SECONDS)
-        async with locks.state_lock:
-            logger.info(f"Awake!")
-            now = datetime.now(tz=timezone.utc)
-            oldest_allowed_timestamp = now - timedelta(
-                seconds=SESSION_EXPIRATION_TIME_IN_SECONDS
+        oldest_allowed_timestamp = time.time() - SESSION_EXPIRATION_TIME_IN_SECONDS
+        for user_id in store.expiry_index.pop_expired(
+            oldest_allowed_timestamp, store.cart_by_user_id
+        ):
+            await discard_session(user_id, oldest_allowed_timestamp)
+        for user_id in list(store.carts_with_zero_entries):
+            await compact_cart(user_id)
+        if store.expiry_index.needs_compaction(len(store.cart_by_user_id)):
+            logger.info(f"Compacting expiry index of {len(store.expiry_index)} entries")
+            store.expiry_index.rebuild(store.cart_by_user_id)
+
+
+async def discard_session(user_id: UserId, oldest_allowed_timestamp: float):
+    async with locks.cart_lock(user_id):
+        cart = store.cart_by_user_id.get(user_id)
+        if cart is None or cart.last_update >= oldest_allowed_timestamp:
+            return
+        getLogger("old-session-discarder").info(f"Removing session data for {user_id=}")
+        for product_id in cart.unit_count_by_product_id:
+            async with locks.product_lock(product_id):
+                log_mutation(op="discard_entry", user_id=user_id, product_id=product_id)
+                store.discard_entry(user_id, product_id)
+        log_mutation(op="discard", user_id=user_id)
+        store.remove_cart(user_id)
+
+
+async def compact_cart(user_id: UserId):
+    # entries without units hold no reservations, so no product lock is needed
+    async with locks.cart_lock(user_id):
+        log_mutation(op="compact", user_id=user_id)
+        store.compact_cart(user_id)
+    memory_budget.compacted_cart_count += 1
+
+
+async def evict_cart(user_id: UserId, last_update: float) -> bool:
+    async with locks.cart_lock(user_id):
+        cart = store.cart_by_user_id.get(user_id)
+        if cart is None or cart.last_update != last_update:
+            # updated while waiting for the lock, so no longer the oldest
+            return False
+        async with locks.product_locks(list(cart.unit_count_by_product_id)):
+            log_mutation(op="evict", user_id=user_id)
+            store.discard_cart(user_id)
+    memory_budget.evicted_cart_count += 1
+    return True
+
+
+async def keep_carts_within_memory_budget():
+    assert memory_budget.budget_in_bytes is not None
+    logger = getLogger("cart-memory-budget")
+    logger.setLevel(INFO)
+    target_in_bytes = memory_budget.budget_in_bytes * CART_MEMORY_EVICTION_TARGET
+    while True:
+        await memory_budget.wait_until_exceeded()
+        # carts with entries without units go first, no reservation is lost
+        for user_id in list(store.carts_with_zero_entries):
+            if store.cart_memory_in_bytes <= target_in_bytes:
+                break
+            await compact_cart(user_id)
+        evicted_cart_count = 0
+        while store.cart_memory_in_bytes > target_in_bytes:
+            oldest = store.expiry_index.pop_oldest(store.cart_by_user_id)
+            if oldest is None:
+                break
+            last_update, user_id = oldest
+            if await evict_cart(user_id, last_update):
+                evicted_cart_count += 1
+        if evicted_cart_count > 0:
+            logger.warning(
+                f"Evicted {evicted_cart_count} least recently updated carts,"
+                f" carts take {store.cart_memory_in_bytes} bytes"
             )
-            user_ids_to_discard_session = [
-                user_id
-                for user_id, cart in state.cart_by_user_id.items()
-                if cart.last_update < oldest_allowed_timestamp
-            ]
-            for user_id in user_ids_to_discard_session:
-                logger.info(f"Removing session data for {user_id=}")
-                for product_id, cart_entry in state.cart_by_user_id[
-                    user_id
-                ].entries_by_product_id.items():
-                    async with locks.product_locks[product_id]:
-                        state.state_by_product[
-                            product_id
-                        ].already_put -= cart_entry.unit_count
-                del state.cart_by_user_id[user_id]
-                del locks.cart_locks[user_id]
+
+
+async def snapshot_state_periodically():
+    assert journal is not None
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL_IN_SECONDS)
+        await journal.snapshot(lambda: json.dumps(store.dump()))
+
+
+def publish_product_counts(product: StoredProduct):
+    assert shared_counters is not None
+    shared_counters.publish(product.product_id, product.total_count, product.already_put)
+
+
+async def refresh_shared_counters_heartbeat():
+    assert shared_counters is not None
+    while True:
+        shared_counters.beat()
+        await asyncio.sleep(SHARED_MEMORY_HEARTBEAT_INTERVAL_IN_SECONDS)
+
+
+def recover_state():
+    assert journal is not None
+    snapshot, records = journal.recover()
+    if snapshot is not None:
+        store.load(json.loads(snapshot))
+    for record in records:
+        try:
+            apply_journal_record(record)
+        except (NotEnoughProductCountAvailableException, ProductNotFoundException):
+            pass
+    store.expiry_index.rebuild(store.cart_by_user_id)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if shared_counters is not None:
+        # created first, so recovered counts are published as they are replayed
+        shared_counters.create()
+        store.on_product_change = publish_product_counts
+        asyncio.create_task(refresh_shared_counters_heartbeat())
+    if journal is not None:
+        recover_state()
+        journal.start()
+        asyncio.create_task(journal.run())
+        asyncio.create_task(snapshot_state_periodically())
     asyncio.create_task(discard_old_session_data())
+    if memory_budget.budget_in_bytes is not None:
+        asyncio.create_task(keep_carts_within_memory_budget())
     yield
+    if journal is not None:
+        journal.close()
+    if shared_counters is not None:
+        store.on_product_change = None
+        shared_counters.close()
 
 
 app = FastAPI(lifespan=lifespan)
 
 
-def increment_count(cart_entry: CartEntry, product_state: ProductState):
-    if product_state.already_put + 1 > product_state.total_count:
-        raise NotEnoughProductCountAvailableException(product_state.product_id)
+def apply_journal_record(record: dict[str, Any]):
+    operation = record["op"]
+    if operation == "overwrite":
+        store.load(record["state"])
+    elif operation == "modify":
+        store.modify_cart_entry(
+            UserId(record["user_id"]),
+            ProductId(record["product_id"]),
+            CART_ENTRY_HANDLERS[record["handler"]],
+            now=record["now"],
+        )
+    elif operation == "batch":
+        store.apply_cart_changes(
+            UserId(record["user_id"]),
+            {
+                ProductId(int(product_id)): unit_count
+                for product_id, unit_count in record["unit_count_by_product_id"].items()
+            },
+            now=record["now"],
+        )
+    elif operation == "checkout_cart":
+        store.commit_checkout(
+            UserId(record["user_id"]),
+            {
+                ProductId(int(product_id)): unit_count
+                for product_id, unit_count in record["unit_count_by_product_id"].items()
+            },
+            record["idempotency_key"],
+        )
+    elif operation == "checkout_entry":
+        # written by cart managers from before checkouts were all-or-nothing
+        store.checkout_entry(UserId(record["user_id"]), ProductId(record["product_id"]))
+    elif operation == "discard_entry":
+        store.discard_entry(UserId(record["user_id"]), ProductId(record["product_id"]))
+    elif operation in ("checkout", "discard"):
+        store.remove_cart(UserId(record["user_id"]))
+    elif operation == "evict":
+        store.discard_cart(UserId(record["user_id"]))
+    elif operation == "compact":
+        store.compact_cart(UserId(record["user_id"]))
+    elif operation == "reduce":
+        store.reduce_total_count(ProductId(record["product_id"]), record["amount"])
+    elif operation == "release":
+        store.release_total_count(
+            ProductId(record["product_id"]), record["amount"], record["borrow_id"]
+        )
+    elif operation == "increase":
+        store.increase_total_count(ProductId(record["product_id"]), record["amount"])
+    elif operation == "upsert":
+        store.upsert_product(ProductId(record["product_id"]), record["total_count"])
     else:
-        cart_entry.unit_count += 1
-        product_state.already_put += 1
-
-
-def decrement_count(cart_entry: CartEntry, product_state: ProductState):
-    cart_entry.unit_count -= 1
-    product_state.already_put -= 1
-
-
-def reset_count(cart_entry: CartEntry, product_state: ProductState):
-    product_state.already_put -= cart_entry.unit_count
-    cart_entry.unit_count = 0
+        raise ValueError(f"Unknown journal record {operation=}")
 
 
 async def modify_user_cart_entry(
     user_id: UserId,
     product_id: ProductId,
-    handler: Callable[[CartEntry, ProductState], None],
+    handler: CartEntryHandler,
 ):
-    async with locks.state_lock:
-        if user_id not in state.cart_by_user_id:
-            state.cart_by_user_id[user_id] = Cart()
-            locks.cart_locks[user_id] = asyncio.Lock()
-        if product_id not in state.state_by_product:
-            raise ProductNotFoundException(product_id)
-    async with locks.cart_locks[user_id], locks.product_locks[product_id]:
-        cart = state.cart_by_user_id[user_id]
-        cart.last_update = datetime.now(tz=timezone.utc)
-        product_state = state.state_by_product[product_id]
-        if product_id not in cart.entries_by_product_id:
-            cart.entries_by_product_id[product_id] = CartEntry()
+    # an unknown product has no units available either, and is not borrowed for
+    raise_if_product_not_found(product_id)
+    if handler is increment_count and store.available_count(product_id) < 1:
+        await borrow_from_peers(product_id, 1)
+    async with locks.cart_lock(user_id), locks.product_lock(product_id):
+        # the state may have been overwritten while waiting for the locks
+        raise_if_product_not_found(product_id)
+        now = time.time()
+        durability = log_mutation(
+            op="modify",
+            user_id=user_id,
+            product_id=product_id,
+            handler=handler.__name__,
+            now=now,
+        )
         try:
-            handler(cart.entries_by_product_id[product_id], product_state)
+            store.modify_cart_entry(user_id, product_id, handler, now)
+            rejected = False
         except NotEnoughProductCountAvailableException:
-            product_state.already_put -= cart.entries_by_product_id[
-                product_id
-            ].unit_count
-            cart.entries_by_product_id[product_id].unit_count = 0
-            raise
+            # the entry is emptied all the same, so the record is waited for anyway
+            rejected = True
+    memory_budget.check(store.cart_memory_in_bytes)
+    await wait_until_durable(durability)
+    if rejected:
+        raise HTTPException(
+            status.HTTP_409_CONFLICT, f"Not enough units of product {product_id}"
+        )
+
+
+def raise_if_product_not_found(product_id: ProductId) -> None:
+    try:
+        store.product(product_id)
+    except ProductNotFoundException as e:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, f"Product {e.product_id} not found")
 
 
 @app.put("/state", status_code=201)
 async def overwrite_state(new_state: State):
-    async with locks.state_lock:
-        state.cart_by_user_id = new_state.cart_by_user_id
-        state.state_by_product = new_state.state_by_product
-        locks.cart_locks = {
-            user_id: asyncio.Lock() for user_id in new_state.cart_by_user_id
-        }
-        locks.product_locks = {
-            product_id: asyncio.Lock() for product_id in state.state_by_product
-        }
+    dumped_state = new_state.model_dump(mode="json")
+    async with locks.all_stripes():
+        durability = log_mutation(op="overwrite", state=dumped_state)
+        store.load(dumped_state)
+    await wait_until_durable(durability)
 
 
 @app.get("/products")
-async def get_current_product_counts(product_ids: list[ProductId] | None = None):
+async def get_current_product_counts(product_ids: list[ProductId] | None = Query(None)):
     if product_ids is None:
-        product_ids = list(state.state_by_product.keys())
+        product_ids = list(store.product_by_id.keys())
     return {
-        product_id: state.state_by_product[product_id] for product_id in product_ids
+        product_id: to_product_state_model(store.product_by_id[product_id])
+        for product_id in product_ids
+        if product_id in store.product_by_id
     }
 
 
 @app.get("/cart/{user_id}")
-async def get_cart(user_id: UserId):
-    return state.cart_by_user_id.get(user_id, Cart())
+async def get_cart(user_id: UserId) -> Cart:
+    return to_cart_model(store.cart_by_user_id.get(user_id))
 
 
 @app.post("/cart/{user_id}/{product_id}/increment", status_code=200)
@@ -192,37 +581,247 @@ async def reset_amount_in_cart(user_id: UserId, product_id: ProductId):
     await modify_user_cart_entry(user_id, product_id, reset_count)
 
 
+@app.post("/cart/{user_id}/batch", status_code=200)
+async def apply_changes_to_cart(
+    user_id: UserId, cart_changes: CartChanges
+) -> CartChangesResult:
+    """Applies all changes to the cart of one user, or none of them when any fails.
+
+    Every product lock is taken once, in stripe order, for the whole batch.
+    A sharded cart manager borrows missing units from its peers and retries.
+    """
+    changes = [
+        (change.product_id, change.delta, change.quantity)
+        for change in cart_changes.changes
+    ]
+    product_ids = list(dict.fromkeys(product_id for product_id, _, _ in changes))
+    # units borrowed for one product may be taken by another request before the
+    # retry, so borrowing is not retried forever
+    attempts_left = len(product_ids) + 1
+    while True:
+        try:
+            return await apply_cart_changes_once(user_id, changes, product_ids)
+        except ProductNotFoundException as e:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, f"Product {e.product_id} not found")
+        except NotEnoughProductCountAvailableException as e:
+            attempts_left -= 1
+            if attempts_left == 0 or not await borrow_from_peers(
+                e.product_id, e.missing_count
+            ):
+                raise HTTPException(
+                    status.HTTP_409_CONFLICT, f"Not enough units of product {e.product_id}"
+                )
+        except ValueError as e:
+            raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, str(e))
+
+
+async def apply_cart_changes_once(
+    user_id: UserId,
+    changes: list[tuple[ProductId, int | None, int | None]],
+    product_ids: list[ProductId],
+) -> CartChangesResult:
+    async with locks.cart_lock(user_id), locks.product_locks(product_ids):
+        unit_count_by_product_id = store.resolve_cart_changes(user_id, changes)
+        now = time.time()
+        durability = log_mutation(
+            op="batch",
+            user_id=user_id,
+            unit_count_by_product_id=unit_count_by_product_id,
+            now=now,
+        )
+        store.apply_cart_changes(user_id, unit_count_by_product_id, now)
+        result = CartChangesResult(
+            cart=to_cart_model(store.cart_by_user_id[user_id]),
+            state_by_product={
+                product_id: to_product_state_model(store.product_by_id[product_id])
+                for product_id in product_ids
+            },
+        )
+    memory_budget.check(store.cart_memory_in_bytes)
+    await wait_until_durable(durability)
+    return result
+
+
 @app.post("/cart/{user_id}/checkout", status_code=200)
-async def checkout_cart(user_id: UserId):
-    async with locks.cart_locks[user_id]:
-        for product_id, entry in state.cart_by_user_id[
-            user_id
-        ].entries_by_product_id.items():
-            async with locks.product_locks[product_id]:
-                product_state = state.state_by_product[product_id]
-                difference = product_state.total_count - entry.unit_count
-                if difference < 0:
-                    reset_count(entry, product_state)
-                    raise NotEnoughProductCountAvailableException(
-                        product_state.product_id
-                    )
-                product_state.already_put -= entry.unit_count
-                product_state.total_count -= entry.unit_count
-        del state.cart_by_user_id[user_id]
-    del locks.cart_locks[user_id]
+async def checkout_cart(
+    user_id: UserId, idempotency_key: str | None = None
+) -> CheckoutResult:
+    """Takes every entry of the cart out of stock, or none of them when any
+    product has fewer units left than the cart holds.
+
+    All product locks of the cart are taken, in stripe order, while the
+    entries are checked and until they are taken out of stock, so nothing
+    can change in between. A checkout repeated with the same
+    `idempotency_key` takes nothing and answers like the first one did.
+    """
+    durability = None
+    async with locks.cart_lock(user_id):
+        if idempotency_key is not None:
+            checked_out = store.completed_checkout(user_id, idempotency_key)
+            if checked_out is not None:
+                return CheckoutResult(unit_count_by_product_id=checked_out)
+        cart = store.cart_by_user_id.get(user_id)
+        product_ids = list(cart.unit_count_by_product_id) if cart is not None else []
+        async with locks.product_locks(product_ids):
+            try:
+                unit_count_by_product_id = store.prepare_checkout(user_id)
+            except ProductNotFoundException as e:
+                raise HTTPException(
+                    status.HTTP_404_NOT_FOUND, f"Product {e.product_id} not found"
+                )
+            except NotEnoughProductCountAvailableException as e:
+                raise HTTPException(
+                    status.HTTP_409_CONFLICT, f"Not enough units of product {e.product_id}"
+                )
+            durability = log_mutation(
+                op="checkout_cart",
+                user_id=user_id,
+                unit_count_by_product_id=unit_count_by_product_id,
+                idempotency_key=idempotency_key,
+            )
+            store.commit_checkout(user_id, unit_count_by_product_id, idempotency_key)
+    await wait_until_durable(durability)
+    return CheckoutResult(unit_count_by_product_id=unit_count_by_product_id)
 
 
 @app.post("/product/{product_id}/reduce")
 async def reduce_amount_available(product_id: ProductId, amount: int):
-    async with locks.product_locks[product_id]:
-        state.state_by_product[product_id].total_count -= amount
+    async with locks.product_lock(product_id):
+        store.product(product_id)
+        durability = log_mutation(op="reduce", product_id=product_id, amount=amount)
+        store.reduce_total_count(product_id, amount)
+    await wait_until_durable(durability)
 
 
 @app.post("/product/{product_id}/increase")
 async def increase_amount_available(product_id: ProductId, amount: int):
-    async with locks.state_lock:
-        if product_id not in state.state_by_product:
-            state.state_by_product[product_id] = ProductState(product_id=product_id)
-            locks.product_locks[product_id] = asyncio.Lock()
-    async with locks.product_locks[product_id]:
-        state.state_by_product[product_id].total_count += amount
+    async with locks.product_lock(product_id):
+        durability = log_mutation(op="increase", product_id=product_id, amount=amount)
+        store.increase_total_count(product_id, amount)
+    await wait_until_durable(durability)
+
+
+@app.post("/product/{product_id}/escrow/release")
+async def release_escrowed_amount(
+    product_id: ProductId, amount: int, borrow_id: str | None = None
+):
+    """Gives up to `amount` units that are in no cart to a peer shard, which
+    adds them to its own slice. Half of them are kept when the product is
+    hot on this shard too. A release repeated with the same `borrow_id`
+    gives nothing more and answers like the first one did."""
+    async with locks.product_lock(product_id):
+        if borrow_id is not None:
+            completed_count = store.completed_release(borrow_id)
+            if completed_count is not None:
+                return {"released": completed_count}
+        available_count = store.available_count(product_id)
+        if escrow is not None:
+            available_count = escrow.releasable_count(product_id, available_count)
+        released_count = max(min(amount, available_count), 0)
+        durability = None
+        if released_count > 0 and borrow_id is not None:
+            durability = log_mutation(
+                op="release",
+                product_id=product_id,
+                amount=released_count,
+                borrow_id=borrow_id,
+            )
+            store.release_total_count(product_id, released_count, borrow_id)
+        elif released_count > 0:
+            durability = log_mutation(
+                op="reduce", product_id=product_id, amount=released_count
+            )
+            store.reduce_total_count(product_id, released_count)
+    await wait_until_durable(durability)
+    return {"released": released_count}
+
+
+def ensure_base_version(base_version: int | None):
+    if base_version is not None and base_version != store.version:
+        raise HTTPException(
+            status.HTTP_409_CONFLICT,
+            f"State is at version {store.version}, not {base_version}",
+        )
+
+
+@app.get("/stats")
+async def get_stats() -> Stats:
+    return Stats(
+        cart_count=len(store.cart_by_user_id),
+        cart_memory_in_bytes=store.cart_memory_in_bytes,
+        cart_memory_budget_in_bytes=memory_budget.budget_in_bytes,
+        compacted_cart_count=memory_budget.compacted_cart_count,
+        evicted_cart_count=memory_budget.evicted_cart_count,
+    )
+
+
+@app.get("/state/digest")
+async def get_state_digest(bucket_count: int = Query(1024, gt=0)) -> StateDigest:
+    availability_checksums, membership_checksums = store.checksums(bucket_count)
+    return StateDigest(
+        version=store.version,
+        product_count=len(store.product_by_id),
+        availability_checksums=availability_checksums,
+        membership_checksums=membership_checksums,
+    )
+
+
+@app.post("/products/upsert")
+async def upsert_products(upserts: ProductUpserts) -> StateVersion:
+    """Sets total counts of products, adding the ones not known yet. Carts are kept."""
+    durability = None
+    async with locks.product_locks(list(upserts.total_count_by_product_id)):
+        ensure_base_version(upserts.base_version)
+        for product_id, total_count in upserts.total_count_by_product_id.items():
+            durability = log_mutation(
+                op="upsert", product_id=product_id, total_count=total_count
+            )
+            store.upsert_product(product_id, total_count)
+        version = store.version
+    await wait_until_durable(durability)
+    return StateVersion(version=version)
+
+
+@app.post("/products/deltas")
+async def apply_availability_deltas(deltas: AvailabilityDeltas) -> StateVersion:
+    """Moves total counts of products by the given deltas. Carts are kept."""
+    durability = None
+    async with locks.product_locks(list(deltas.delta_by_product_id)):
+        ensure_base_version(deltas.base_version)
+        for product_id, delta in deltas.delta_by_product_id.items():
+            durability = log_mutation(op="increase", product_id=product_id, amount=delta)
+            store.increase_total_count(product_id, delta)
+        version = store.version
+    await wait_until_durable(durability)
+    return StateVersion(version=version)
+
+
+@app.get("/products/changes")
+async def get_availability_changes(
+    since: int | None = None,
+    timeout_in_seconds: float = Query(25, ge=0, le=60),
+) -> AvailabilityChanges:
+    """Long poll for total counts changed after version `since`.
+
+    Answers straight away when anything changed already, otherwise once
+    something does or the timeout passes. All counts are sent, with
+    `complete` set, when `since` is not given or is too old to tell.
+    """
+    if since == store.version:
+        await version_watch.wait(timeout_in_seconds)
+    changed_product_ids = (
+        store.changed_product_ids_since(since) if since is not None else None
+    )
+    return AvailabilityChanges(
+        version=store.version,
+        complete=changed_product_ids is None,
+        total_count_by_product_id={
+            product_id: product.total_count
+            for product_id, product in store.product_by_id.items()
+        }
+        if changed_product_ids is None
+        else {
+            product_id: store.product_by_id[product_id].total_count
+            for product_id in changed_product_ids
+        },
+    )
@@ -0,0 +1,154 @@
+import asyncio
+import json
+from logging import getLogger
+import os
+from pathlib import Path
+from typing import Any, Callable, Iterator, TextIO
+
+
+SNAPSHOT_FILE_NAME = "snapshot.json"
+SEGMENT_PREFIX = "wal-"
+SEGMENT_SUFFIX = ".log"
+
+
+class CartJournal:
+    """Write-ahead log of cart mutations plus periodic snapshots of the whole state.
+
+    Records are appended to the current log segment straight away, but are
+    fsynced in batches every `fsync_interval_in_seconds` (or one by one when it
+    is 0). The future returned by `append` completes once its record is on
+    disk. A snapshot starts a new segment, and segments it covers are removed.
+    """
+
+    def __init__(self, directory: str, fsync_interval_in_seconds: float = 0.01) -> None:
+        self.directory = Path(directory)
+        self.fsync_interval_in_seconds = fsync_interval_in_seconds
+        self.sequence = 0
+
+        self._segment: TextIO | None = None
+        self._pending: list[asyncio.Future[None]] = []
+        self._flush_lock = asyncio.Lock()
+        self._logger = getLogger("cart-journal")
+
+    def recover(self) -> tuple[str | None, Iterator[dict[str, Any]]]:
+        """Returns the latest snapshot and the records logged after it.
+
+        Must be called, and the records consumed, before anything is appended.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        snapshot_sequence, snapshot = self._read_snapshot()
+        self.sequence = snapshot_sequence
+        return snapshot, self._read_records_after(snapshot_sequence)
+
+    def append(self, record: dict[str, Any]) -> asyncio.Future[None]:
+        assert self._segment is not None, "journal was not started"
+        self.sequence += 1
+        self._segment.write(json.dumps({"seq": self.sequence, **record}) + "\n")
+        durability: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        if self.fsync_interval_in_seconds <= 0:
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+            durability.set_result(None)
+        else:
+            self._pending.append(durability)
+        return durability
+
+    def start(self) -> None:
+        self._open_segment()
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.fsync_interval_in_seconds or 1)
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._pending or self._segment is None:
+                return
+            pending, self._pending = self._pending, []
+            self._segment.flush()
+            await asyncio.to_thread(os.fsync, self._segment.fileno())
+            for durability in pending:
+                if not durability.done():
+                    durability.set_result(None)
+
+    async def snapshot(self, dump_state: Callable[[], str]) -> None:
+        async with self._flush_lock:
+            # nothing here may await until the state is dumped, so the snapshot
+            # holds exactly the mutations logged up to `sequence`
+            self.close()
+            sequence = self.sequence
+            self._open_segment()
+            state = dump_state()
+        await asyncio.to_thread(self._write_snapshot, sequence, state)
+        self._logger.info(f"Snapshot taken at {sequence=}")
+
+    def close(self) -> None:
+        if self._segment is not None:
+            self._sync_segment()
+            self._segment.close()
+            self._segment = None
+
+    def _sync_segment(self) -> None:
+        assert self._segment is not None
+        self._segment.flush()
+        os.fsync(self._segment.fileno())
+        pending, self._pending = self._pending, []
+        for durability in pending:
+            if not durability.done():
+                durability.set_result(None)
+
+    def _open_segment(self) -> None:
+        path = self.directory / f"{SEGMENT_PREFIX}{self.sequence + 1:020d}{SEGMENT_SUFFIX}"
+        # a segment with this name can only hold a torn record left by a crash
+        self._segment = open(path, "w", encoding="utf-8")
+        self._fsync_directory()
+
+    def _segments(self) -> list[tuple[int, Path]]:
+        return sorted(
+            (int(path.name[len(SEGMENT_PREFIX) : -len(SEGMENT_SUFFIX)]), path)
+            for path in self.directory.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}")
+        )
+
+    def _read_snapshot(self) -> tuple[int, str | None]:
+        path = self.directory / SNAPSHOT_FILE_NAME
+        if not path.exists():
+            return 0, None
+        with open(path, encoding="utf-8") as file:
+            header = json.loads(file.readline())
+            return header["sequence"], file.read()
+
+    def _read_records_after(self, sequence: int) -> Iterator[dict[str, Any]]:
+        for _, path in self._segments():
+            with open(path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # torn write of the very last record before a crash
+                        self._logger.warning(f"Ignoring incomplete record in {path}")
+                        break
+                    if record["seq"] <= sequence:
+                        continue
+                    self.sequence = record.pop("seq")
+                    yield record
+
+    def _write_snapshot(self, sequence: int, state: str) -> None:
+        temporary_path = self.directory / f"{SNAPSHOT_FILE_NAME}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            file.write(json.dumps({"sequence": sequence}) + "\n")
+            file.write(state)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.directory / SNAPSHOT_FILE_NAME)
+        self._fsync_directory()
+        for first_sequence, path in self._segments():
+            if first_sequence <= sequence:
+                path.unlink()
+
+    def _fsync_directory(self) -> None:
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
@@ -0,0 +1,170 @@
+from logging import getLogger
+from multiprocessing import resource_tracker, shared_memory
+import struct
+import time
+from typing import Iterator
+
+
+# header: magic, capacity, slot count, state, heartbeat (POSIX timestamp)
+HEADER = struct.Struct("<8sQQQd")
+HEADER_SIZE = 64
+# slot: sequence, product id, total count, already put
+SLOT = struct.Struct("<Qqqq")
+MAGIC = b"ZWPACNT1"
+
+OPEN = 0
+OVERFLOWED = 1
+CLOSED = 2
+
+_SLOT_COUNT_OFFSET = 16
+_STATE_OFFSET = 24
+_HEARTBEAT_OFFSET = 32
+_UINT64 = struct.Struct("<Q")
+_INT64 = struct.Struct("<q")
+_DOUBLE = struct.Struct("<d")
+_COUNTS = struct.Struct("<qq")
+
+
+class SharedAvailabilityCounters:
+    """Publishes `total_count` and `already_put` of every product into a shared
+    memory segment, for processes on the same host to read without asking.
+
+    Every product gets a fixed slot the first time it is published, and
+    keeps it until the segment is closed. A slot is guarded by its own
+    sequence number, a seqlock: it is odd while the slot is being written,
+    so a reader that saw it odd, or saw it change while reading, reads
+    again. Only this process writes. When more than `capacity` products are
+    published the segment is marked overflowed, and readers must not use it.
+
+    The heartbeat in the header is refreshed periodically, so readers can
+    tell a segment left behind by a process that died from a live one.
+    """
+
+    def __init__(self, name: str, capacity: int = 100_000) -> None:
+        self.name = name
+        self.capacity = capacity
+
+        self._memory: shared_memory.SharedMemory | None = None
+        self._slot_by_product_id: dict[int, int] = {}
+        self._logger = getLogger("shared-availability-counters")
+
+    def create(self) -> None:
+        size = HEADER_SIZE + self.capacity * SLOT.size
+        try:
+            self._memory = shared_memory.SharedMemory(self.name, create=True, size=size)
+        except FileExistsError:
+            # left behind by a previous run that did not shut down cleanly
+            stale_memory = shared_memory.SharedMemory(self.name)
+            stale_memory.close()
+            stale_memory.unlink()
+            self._memory = shared_memory.SharedMemory(self.name, create=True, size=size)
+        self._slot_by_product_id = {}
+        HEADER.pack_into(self._memory.buf, 0, MAGIC, self.capacity, 0, OPEN, time.time())
+
+    def publish(self, product_id: int, total_count: int, already_put: int) -> None:
+        assert self._memory is not None, "segment was not created"
+        buffer = self._memory.buf
+        slot = self._slot_by_product_id.get(product_id)
+        if slot is None:
+            if len(self._slot_by_product_id) == self.capacity:
+                if _UINT64.unpack_from(buffer, _STATE_OFFSET)[0] != OVERFLOWED:
+                    self._logger.warning(f"More than {self.capacity} products to publish")
+                    _UINT64.pack_into(buffer, _STATE_OFFSET, OVERFLOWED)
+                return
+            slot = self._slot_by_product_id[product_id] = len(self._slot_by_product_id)
+            # the slot is filled in before readers are told it exists
+            SLOT.pack_into(buffer, _slot_offset(slot), 0, product_id, total_count, already_put)
+            _UINT64.pack_into(buffer, _SLOT_COUNT_OFFSET, slot + 1)
+            return
+        offset = _slot_offset(slot)
+        sequence = _UINT64.unpack_from(buffer, offset)[0]
+        _UINT64.pack_into(buffer, offset, sequence + 1)
+        _COUNTS.pack_into(buffer, offset + 16, total_count, already_put)
+        _UINT64.pack_into(buffer, offset, sequence + 2)
+
+    def beat(self) -> None:
+        if self._memory is not None:
+            _DOUBLE.pack_into(self._memory.buf, _HEARTBEAT_OFFSET, time.time())
+
+    def close(self) -> None:
+        if self._memory is None:
+            return
+        _UINT64.pack_into(self._memory.buf, _STATE_OFFSET, CLOSED)
+        self._memory.close()
+        self._memory.unlink()
+        self._memory = None
+
+
+class TornSlotError(Exception):
+    """A slot stayed in the middle of being written for every read attempt,
+    e.g. because the process writing it died there."""
+
+
+class SharedAvailabilityCountersReader:
+    """Reads counts published by `SharedAvailabilityCounters` in another process.
+
+    Slots of products are looked up once and remembered, so reading the
+    counts of a product touches only its own slot. A slot is read at most
+    `max_read_attempts` times before giving up with `TornSlotError`, as a
+    writer that died mid-write leaves its sequence number odd forever.
+    """
+
+    def __init__(self, name: str, max_read_attempts: int = 1000) -> None:
+        self.name = name
+        self.max_read_attempts = max_read_attempts
+
+        self._memory = shared_memory.SharedMemory(name)
+        # the segment belongs to the cart manager; without this the resource
+        # tracker of this process would remove it when this process exits
+        resource_tracker.unregister(self._memory._name, "shared_memory")  # type: ignore[attr-defined]
+        magic, self.capacity, _, _, _ = HEADER.unpack_from(self._memory.buf, 0)
+        if magic != MAGIC:
+            self._memory.close()
+            raise ValueError(f"{name} does not hold availability counters")
+        self._slot_by_product_id: dict[int, int] = {}
+
+    @property
+    def state(self) -> int:
+        return _UINT64.unpack_from(self._memory.buf, _STATE_OFFSET)[0]
+
+    @property
+    def heartbeat(self) -> float:
+        return _DOUBLE.unpack_from(self._memory.buf, _HEARTBEAT_OFFSET)[0]
+
+    def read(self, product_id: int) -> tuple[int, int] | None:
+        """`(total_count, already_put)` of a product, or None when it was never published."""
+        slot = self._slot_by_product_id.get(product_id)
+        if slot is None:
+            self._index_new_slots()
+            slot = self._slot_by_product_id.get(product_id)
+            if slot is None:
+                return None
+        return self._read_slot(_slot_offset(slot))
+
+    def product_ids(self) -> Iterator[int]:
+        self._index_new_slots()
+        return iter(list(self._slot_by_product_id))
+
+    def close(self) -> None:
+        self._memory.close()
+
+    def _read_slot(self, offset: int) -> tuple[int, int]:
+        buffer = self._memory.buf
+        for _ in range(self.max_read_attempts):
+            sequence = _UINT64.unpack_from(buffer, offset)[0]
+            if sequence % 2 == 1:
+                continue
+            counts = _COUNTS.unpack_from(buffer, offset + 16)
+            if _UINT64.unpack_from(buffer, offset)[0] == sequence:
+                return counts
+        raise TornSlotError(f"slot at {offset} of {self.name} is being written")
+
+    def _index_new_slots(self) -> None:
+        slot_count = _UINT64.unpack_from(self._memory.buf, _SLOT_COUNT_OFFSET)[0]
+        for slot in range(len(self._slot_by_product_id), slot_count):
+            product_id = _INT64.unpack_from(self._memory.buf, _slot_offset(slot) + 8)[0]
+            self._slot_by_product_id[product_id] = slot
+
+
+def _slot_offset(slot: int) -> int:
+    return HEADER_SIZE + slot * SLOT.size
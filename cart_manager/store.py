@@ -0,0 +1,528 @@
+from collections import OrderedDict, deque
+from datetime import datetime
+from hashlib import blake2b
+import sys
+from typing import Any, Callable, Iterable, NewType
+
+from cart_manager.expiry import ExpiryIndex
+
+
+ProductId = NewType("ProductId", int)
+UserId = NewType("UserId", int)
+
+
+class ProductNotFoundException(Exception):
+    def __init__(self, product_id: int, *args: object) -> None:
+        super().__init__(*args)
+        self.product_id = product_id
+
+
+class NotEnoughProductCountAvailableException(Exception):
+    def __init__(self, product_id: int, *args: object, missing_count: int = 1) -> None:
+        super().__init__(*args)
+        self.product_id = product_id
+        self.missing_count = missing_count
+
+
+class StoredCart:
+    """A cart keeps bare unit counts by product id, with no object per entry.
+
+    `last_update` is a POSIX timestamp.
+    """
+
+    __slots__ = ("unit_count_by_product_id", "last_update")
+
+    def __init__(
+        self,
+        last_update: float,
+        unit_count_by_product_id: dict[ProductId, int] | None = None,
+    ) -> None:
+        self.last_update = last_update
+        self.unit_count_by_product_id = (
+            unit_count_by_product_id if unit_count_by_product_id is not None else {}
+        )
+
+
+class StoredProduct:
+    __slots__ = ("product_id", "total_count", "already_put")
+
+    def __init__(
+        self, product_id: ProductId, total_count: int = 0, already_put: int = 0
+    ) -> None:
+        self.product_id = product_id
+        self.total_count = total_count
+        self.already_put = already_put
+
+
+# memory a cart takes besides the cart object and its dict, as measured with
+# tracemalloc: its slot in `cart_by_user_id`, its user id, last update and
+# pair in the expiry index, and the product id object of every entry
+CART_OVERHEAD_IN_BYTES = 150
+ENTRY_OVERHEAD_IN_BYTES = 32
+
+
+def cart_size_in_bytes(cart: StoredCart | None) -> int:
+    """Estimate of the memory a cart takes, with everything that keeps track of it."""
+    if cart is None:
+        return 0
+    return (
+        sys.getsizeof(cart)
+        + sys.getsizeof(cart.unit_count_by_product_id)
+        + CART_OVERHEAD_IN_BYTES
+        + ENTRY_OVERHEAD_IN_BYTES * len(cart.unit_count_by_product_id)
+    )
+
+
+CartEntryHandler = Callable[[StoredCart, StoredProduct], None]
+
+
+def increment_count(cart: StoredCart, product: StoredProduct):
+    if product.already_put + 1 > product.total_count:
+        raise NotEnoughProductCountAvailableException(product.product_id)
+    unit_count_by_product_id = cart.unit_count_by_product_id
+    unit_count_by_product_id[product.product_id] = (
+        unit_count_by_product_id.get(product.product_id, 0) + 1
+    )
+    product.already_put += 1
+
+
+def decrement_count(cart: StoredCart, product: StoredProduct):
+    unit_count_by_product_id = cart.unit_count_by_product_id
+    unit_count_by_product_id[product.product_id] = (
+        unit_count_by_product_id.get(product.product_id, 0) - 1
+    )
+    product.already_put -= 1
+
+
+def reset_count(cart: StoredCart, product: StoredProduct):
+    product.already_put -= cart.unit_count_by_product_id.get(product.product_id, 0)
+    cart.unit_count_by_product_id[product.product_id] = 0
+
+
+CART_ENTRY_HANDLERS: dict[str, CartEntryHandler] = {
+    handler.__name__: handler for handler in (increment_count, decrement_count, reset_count)
+}
+
+
+class CartStore:
+    """Carts and product counts of the cart manager, kept as compact plain objects.
+
+    Mutations here take no locks and log nothing; the caller does both. They
+    are shared by the endpoints and by journal replay, so replaying a record
+    changes the state exactly as the original request did. Dumps use the same
+    layout as the `State` model of the HTTP API.
+
+    `version` goes up whenever any product's total count changes, so a client
+    can tell whether the counts it read are still current. The last
+    `change_log_size` changes are remembered, so a client can also ask which
+    products changed since the version it read, and `on_version_change` is
+    called after each of them. `on_product_change` is called after any count
+    of a product changed, `already_put` included.
+
+    The last `completed_checkout_count` checkouts made with an idempotency
+    key are remembered, so a retried checkout is answered with the units
+    checked out the first time instead of being checked out again.
+    The last `completed_release_count` releases to peer shards are remembered
+    the same way by borrow id, so a peer retrying a release it got no answer
+    to is given the units released the first time.
+
+    `cart_memory_in_bytes` estimates the memory all carts take, and
+    `carts_with_zero_entries` holds the carts that may have entries without
+    units, which `compact_cart` drops.
+    """
+
+    def __init__(
+        self,
+        change_log_size: int = 100_000,
+        completed_checkout_count: int = 100_000,
+        completed_release_count: int = 100_000,
+    ) -> None:
+        self.cart_by_user_id: dict[UserId, StoredCart] = {}
+        self.product_by_id: dict[ProductId, StoredProduct] = {}
+        self.expiry_index = ExpiryIndex()
+        self.version = 0
+        self.on_version_change: Callable[[], None] | None = None
+        self.on_product_change: Callable[[StoredProduct], None] | None = None
+        self.cart_memory_in_bytes = 0
+        self.carts_with_zero_entries: set[UserId] = set()
+
+        self.completed_checkout_count = completed_checkout_count
+        self.completed_release_count = completed_release_count
+
+        self._change_log: deque[tuple[int, ProductId]] = deque(maxlen=change_log_size)
+        self._oldest_logged_version = 0
+        self._completed_checkouts: OrderedDict[
+            tuple[UserId, str], dict[ProductId, int]
+        ] = OrderedDict()
+        self._completed_releases: OrderedDict[str, int] = OrderedDict()
+
+    def product(self, product_id: ProductId) -> StoredProduct:
+        try:
+            return self.product_by_id[product_id]
+        except KeyError:
+            raise ProductNotFoundException(product_id)
+
+    def available_count(self, product_id: ProductId) -> int:
+        product = self.product_by_id.get(product_id)
+        return product.total_count - product.already_put if product is not None else 0
+
+    def touch_cart(self, user_id: UserId, now: float) -> StoredCart:
+        cart = self.cart_by_user_id.get(user_id)
+        if cart is None:
+            cart = self.cart_by_user_id[user_id] = StoredCart(now)
+        else:
+            cart.last_update = now
+        self.expiry_index.touch(user_id, now)
+        return cart
+
+    def modify_cart_entry(
+        self,
+        user_id: UserId,
+        product_id: ProductId,
+        handler: CartEntryHandler,
+        now: float,
+    ):
+        product = self.product(product_id)
+        size_before = cart_size_in_bytes(self.cart_by_user_id.get(user_id))
+        cart = self.touch_cart(user_id, now)
+        try:
+            handler(cart, product)
+        except NotEnoughProductCountAvailableException:
+            reset_count(cart, product)
+            raise
+        finally:
+            self.cart_memory_in_bytes += cart_size_in_bytes(cart) - size_before
+            if cart.unit_count_by_product_id.get(product_id) == 0:
+                self.carts_with_zero_entries.add(user_id)
+            self._product_changed(product)
+
+    def checkout_entry(self, user_id: UserId, product_id: ProductId):
+        cart = self.cart_by_user_id[user_id]
+        product = self.product(product_id)
+        unit_count = cart.unit_count_by_product_id[product_id]
+        if product.total_count - unit_count < 0:
+            reset_count(cart, product)
+            raise NotEnoughProductCountAvailableException(product_id)
+        product.already_put -= unit_count
+        product.total_count -= unit_count
+        self._total_count_changed(product_id)
+
+    def prepare_checkout(self, user_id: UserId) -> dict[ProductId, int]:
+        """Unit counts a checkout of the cart would take, without changing anything.
+
+        Raises when any product of the cart does not exist or has fewer units
+        left than the cart holds, so a checkout either takes every entry or
+        none of them.
+        """
+        cart = self.cart_by_user_id.get(user_id)
+        if cart is None:
+            return {}
+        for product_id, unit_count in cart.unit_count_by_product_id.items():
+            missing_count = unit_count - self.product(product_id).total_count
+            if missing_count > 0:
+                raise NotEnoughProductCountAvailableException(
+                    product_id, missing_count=missing_count
+                )
+        return dict(cart.unit_count_by_product_id)
+
+    def commit_checkout(
+        self,
+        user_id: UserId,
+        unit_count_by_product_id: dict[ProductId, int],
+        idempotency_key: str | None = None,
+    ):
+        """Takes units prepared by `prepare_checkout` out of stock and removes the cart."""
+        for product_id, unit_count in unit_count_by_product_id.items():
+            product = self.product_by_id[product_id]
+            product.already_put -= unit_count
+            product.total_count -= unit_count
+            self._total_count_changed(product_id)
+        self.remove_cart(user_id)
+        if idempotency_key is not None:
+            self._completed_checkouts[(user_id, idempotency_key)] = unit_count_by_product_id
+            if len(self._completed_checkouts) > self.completed_checkout_count:
+                self._completed_checkouts.popitem(last=False)
+
+    def completed_checkout(
+        self, user_id: UserId, idempotency_key: str
+    ) -> dict[ProductId, int] | None:
+        return self._completed_checkouts.get((user_id, idempotency_key))
+
+    def discard_entry(self, user_id: UserId, product_id: ProductId):
+        unit_count = self.cart_by_user_id[user_id].unit_count_by_product_id[product_id]
+        product = self.product(product_id)
+        product.already_put -= unit_count
+        self._product_changed(product)
+
+    def remove_cart(self, user_id: UserId):
+        self.cart_memory_in_bytes -= cart_size_in_bytes(
+            self.cart_by_user_id.pop(user_id, None)
+        )
+        self.carts_with_zero_entries.discard(user_id)
+
+    def discard_cart(self, user_id: UserId):
+        """Releases the units of every entry of the cart and removes it."""
+        for product_id in self.cart_by_user_id[user_id].unit_count_by_product_id:
+            self.discard_entry(user_id, product_id)
+        self.remove_cart(user_id)
+
+    def compact_cart(self, user_id: UserId):
+        """Drops entries without units from the cart, and the cart itself when
+        no entry is left."""
+        self.carts_with_zero_entries.discard(user_id)
+        cart = self.cart_by_user_id.get(user_id)
+        if cart is None:
+            return
+        size_before = cart_size_in_bytes(cart)
+        # a new dict, as one that had keys deleted keeps its size
+        cart.unit_count_by_product_id = {
+            product_id: unit_count
+            for product_id, unit_count in cart.unit_count_by_product_id.items()
+            if unit_count != 0
+        }
+        self.cart_memory_in_bytes += cart_size_in_bytes(cart) - size_before
+        if not cart.unit_count_by_product_id:
+            self.remove_cart(user_id)
+
+    def resolve_cart_changes(
+        self,
+        user_id: UserId,
+        changes: Iterable[tuple[ProductId, int | None, int | None]],
+    ) -> dict[ProductId, int]:
+        """Turns `(product id, delta, quantity)` changes into the unit counts the
+        cart would end up with, without changing anything.
+
+        Raises when a product does not exist, when a count would go negative
+        or when there are not enough units left of a product.
+        """
+        cart = self.cart_by_user_id.get(user_id)
+        current_unit_count_by_product_id = (
+            cart.unit_count_by_product_id if cart is not None else {}
+        )
+        unit_count_by_product_id: dict[ProductId, int] = {}
+        for product_id, delta, quantity in changes:
+            self.product(product_id)
+            unit_count = unit_count_by_product_id.get(
+                product_id, current_unit_count_by_product_id.get(product_id, 0)
+            )
+            if quantity is not None:
+                unit_count = quantity
+            if delta is not None:
+                unit_count += delta
+            if unit_count < 0:
+                raise ValueError(f"Negative unit count of product {product_id}")
+            unit_count_by_product_id[product_id] = unit_count
+        for product_id, unit_count in unit_count_by_product_id.items():
+            product = self.product_by_id[product_id]
+            increase = unit_count - current_unit_count_by_product_id.get(product_id, 0)
+            missing_count = product.already_put + increase - product.total_count
+            if increase > 0 and missing_count > 0:
+                raise NotEnoughProductCountAvailableException(
+                    product_id, missing_count=missing_count
+                )
+        return unit_count_by_product_id
+
+    def apply_cart_changes(
+        self, user_id: UserId, unit_count_by_product_id: dict[ProductId, int], now: float
+    ):
+        size_before = cart_size_in_bytes(self.cart_by_user_id.get(user_id))
+        cart = self.touch_cart(user_id, now)
+        for product_id, unit_count in unit_count_by_product_id.items():
+            product = self.product_by_id[product_id]
+            product.already_put += unit_count - cart.unit_count_by_product_id.get(
+                product_id, 0
+            )
+            cart.unit_count_by_product_id[product_id] = unit_count
+            self._product_changed(product)
+        self.cart_memory_in_bytes += cart_size_in_bytes(cart) - size_before
+        if 0 in unit_count_by_product_id.values():
+            self.carts_with_zero_entries.add(user_id)
+
+    def reduce_total_count(self, product_id: ProductId, amount: int):
+        self.product(product_id).total_count -= amount
+        self._total_count_changed(product_id)
+
+    def release_total_count(self, product_id: ProductId, amount: int, borrow_id: str):
+        """Gives `amount` units to the peer shard borrowing them under `borrow_id`."""
+        self.reduce_total_count(product_id, amount)
+        self._completed_releases[borrow_id] = amount
+        if len(self._completed_releases) > self.completed_release_count:
+            self._completed_releases.popitem(last=False)
+
+    def completed_release(self, borrow_id: str) -> int | None:
+        return self._completed_releases.get(borrow_id)
+
+    def increase_total_count(self, product_id: ProductId, amount: int):
+        if product_id not in self.product_by_id:
+            self.product_by_id[product_id] = StoredProduct(product_id)
+        self.product_by_id[product_id].total_count += amount
+        self._total_count_changed(product_id)
+
+    def upsert_product(self, product_id: ProductId, total_count: int):
+        if product_id not in self.product_by_id:
+            self.product_by_id[product_id] = StoredProduct(product_id)
+        self.product_by_id[product_id].total_count = total_count
+        self._total_count_changed(product_id)
+
+    def changed_product_ids_since(self, version: int) -> set[ProductId] | None:
+        """Products whose total count changed after `version`, or None when
+        those changes are no longer remembered and every product has to be read."""
+        if version > self.version or version < self._oldest_logged_version:
+            return None
+        changed_product_ids = set()
+        for change_version, product_id in reversed(self._change_log):
+            if change_version <= version:
+                break
+            changed_product_ids.add(product_id)
+        return changed_product_ids
+
+    def _total_count_changed(self, product_id: ProductId):
+        self.version += 1
+        if len(self._change_log) == self._change_log.maxlen:
+            self._oldest_logged_version = self._change_log[0][0]
+        self._change_log.append((self.version, product_id))
+        self._product_changed(self.product_by_id[product_id])
+        if self.on_version_change is not None:
+            self.on_version_change()
+
+    def _product_changed(self, product: StoredProduct):
+        if self.on_product_change is not None:
+            self.on_product_change(product)
+
+    def checksums(self, bucket_count: int) -> tuple[list[int], list[int]]:
+        """Sums of per product hashes, by product id modulo `bucket_count`.
+
+        Availability checksums add up the total counts weighted by a hash of
+        the product id, membership checksums tell which products are known at
+        all. Both are sums, so checksums of shards add up to the checksum of
+        their combined counts.
+        """
+        availability_checksums = [0] * bucket_count
+        membership_checksums = [0] * bucket_count
+        for product_id, product in self.product_by_id.items():
+            bucket = product_id % bucket_count
+            availability_checksums[bucket] = (
+                availability_checksums[bucket]
+                + product.total_count * product_hash(product_id, b"availability")
+            ) % CHECKSUM_MODULUS
+            membership_checksums[bucket] = (
+                membership_checksums[bucket] + product_hash(product_id, b"membership")
+            ) % CHECKSUM_MODULUS
+        return availability_checksums, membership_checksums
+
+    def load(self, dumped_state: dict[str, Any]):
+        """Replaces the whole state with one dumped by `dump` or sent to `PUT /state`."""
+        self.cart_by_user_id = {
+            UserId(int(user_id)): StoredCart(
+                _to_timestamp(cart["last_update"]),
+                {
+                    ProductId(int(product_id)): entry.get("unit_count", 0)
+                    for product_id, entry in cart.get("entries_by_product_id", {}).items()
+                },
+            )
+            for user_id, cart in dumped_state.get("cart_by_user_id", {}).items()
+        }
+        self.cart_memory_in_bytes = sum(
+            map(cart_size_in_bytes, self.cart_by_user_id.values())
+        )
+        self.carts_with_zero_entries = {
+            user_id
+            for user_id, cart in self.cart_by_user_id.items()
+            if 0 in cart.unit_count_by_product_id.values()
+        }
+        previous_product_ids = self.product_by_id.keys()
+        self.product_by_id = {
+            ProductId(int(product_id)): StoredProduct(
+                ProductId(product["product_id"]),
+                product.get("total_count", 0),
+                product.get("already_put", 0),
+            )
+            for product_id, product in dumped_state.get("state_by_product", {}).items()
+        }
+        self._completed_checkouts = OrderedDict(
+            (
+                (UserId(user_id), idempotency_key),
+                {
+                    ProductId(int(product_id)): unit_count
+                    for product_id, unit_count in unit_count_by_product_id.items()
+                },
+            )
+            for user_id, idempotency_key, unit_count_by_product_id in dumped_state.get(
+                "completed_checkouts", []
+            )
+        )
+        self._completed_releases = OrderedDict(
+            dumped_state.get("completed_releases", [])
+        )
+        self.expiry_index.rebuild(self.cart_by_user_id)
+        # a state sent to `PUT /state` carries no version and counts as a change
+        self.version = dumped_state.get("version", self.version + 1)
+        self._change_log.clear()
+        self._oldest_logged_version = self.version
+        if self.on_product_change is not None:
+            # products that are gone are reported with no units at all
+            for product_id in previous_product_ids - self.product_by_id.keys():
+                self.on_product_change(StoredProduct(product_id))
+            for product in self.product_by_id.values():
+                self.on_product_change(product)
+        if self.on_version_change is not None:
+            self.on_version_change()
+
+    def dump(self) -> dict[str, Any]:
+        return {
+            "version": self.version,
+            "cart_by_user_id": {
+                str(user_id): {
+                    "entries_by_product_id": {
+                        str(product_id): {"unit_count": unit_count}
+                        for product_id, unit_count in cart.unit_count_by_product_id.items()
+                    },
+                    "last_update": cart.last_update,
+                }
+                for user_id, cart in self.cart_by_user_id.items()
+            },
+            "state_by_product": {
+                str(product_id): {
+                    "product_id": product.product_id,
+                    "total_count": product.total_count,
+                    "already_put": product.already_put,
+                }
+                for product_id, product in self.product_by_id.items()
+            },
+            "completed_checkouts": [
+                [
+                    user_id,
+                    idempotency_key,
+                    {
+                        str(product_id): unit_count
+                        for product_id, unit_count in unit_count_by_product_id.items()
+                    },
+                ]
+                for (
+                    user_id,
+                    idempotency_key,
+                ), unit_count_by_product_id in self._completed_checkouts.items()
+            ],
+            "completed_releases": [
+                [borrow_id, amount]
+                for borrow_id, amount in self._completed_releases.items()
+            ],
+        }
+
+
+CHECKSUM_MODULUS = 2**64
+
+
+def product_hash(product_id: int, salt: bytes) -> int:
+    return int.from_bytes(
+        blake2b(
+            product_id.to_bytes(8, "little", signed=True), digest_size=8, person=salt
+        ).digest(),
+        "little",
+    )
+
+
+def _to_timestamp(last_update: float | str) -> float:
+    if isinstance(last_update, str):
+        return datetime.fromisoformat(last_update).timestamp()
+    return last_update
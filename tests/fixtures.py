@@ -20,7 +20,7 @@ from zwpa.model import (
     Warehouse,
     WarehouseProduct,
 )
-from zwpa.model import UserRoleAssignment
+from zwpa.model import USER_ROLE_BITS, UserRoleAssignment
 
 from zwpa.model import User
 from zwpa.views.LocationView import LocationView
@@ -124,6 +124,9 @@ class Fixtures:
             role=role, user_id=user_id, id=id if id is not None else cls.next_id()
         )
         session.add(user_role_assignment)
+        user = session.get(User, user_id)
+        if user is not None:
+            user.role_mask = (user.role_mask or 0) | USER_ROLE_BITS[role]
         return user_role_assignment
 
     @classmethod
@@ -0,0 +1,1118 @@
+import asyncio
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import json
+from pathlib import Path
+from socketserver import ThreadingUnixStreamServer
+from types import SimpleNamespace
+from tempfile import TemporaryDirectory
+import threading
+import time
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+import httpx
+
+os.environ.setdefault("ACCESS_TOKEN", "test")
+
+from cart_manager import main as cart_manager_server  # noqa: E402
+from cart_manager.escrow import Escrow
+from cart_manager.expiry import ExpiryIndex
+from cart_manager.persistence import CartJournal
+from cart_manager.shared_counters import (
+    HEADER_SIZE,
+    OVERFLOWED,
+    SharedAvailabilityCounters,
+    SharedAvailabilityCountersReader,
+    TornSlotError,
+)
+from cart_manager.store import (
+    CartStore,
+    NotEnoughProductCountAvailableException,
+    ProductId,
+    UserId,
+    cart_size_in_bytes,
+    decrement_count,
+    increment_count,
+)
+from zwpa.workflows.retail.AsyncCartManagerClient import AsyncCartManagerClient
+from zwpa.workflows.retail.AsyncRestCartManager import AsyncRestCartManager
+from zwpa.workflows.retail.AvailabilityMirror import AvailabilityMirror
+from zwpa.workflows.retail.CartManager import (
+    CHECKSUM_MODULUS,
+    CartChange,
+    CartManagerResponseException,
+    InvalidCartChangeException,
+    NotEnoughProductCountAvailableException as CartManagerNotEnoughProductCountAvailableException,
+    ProductCountsUnreadableException,
+    ProductNotFoundException,
+    availability_checksums,
+)
+from zwpa.workflows.retail.CartManagerClient import CartManagerClient
+from zwpa.workflows.retail.InProcessCartManager import InProcessCartManager
+from zwpa.workflows.retail.RestCartManager import (
+    RestAvailabilityChanges,
+    RestCartManager,
+)
+from zwpa.workflows.retail.SharedMemoryAvailability import SharedMemoryAvailability
+
+
+class CartJournalTestCase(TestCase):
+    def setUp(self) -> None:
+        self.directory = TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_recovery_replays_records_logged_after_latest_snapshot(self):
+        # given
+        async def write():
+            journal = CartJournal(self.directory.name, fsync_interval_in_seconds=0.001)
+            journal.recover()
+            journal.start()
+            flusher = asyncio.create_task(journal.run())
+            await journal.append({"op": "increase", "amount": 1})
+            await journal.snapshot(lambda: '{"total": 1}')
+            await journal.append({"op": "increase", "amount": 2})
+            flusher.cancel()
+
+        asyncio.run(write())
+
+        # when
+        snapshot, records = CartJournal(self.directory.name).recover()
+
+        # then
+        self.assertEqual('{"total": 1}', snapshot)
+        self.assertEqual([{"op": "increase", "amount": 2}], list(records))
+
+    def test_recovery_ignores_torn_last_record(self):
+        # given
+        segment = Path(self.directory.name) / "wal-00000000000000000001.log"
+        segment.write_text(
+            json.dumps({"seq": 1, "op": "increase", "amount": 1}) + '\n{"seq": 2, "op'
+        )
+        journal = CartJournal(self.directory.name, fsync_interval_in_seconds=0)
+
+        # when
+        snapshot, records = journal.recover()
+        recovered_records = list(records)
+
+        # then
+        self.assertIsNone(snapshot)
+        self.assertEqual([{"op": "increase", "amount": 1}], recovered_records)
+        self.assertEqual(1, journal.sequence)
+
+
+class ExpiryIndexTestCase(TestCase):
+    def test_only_items_not_touched_since_are_expired(self):
+        # given
+        start = 1_700_000_000.0
+        items = {
+            1: SimpleNamespace(last_update=start),
+            2: SimpleNamespace(last_update=start + 10),
+            3: SimpleNamespace(last_update=start),
+        }
+        index = ExpiryIndex()
+        index.rebuild(items)
+        items[3].last_update = start + 20
+        index.touch(3, items[3].last_update)
+
+        # when
+        expired = index.pop_expired(start + 15, items)
+
+        # then
+        self.assertEqual([1, 2], sorted(expired))
+        self.assertEqual(5.0, index.seconds_until_next_expiry(start + 15, 0))
+
+    def test_least_recently_touched_items_are_popped_first(self):
+        # given
+        items = {1: SimpleNamespace(last_update=1.0), 2: SimpleNamespace(last_update=2.0)}
+        index = ExpiryIndex()
+        index.rebuild(items)
+        items[1].last_update = 3.0
+        index.touch(1, items[1].last_update)
+
+        # when
+        popped = [index.pop_oldest(items) for _ in range(3)]
+
+        # then
+        self.assertEqual([(2.0, 2), (3.0, 1), None], popped)
+
+
+class RecordingEscrow(Escrow):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.requested_amounts: list[int] = []
+        self.requested_borrow_ids: list[str] = []
+
+    def _request_release(
+        self, peer_url: str, product_id: int, amount: int, borrow_id: str
+    ) -> int | None:
+        self.requested_amounts.append(amount)
+        self.requested_borrow_ids.append(borrow_id)
+        return amount
+
+
+class DrainedEscrow(RecordingEscrow):
+    def _request_release(
+        self, peer_url: str, product_id: int, amount: int, borrow_id: str
+    ) -> int | None:
+        super()._request_release(peer_url, product_id, amount, borrow_id)
+        return 0
+
+
+class UnansweredEscrow(RecordingEscrow):
+    """Gets no answer to its first `unanswered_count` release requests."""
+
+    def __init__(self, *args, unanswered_count: int, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.unanswered_count = unanswered_count
+
+    def _request_release(
+        self, peer_url: str, product_id: int, amount: int, borrow_id: str
+    ) -> int | None:
+        released_count = super()._request_release(peer_url, product_id, amount, borrow_id)
+        if len(self.requested_amounts) <= self.unanswered_count:
+            return None
+        return released_count
+
+
+class EscrowTestCase(IsolatedAsyncioTestCase):
+    async def test_borrows_in_a_row_of_hot_product_ask_for_growing_batches(self):
+        # given
+        escrow = RecordingEscrow(
+            ["http://peer"],
+            borrow_batch_size=10,
+            max_borrow_batch_size=50,
+            hot_product_interval_in_seconds=60,
+        )
+
+        # when
+        for _ in range(4):
+            await escrow.borrow(1, 1)
+        await escrow.borrow(2, 1)
+
+        # then
+        self.assertEqual([10, 20, 40, 50, 10], escrow.requested_amounts)
+        self.assertEqual(5, escrow.releasable_count(1, 11))
+        self.assertEqual(11, escrow.releasable_count(3, 11))
+
+    async def test_products_borrowed_rarely_are_not_hot(self):
+        # given
+        escrow = RecordingEscrow(
+            ["http://peer"], borrow_batch_size=10, hot_product_interval_in_seconds=0
+        )
+
+        # when
+        for _ in range(3):
+            await escrow.borrow(1, 1)
+
+        # then
+        self.assertEqual([10, 10, 10], escrow.requested_amounts)
+        self.assertEqual(11, escrow.releasable_count(1, 11))
+
+
+    async def test_unanswered_release_is_retried_with_same_borrow_id(self):
+        # given
+        escrow = UnansweredEscrow(
+            ["http://peer"], borrow_batch_size=10, unanswered_count=1
+        )
+
+        # when
+        borrowed_count = await escrow.borrow(1, 1)
+
+        # then
+        self.assertEqual(10, borrowed_count)
+        self.assertEqual(2, len(escrow.requested_borrow_ids))
+        self.assertEqual(1, len(set(escrow.requested_borrow_ids)))
+
+    async def test_release_unanswered_after_all_attempts_is_claimed_by_next_borrow(self):
+        # given
+        escrow = UnansweredEscrow(
+            ["http://peer"], borrow_batch_size=10, release_attempts=2, unanswered_count=2
+        )
+        unconfirmed_count = await escrow.borrow(1, 1)
+
+        # when
+        borrowed_count = await escrow.borrow(1, 1)
+
+        # then
+        self.assertEqual(0, unconfirmed_count)
+        self.assertEqual(10, borrowed_count)
+        self.assertEqual(3, len(escrow.requested_borrow_ids))
+        self.assertEqual(1, len(set(escrow.requested_borrow_ids)))
+
+
+class CartStoreTestCase(TestCase):
+    def test_failed_increment_releases_units_already_in_cart(self):
+        # given
+        store = CartStore()
+        store.increase_total_count(ProductId(1), 2)
+        for _ in range(2):
+            store.modify_cart_entry(UserId(7), ProductId(1), increment_count, now=1.0)
+
+        # when
+        with self.assertRaises(NotEnoughProductCountAvailableException):
+            store.modify_cart_entry(UserId(7), ProductId(1), increment_count, now=2.0)
+
+        # then
+        self.assertEqual(0, store.product_by_id[ProductId(1)].already_put)
+        self.assertEqual(
+            {ProductId(1): 0}, store.cart_by_user_id[UserId(7)].unit_count_by_product_id
+        )
+        self.assertEqual(2.0, store.cart_by_user_id[UserId(7)].last_update)
+
+    def test_rejected_cart_changes_report_how_many_units_are_missing(self):
+        # given
+        store = CartStore()
+        store.increase_total_count(ProductId(1), 5)
+        store.apply_cart_changes(UserId(7), {ProductId(1): 3}, now=1.0)
+
+        # when
+        with self.assertRaises(NotEnoughProductCountAvailableException) as context:
+            store.resolve_cart_changes(UserId(8), [(ProductId(1), 4, None)])
+
+        # then
+        self.assertEqual(2, context.exception.missing_count)
+        self.assertEqual(3, store.product_by_id[ProductId(1)].already_put)
+        self.assertNotIn(UserId(8), store.cart_by_user_id)
+
+    def test_checkout_takes_no_units_unless_it_can_take_all_of_them(self):
+        # given
+        store = CartStore()
+        store.increase_total_count(ProductId(1), 5)
+        store.increase_total_count(ProductId(2), 5)
+        store.apply_cart_changes(UserId(7), {ProductId(1): 2, ProductId(2): 3}, now=1.0)
+        store.reduce_total_count(ProductId(2), 4)
+
+        # when
+        with self.assertRaises(NotEnoughProductCountAvailableException) as context:
+            store.prepare_checkout(UserId(7))
+
+        # then
+        self.assertEqual(2, context.exception.missing_count)
+        self.assertEqual(5, store.product_by_id[ProductId(1)].total_count)
+        self.assertEqual(2, store.product_by_id[ProductId(1)].already_put)
+        self.assertIn(UserId(7), store.cart_by_user_id)
+
+    def test_completed_checkouts_are_remembered_by_idempotency_key(self):
+        # given
+        store = CartStore(completed_checkout_count=1)
+        store.increase_total_count(ProductId(1), 5)
+        store.apply_cart_changes(UserId(7), {ProductId(1): 2}, now=1.0)
+
+        # when
+        store.commit_checkout(UserId(7), store.prepare_checkout(UserId(7)), "first")
+        store.commit_checkout(UserId(7), store.prepare_checkout(UserId(7)), "second")
+        restored_store = CartStore()
+        restored_store.load(json.loads(json.dumps(store.dump())))
+
+        # then
+        self.assertEqual(3, store.product_by_id[ProductId(1)].total_count)
+        self.assertEqual(0, store.product_by_id[ProductId(1)].already_put)
+        self.assertIsNone(store.completed_checkout(UserId(7), "first"))
+        self.assertEqual({}, store.completed_checkout(UserId(7), "second"))
+        self.assertEqual({}, restored_store.completed_checkout(UserId(7), "second"))
+
+    def test_completed_releases_are_remembered_by_borrow_id(self):
+        # given
+        store = CartStore(completed_release_count=1)
+        store.increase_total_count(ProductId(1), 5)
+
+        # when
+        store.release_total_count(ProductId(1), 2, "first")
+        store.release_total_count(ProductId(1), 1, "second")
+        restored_store = CartStore()
+        restored_store.load(json.loads(json.dumps(store.dump())))
+
+        # then
+        self.assertEqual(2, store.product_by_id[ProductId(1)].total_count)
+        self.assertIsNone(store.completed_release("first"))
+        self.assertEqual(1, store.completed_release("second"))
+        self.assertEqual(1, restored_store.completed_release("second"))
+
+    def test_compaction_drops_entries_without_units_and_their_memory(self):
+        # given
+        store = CartStore()
+        store.increase_total_count(ProductId(1), 5)
+        store.increase_total_count(ProductId(2), 5)
+        store.apply_cart_changes(UserId(7), {ProductId(1): 2}, now=1.0)
+        store.modify_cart_entry(UserId(8), ProductId(2), increment_count, now=1.0)
+        store.modify_cart_entry(UserId(8), ProductId(2), decrement_count, now=2.0)
+
+        # when
+        for user_id in list(store.carts_with_zero_entries):
+            store.compact_cart(user_id)
+
+        # then
+        self.assertEqual([UserId(7)], list(store.cart_by_user_id))
+        self.assertEqual(
+            cart_size_in_bytes(store.cart_by_user_id[UserId(7)]),
+            store.cart_memory_in_bytes,
+        )
+        store.discard_cart(UserId(7))
+        self.assertEqual(0, store.cart_memory_in_bytes)
+        self.assertEqual(0, store.product_by_id[ProductId(1)].already_put)
+
+    def test_tells_products_changed_since_version_while_changes_are_remembered(self):
+        # given
+        store = CartStore(change_log_size=3)
+        for product_id in (1, 2, 1):
+            store.increase_total_count(ProductId(product_id), 1)
+
+        # when
+        changed_since_first = store.changed_product_ids_since(1)
+        store.increase_total_count(ProductId(3), 1)
+
+        # then
+        self.assertEqual({ProductId(1), ProductId(2)}, changed_since_first)
+        self.assertIsNone(store.changed_product_ids_since(0))
+        self.assertEqual({ProductId(3)}, store.changed_product_ids_since(3))
+        self.assertEqual(set(), store.changed_product_ids_since(4))
+        self.assertIsNone(store.changed_product_ids_since(5))
+
+    def test_loads_state_in_http_api_layout(self):
+        # given
+        dumped_state = {
+            "cart_by_user_id": {
+                "7": {
+                    "entries_by_product_id": {"1": {"unit_count": 3}},
+                    "last_update": "2024-01-01T00:00:00Z",
+                }
+            },
+            "state_by_product": {
+                "1": {"product_id": 1, "total_count": 5, "already_put": 3}
+            },
+        }
+        store = CartStore()
+
+        # when
+        store.load(dumped_state)
+        reloaded_store = CartStore()
+        reloaded_store.load(json.loads(json.dumps(store.dump())))
+
+        # then
+        cart = reloaded_store.cart_by_user_id[UserId(7)]
+        self.assertEqual({ProductId(1): 3}, cart.unit_count_by_product_id)
+        self.assertEqual(
+            datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp(), cart.last_update
+        )
+        self.assertEqual(5, reloaded_store.product_by_id[ProductId(1)].total_count)
+        self.assertEqual(
+            [UserId(7)],
+            reloaded_store.expiry_index.pop_expired(
+                float("inf"), reloaded_store.cart_by_user_id
+            ),
+        )
+
+    def test_checksums_of_shards_add_up_to_checksums_expected_by_main_server(self):
+        # given
+        total_count_by_product_id = {1: 5, 2: 0, 9: 3}
+        shards = [CartStore(), CartStore()]
+        for product_id, total_count in total_count_by_product_id.items():
+            shards[0].upsert_product(ProductId(product_id), total_count - 1)
+            shards[1].upsert_product(ProductId(product_id), 1)
+
+        # when
+        shard_checksums = [shard.checksums(bucket_count=4) for shard in shards]
+
+        # then
+        self.assertEqual(
+            availability_checksums(total_count_by_product_id, bucket_count=4),
+            [
+                (
+                    shard_checksums[0][0][bucket]
+                    + shard_checksums[1][0][bucket]
+                    + shard_checksums[0][1][bucket]
+                )
+                % CHECKSUM_MODULUS
+                for bucket in range(4)
+            ],
+        )
+
+
+class CartManagerClientTestCase(TestCase):
+    def setUp(self) -> None:
+        self.status_codes = []
+
+        test_case = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._respond()
+
+            def do_POST(self):
+                self._respond()
+
+            def _respond(self):
+                status_code = test_case.status_codes.pop(0)
+                body = json.dumps({"detail": "unavailable"}).encode()
+                self.send_response(status_code)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.client = CartManagerClient(max_retries=2, retry_backoff_in_seconds=0.001)
+        self.addCleanup(self.client.close)
+
+    def test_only_idempotent_requests_are_retried(self):
+        # given
+        self.status_codes = [503, 503, 200, 503]
+
+        # when
+        self.client.request("get_cart", "GET", f"{self.url}/cart/1")
+        with self.assertRaises(CartManagerResponseException) as context:
+            self.client.request("checkout", "POST", f"{self.url}/cart/1/checkout")
+
+        # then
+        self.assertEqual(503, context.exception.status_code)
+        self.assertEqual([], self.status_codes)
+        self.assertEqual(2, self.client.statistics["get_cart"].retries)
+        self.assertEqual(0, self.client.statistics["get_cart"].errors)
+        self.assertEqual(1, self.client.statistics["checkout"].errors)
+
+
+
+class AsyncRestCartManagerTestCase(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.status_codes = []
+        self.requested_urls = []
+
+        def handle(request: httpx.Request) -> httpx.Response:
+            self.requested_urls.append(str(request.url))
+            if request.url.path == "/products":
+                shard = request.url.host
+                return httpx.Response(
+                    200,
+                    json={
+                        "1": {"product_id": 1, "total_count": 2 if shard == "a" else 3},
+                        "2": {"product_id": 2, "total_count": 1},
+                    },
+                )
+            return httpx.Response(
+                self.status_codes.pop(0), json={"detail": "product not found"}
+            )
+
+        self.cart_manager = AsyncRestCartManager(
+            manager_url="http://a",
+            shard_urls=["http://a", "http://b"],
+            client=AsyncCartManagerClient(
+                retry_backoff_in_seconds=0.001, transport=httpx.MockTransport(handle)
+            ),
+        )
+
+    async def asyncTearDown(self) -> None:
+        await self.cart_manager.close()
+
+    async def test_product_counts_of_all_shards_are_summed_up(self):
+        # when
+        counts = await self.cart_manager.get_current_product_counts()
+
+        # then
+        self.assertEqual({1: 5, 2: 2}, counts)
+        self.assertEqual(2, len(self.requested_urls))
+
+    async def test_cart_errors_are_raised_and_only_idempotent_requests_retried(self):
+        # given
+        self.status_codes = [404, 503]
+
+        # when
+        with self.assertRaises(ProductNotFoundException):
+            await self.cart_manager.put_in_cart(product_id=7, user_id=1)
+        with self.assertRaises(CartManagerResponseException):
+            await self.cart_manager.checkout(user_id=1)
+
+        # then
+        self.assertEqual([], self.status_codes)
+        statistics = self.cart_manager.client.statistics
+        self.assertEqual(0, statistics["put_in_cart"].errors)
+        self.assertEqual(0, statistics["checkout"].retries)
+        self.assertEqual(1, statistics["checkout"].errors)
+
+    async def test_invalid_cart_change_is_raised_as_client_error(self):
+        # given
+        self.status_codes = [422]
+
+        # when / then
+        with self.assertRaises(InvalidCartChangeException):
+            await self.cart_manager.apply_cart_changes(
+                user_id=1, changes=[CartChange(product_id=1, delta=-1)]
+            )
+
+
+class CartManagerServerTestCase(TestCase):
+    def setUp(self) -> None:
+        self.client = TestClient(cart_manager_server.app)
+        self.client.put(
+            "/state",
+            json={
+                "state_by_product": {
+                    "1": {"product_id": 1, "total_count": 5},
+                    "2": {"product_id": 2, "total_count": 1},
+                }
+            },
+        ).raise_for_status()
+
+    def unit_counts_in_cart(self, user_id: int) -> dict[str, int]:
+        entries = self.client.get(f"/cart/{user_id}").json()["entries_by_product_id"]
+        return {product_id: entry["unit_count"] for product_id, entry in entries.items()}
+
+    def already_put_counts(self) -> dict[str, int]:
+        return {
+            product_id: state["already_put"]
+            for product_id, state in self.client.get("/products").json().items()
+        }
+
+    def test_batch_with_change_beyond_total_count_changes_nothing(self):
+        # given
+        changes = [
+            {"product_id": 1, "quantity": 2},
+            {"product_id": 2, "quantity": 3},
+        ]
+
+        # when
+        response = self.client.post("/cart/1/batch", json={"changes": changes})
+
+        # then
+        self.assertEqual(409, response.status_code)
+        self.assertEqual({}, self.unit_counts_in_cart(1))
+        self.assertEqual({"1": 0, "2": 0}, self.already_put_counts())
+
+    def test_batch_with_negative_unit_count_is_unprocessable(self):
+        # given
+        changes = [
+            {"product_id": 1, "quantity": 2},
+            {"product_id": 2, "delta": -1},
+        ]
+
+        # when
+        response = self.client.post("/cart/1/batch", json={"changes": changes})
+
+        # then
+        self.assertEqual(422, response.status_code)
+        self.assertEqual({}, self.unit_counts_in_cart(1))
+        self.assertEqual({"1": 0, "2": 0}, self.already_put_counts())
+
+    def test_release_repeated_with_same_borrow_id_gives_units_once(self):
+        # when
+        responses = [
+            self.client.post(
+                "/product/1/escrow/release", params={"amount": 2, "borrow_id": "b1"}
+            )
+            for _ in range(2)
+        ]
+
+        # then
+        self.assertEqual([{"released": 2}] * 2, [response.json() for response in responses])
+        self.assertEqual(3, self.client.get("/products").json()["1"]["total_count"])
+
+    def test_units_missing_on_shard_are_borrowed_before_retrying_batch(self):
+        # given
+        escrow = RecordingEscrow(["http://peer"], borrow_batch_size=1)
+        changes = [{"product_id": 2, "quantity": 3}]
+
+        # when
+        with patch.object(cart_manager_server, "escrow", escrow):
+            response = self.client.post("/cart/1/batch", json={"changes": changes})
+
+        # then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([2], escrow.requested_amounts)
+        self.assertEqual({"2": 3}, self.unit_counts_in_cart(1))
+        self.assertEqual(3, response.json()["state_by_product"]["2"]["total_count"])
+
+    def test_increment_of_unknown_product_borrows_nothing(self):
+        # given
+        escrow = RecordingEscrow(["http://peer"], borrow_batch_size=1)
+
+        # when
+        with patch.object(cart_manager_server, "escrow", escrow):
+            response = self.client.post("/cart/1/3/increment")
+
+        # then
+        self.assertEqual(404, response.status_code)
+        self.assertEqual([], escrow.requested_amounts)
+
+    def test_batch_fails_once_peers_have_no_units_to_lend(self):
+        # given
+        escrow = DrainedEscrow(["http://peer"], borrow_batch_size=1)
+        changes = [{"product_id": 2, "quantity": 3}]
+
+        # when
+        with patch.object(cart_manager_server, "escrow", escrow):
+            response = self.client.post("/cart/1/batch", json={"changes": changes})
+
+        # then
+        self.assertEqual(409, response.status_code)
+        self.assertEqual([2], escrow.requested_amounts)
+        self.assertEqual({}, self.unit_counts_in_cart(1))
+
+
+class YieldingLock(asyncio.Lock):
+    """Hands control to other requests before every acquisition, as a
+    contended lock would, so requests interleave while taking stripes."""
+
+    async def acquire(self) -> bool:
+        await asyncio.sleep(0)
+        return await super().acquire()
+
+
+def yielding_locks(stripe_count: int) -> cart_manager_server.Locks:
+    locks = cart_manager_server.Locks(stripe_count)
+    locks.cart_lock_stripes = [YieldingLock() for _ in range(stripe_count)]
+    locks.product_lock_stripes = [YieldingLock() for _ in range(stripe_count)]
+    return locks
+
+
+class CartManagerLocksTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        # two stripes, so requests for different products share them too
+        locks_patch = patch.object(cart_manager_server, "locks", yielding_locks(2))
+        locks_patch.start()
+        self.addCleanup(locks_patch.stop)
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=cart_manager_server.app),
+            base_url="http://cart-manager",
+        )
+        await self.client.put(
+            "/state",
+            json={
+                "state_by_product": {
+                    str(product_id): {"product_id": product_id, "total_count": 3}
+                    for product_id in range(1, 5)
+                }
+            },
+        )
+
+    async def asyncTearDown(self) -> None:
+        await self.client.aclose()
+
+    def assert_reservations_match_carts(self) -> None:
+        store = cart_manager_server.store
+        for product_id, product in store.product_by_id.items():
+            self.assertEqual(
+                sum(
+                    cart.unit_count_by_product_id.get(product_id, 0)
+                    for cart in store.cart_by_user_id.values()
+                ),
+                product.already_put,
+            )
+            self.assertLessEqual(product.already_put, product.total_count)
+
+    async def test_overlapping_batches_and_checkouts_neither_deadlock_nor_oversell(self):
+        # given
+        async def fill_cart_and_check_out(user_id: int) -> dict[str, int]:
+            changes = [
+                {"product_id": product_id, "quantity": 1}
+                for product_id in (user_id % 4 + 1, (user_id + 1) % 4 + 1)
+            ]
+            await self.client.post(f"/cart/{user_id}/batch", json={"changes": changes})
+            response = await self.client.post(f"/cart/{user_id}/checkout")
+            return response.json()["unit_count_by_product_id"]
+
+        # when
+        checkouts = await asyncio.wait_for(
+            asyncio.gather(*(fill_cart_and_check_out(user_id) for user_id in range(20))),
+            timeout=5,
+        )
+
+        # then
+        for product_id, product in cart_manager_server.store.product_by_id.items():
+            checked_out_count = sum(
+                checkout.get(str(product_id), 0) for checkout in checkouts
+            )
+            self.assertEqual(3, checked_out_count + product.total_count)
+            self.assertGreaterEqual(product.total_count, 0)
+        self.assert_reservations_match_carts()
+
+    async def test_discarding_old_carts_releases_units_while_batches_take_them(self):
+        # given
+        for user_id in range(1, 4):
+            await self.client.post(
+                f"/cart/{user_id}/batch",
+                json={
+                    "changes": [
+                        {"product_id": 1, "quantity": 1},
+                        {"product_id": 2, "quantity": 1},
+                    ]
+                },
+            )
+        oldest_allowed_timestamp = time.time() + 1
+
+        # when
+        await asyncio.wait_for(
+            asyncio.gather(
+                *(
+                    cart_manager_server.discard_session(
+                        UserId(user_id), oldest_allowed_timestamp
+                    )
+                    for user_id in range(1, 4)
+                ),
+                *(
+                    self.client.post(
+                        f"/cart/{user_id}/batch",
+                        json={
+                            "changes": [
+                                {"product_id": 2, "quantity": 1},
+                                {"product_id": 1, "delta": 1},
+                            ]
+                        },
+                    )
+                    for user_id in range(4, 10)
+                ),
+            ),
+            timeout=5,
+        )
+
+        # then
+        for user_id in range(1, 4):
+            self.assertNotIn(user_id, cart_manager_server.store.cart_by_user_id)
+        self.assert_reservations_match_carts()
+
+
+class InProcessCartManagerTestCase(TestCase):
+    def setUp(self) -> None:
+        self.cart_manager = InProcessCartManager(session_expiration_time_in_seconds=60)
+        self.cart_manager.initialize({1: 2, 2: 5})
+
+    def test_units_cannot_be_put_into_carts_beyond_total_count(self):
+        # given
+        self.cart_manager.put_in_cart(product_id=1, user_id=1)
+        self.cart_manager.put_in_cart(product_id=1, user_id=2)
+
+        # when
+        with self.assertRaises(CartManagerNotEnoughProductCountAvailableException):
+            self.cart_manager.put_in_cart(product_id=1, user_id=1)
+        with self.assertRaises(ProductNotFoundException):
+            self.cart_manager.put_in_cart(product_id=3, user_id=1)
+
+        # then
+        self.assertEqual({1: 0}, self.cart_manager.get_cart(1).amount_by_product_id)
+        self.assertEqual({1: 1}, self.cart_manager.get_cart(2).amount_by_product_id)
+
+    def test_second_process_sharing_lock_path_refuses_to_start(self):
+        # given
+        with TemporaryDirectory() as directory:
+            lock_path = os.path.join(directory, "cart-manager.lock")
+            first = InProcessCartManager(lock_path=lock_path)
+            second = InProcessCartManager(lock_path=lock_path)
+            first.start()
+
+            # when / then
+            with self.assertRaises(RuntimeError):
+                second.start()
+            first.close()
+            second.start()
+            second.close()
+
+    def test_batch_with_negative_unit_count_is_rejected_as_invalid(self):
+        # when
+        with self.assertRaises(InvalidCartChangeException):
+            self.cart_manager.apply_cart_changes(
+                user_id=1,
+                changes=[
+                    CartChange(product_id=2, quantity=1),
+                    CartChange(product_id=1, delta=-1),
+                ],
+            )
+
+        # then
+        self.assertEqual({}, self.cart_manager.get_cart(1).amount_by_product_id)
+
+    def test_digest_matches_checksums_expected_by_main_server(self):
+        # when
+        digest = self.cart_manager.get_state_digest(bucket_count=4)
+
+        # then
+        self.assertEqual(availability_checksums({1: 2, 2: 5}, 4), digest.checksums)
+        self.assertEqual(2, digest.product_count)
+
+    def test_checkout_repeated_with_same_key_takes_units_once(self):
+        # given
+        self.cart_manager.put_in_cart(product_id=2, user_id=1)
+        self.cart_manager.put_in_cart(product_id=2, user_id=1)
+        self.cart_manager.checkout(user_id=1, idempotency_key="order")
+        self.cart_manager.put_in_cart(product_id=2, user_id=1)
+
+        # when
+        self.cart_manager.checkout(user_id=1, idempotency_key="order")
+
+        # then
+        self.assertEqual({2: 1}, self.cart_manager.get_cart(1).amount_by_product_id)
+        self.assertEqual({2: 3}, self.cart_manager.get_product_counts([2]))
+
+    def test_expired_carts_are_discarded_with_their_units(self):
+        # given
+        self.cart_manager.put_in_cart(product_id=1, user_id=1)
+        self.cart_manager.put_in_cart(product_id=1, user_id=1)
+
+        # when
+        self.cart_manager.discard_old_carts(now=time.time() + 61)
+
+        # then
+        self.assertEqual({}, self.cart_manager.get_cart(1).amount_by_product_id)
+        self.cart_manager.put_in_cart(product_id=1, user_id=2)
+        self.cart_manager.put_in_cart(product_id=1, user_id=2)
+
+
+class UnixSocketTransportTestCase(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps({"path": self.path}).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.socket_path = os.path.join(directory.name, "cart_manager.sock")
+        self.server = ThreadingUnixStreamServer(self.socket_path, Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    async def test_both_clients_reach_cart_manager_on_unix_socket(self):
+        # given
+        client = CartManagerClient(unix_socket_path=self.socket_path)
+        self.addCleanup(client.close)
+        async_client = AsyncCartManagerClient(unix_socket_path=self.socket_path)
+
+        # when
+        response = client.request("get_cart", "GET", "http://localhost/cart/1")
+        async_response = await async_client.request(
+            "get_cart", "GET", "http://localhost/cart/2"
+        )
+        await async_client.close()
+
+        # then
+        self.assertEqual({"path": "/cart/1"}, response.json())
+        self.assertEqual({"path": "/cart/2"}, async_response.json())
+
+
+class ScriptedRestCartManager(RestCartManager):
+    """Answers availability polls of every shard with the changes or errors
+    scripted for it, and with no changes once the script runs out."""
+
+    def __init__(self, changes_by_shard_url: dict[str, list]) -> None:
+        super().__init__(
+            manager_url="http://a",
+            manager_access_key="",
+            shard_urls=list(changes_by_shard_url),
+        )
+        self.changes_by_shard_url = changes_by_shard_url
+        self.polled_versions_by_shard_url: dict[str, list[int | None]] = {
+            shard_url: [] for shard_url in changes_by_shard_url
+        }
+
+    def poll_availability_changes(
+        self, shard_url: str, since: int | None, timeout_in_seconds: float
+    ) -> RestAvailabilityChanges:
+        self.polled_versions_by_shard_url[shard_url].append(since)
+        script = self.changes_by_shard_url[shard_url]
+        if not script:
+            time.sleep(0.01)
+            return RestAvailabilityChanges(
+                version=since or 0, complete=False, total_count_by_product_id={}
+            )
+        changes = script.pop(0)
+        if isinstance(changes, Exception):
+            raise changes
+        return changes
+
+
+class AvailabilityMirrorTestCase(TestCase):
+    def wait_until(self, condition) -> None:
+        deadline = time.monotonic() + 2
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("condition not met in time")
+            time.sleep(0.005)
+
+    def test_counts_of_all_shards_are_summed_up(self):
+        # given
+        cart_manager = ScriptedRestCartManager(
+            {
+                "http://a": [_complete_changes(1, {1: 2, 2: 1})],
+                "http://b": [_complete_changes(4, {1: 3})],
+            }
+        )
+        mirror = AvailabilityMirror(cart_manager)
+        self.addCleanup(mirror.close)
+
+        # when
+        mirror.start()
+        self.wait_until(lambda: mirror.is_synchronized)
+
+        # then
+        self.assertEqual({1: 5, 2: 1}, dict(mirror.get_current_product_counts()))
+        self.wait_until(
+            lambda: 4 in cart_manager.polled_versions_by_shard_url["http://b"]
+        )
+
+    def test_complete_changes_remove_products_missing_from_shard(self):
+        # given
+        mirror = AvailabilityMirror(
+            ScriptedRestCartManager({"http://a": [], "http://b": []})
+        )
+        mirror._apply(0, {1: 2, 2: 1}, complete=True)
+        mirror._apply(1, {1: 3, 3: 4}, complete=True)
+
+        # when
+        mirror._apply(0, {2: 5}, complete=False)
+        mirror._apply(1, {1: 1}, complete=True)
+
+        # then
+        self.assertEqual({1: 3, 2: 5}, dict(mirror.get_current_product_counts()))
+
+    def test_poll_error_desynchronizes_mirror(self):
+        # given
+        cart_manager = ScriptedRestCartManager(
+            {
+                "http://a": [
+                    _complete_changes(1, {1: 2}),
+                    ConnectionError("cart manager is down"),
+                ],
+            }
+        )
+        mirror = AvailabilityMirror(cart_manager, retry_interval_in_seconds=60)
+        self.addCleanup(mirror.close)
+
+        # when
+        mirror.start()
+
+        # then
+        self.wait_until(
+            lambda: len(cart_manager.polled_versions_by_shard_url["http://a"]) == 2
+        )
+        self.wait_until(lambda: not mirror.is_synchronized)
+        self.assertEqual([None, 1], cart_manager.polled_versions_by_shard_url["http://a"])
+
+    def test_poll_after_error_asks_for_all_counts_again(self):
+        # given
+        cart_manager = ScriptedRestCartManager(
+            {
+                "http://a": [
+                    _complete_changes(1, {1: 2}),
+                    ConnectionError("cart manager is down"),
+                    _complete_changes(3, {2: 1}),
+                ],
+            }
+        )
+        mirror = AvailabilityMirror(cart_manager, retry_interval_in_seconds=0.01)
+        self.addCleanup(mirror.close)
+
+        # when
+        mirror.start()
+
+        # then
+        self.wait_until(
+            lambda: len(cart_manager.polled_versions_by_shard_url["http://a"]) >= 4
+        )
+        self.assertTrue(mirror.is_synchronized)
+        self.assertEqual(
+            [None, 1, None, 3], cart_manager.polled_versions_by_shard_url["http://a"][:4]
+        )
+        self.assertEqual({2: 1}, dict(mirror.get_current_product_counts()))
+
+
+class SharedAvailabilityCountersTestCase(TestCase):
+    def setUp(self) -> None:
+        self.counters = SharedAvailabilityCounters(f"zwpa-test-{os.getpid()}", capacity=2)
+        self.counters.create()
+        self.addCleanup(self.counters.close)
+        self.store = CartStore()
+        self.store.on_product_change = lambda product: self.counters.publish(
+            product.product_id, product.total_count, product.already_put
+        )
+
+    def test_readers_see_every_count_change_of_the_store(self):
+        # given
+        reader = SharedAvailabilityCountersReader(self.counters.name)
+        self.addCleanup(reader.close)
+        self.store.load(_dumped_state(total_count_by_product_id={1: 5, 2: 3}))
+
+        # when
+        self.store.modify_cart_entry(UserId(1), ProductId(1), increment_count, now=0.0)
+        self.store.reduce_total_count(ProductId(2), 1)
+
+        # then
+        self.assertEqual((5, 1), reader.read(1))
+        self.assertEqual((2, 0), reader.read(2))
+        self.assertIsNone(reader.read(3))
+
+    def test_segment_is_marked_overflowed_beyond_capacity(self):
+        # when
+        self.store.load(_dumped_state(total_count_by_product_id={1: 5, 2: 3, 3: 1}))
+
+        # then
+        reader = SharedAvailabilityCountersReader(self.counters.name)
+        self.addCleanup(reader.close)
+        self.assertEqual(OVERFLOWED, reader.state)
+
+    def test_counts_are_not_read_once_heartbeat_is_stale(self):
+        # given
+        self.store.load(_dumped_state(total_count_by_product_id={1: 5}))
+        availability = SharedMemoryAvailability(
+            [self.counters.name], max_heartbeat_age_in_seconds=0.05
+        )
+        self.addCleanup(availability.close)
+
+        # when
+        synchronized_while_beating = availability.is_synchronized
+        time.sleep(0.1)
+
+        # then
+        self.assertTrue(synchronized_while_beating)
+        self.assertEqual({1: 5}, dict(availability.get_current_product_counts()))
+        self.assertFalse(availability.is_synchronized)
+
+    def test_slot_left_mid_write_is_not_read_forever(self):
+        # given
+        self.store.load(_dumped_state(total_count_by_product_id={1: 5}))
+        reader = SharedAvailabilityCountersReader(self.counters.name, max_read_attempts=10)
+        self.addCleanup(reader.close)
+        availability = SharedMemoryAvailability([self.counters.name])
+        self.addCleanup(availability.close)
+        availability.start()
+
+        # when
+        # as if the cart manager died between the two sequence writes of `publish`
+        self.counters._memory.buf[HEADER_SIZE] = 1
+
+        # then
+        with self.assertRaises(TornSlotError):
+            reader.read(1)
+        with self.assertRaises(ProductCountsUnreadableException):
+            availability.get_current_product_counts()[1]
+
+
+def _dumped_state(total_count_by_product_id: dict[int, int]) -> dict:
+    return {
+        "state_by_product": {
+            str(product_id): {"product_id": product_id, "total_count": total_count}
+            for product_id, total_count in total_count_by_product_id.items()
+        }
+    }
+
+
+def _complete_changes(
+    version: int, total_count_by_product_id: dict[int, int]
+) -> RestAvailabilityChanges:
+    return RestAvailabilityChanges(
+        version=version,
+        complete=True,
+        total_count_by_product_id=total_count_by_product_id,
+    )
@@ -1,9 +1,35 @@
-from sqlalchemy import select
+import asyncio
+from contextvars import copy_context
+import os
+from unittest import TestCase
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from sqlalchemy import inspect, select, text
 from tests.fixtures import Fixtures
 from tests.test_case_with_database import TestCaseWithDatabase
+from zwpa.exceptions.InvalidSessionToken import InvalidSessionToken
+from zwpa.exceptions.LoginThrottled import LoginThrottled
+from zwpa.exceptions.PasswordHashingOverloaded import PasswordHashingOverloaded
 from zwpa.exceptions.UserLacksRoleException import UserLacksRoleException
-from zwpa.model import User, UserRole, UserRoleAssignment
+from zwpa.model import (
+    User,
+    UserAuthenticationLogRecord,
+    UserRole,
+    UserRoleAssignment,
+    mask_to_roles,
+)
 from zwpa.workflows.user.AuthenticateUserWorkflow import AuthenticateUserWorkflow
+from zwpa.workflows.user.BackfillUserRoleMaskWorkflow import (
+    BackfillUserRoleMaskWorkflow,
+)
+from zwpa.workflows.user.BufferedAuthenticationLogWriter import (
+    BufferedAuthenticationLogWriter,
+)
+from zwpa.workflows.user.BulkCreateUsersWorkflow import (
+    BulkCreateUsersWorkflow,
+    BulkUserFormat,
+    parse_bulk_user_rows,
+)
 from zwpa.workflows.user.CreateUserWorkflow import CreateUserWorkflow
 from zwpa.exceptions.UserAlreadyExistsException import UserAlreadyExistsException
 from zwpa.exceptions.UserDoesNotExist import UserDoesNotExist
@@ -12,7 +38,16 @@ from zwpa.exceptions.UserHasNoLoginAttemptsLeft import UserHasNoLoginAttemptsLef
 
 from zwpa.model import LOGIN_ATTEMPTS
 from zwpa.workflows.user.ListUserRolesWorkflow import ListUserRolesWorkflow, UserRolesView
+from zwpa.workflows.user.LoginThrottle import LoginThrottle
 from zwpa.workflows.user.ModifyUserRolesWorkflow import ModifyUserRolesWorkflow
+from zwpa.workflows.user.PasswordHashingExecutor import PasswordHashingExecutor
+from zwpa.workflows.user.PasswordHashingExecutorKind import PasswordHashingExecutorKind
+from zwpa.workflows.user.SessionTokenDenylist import SessionTokenDenylist
+from zwpa.workflows.user.SessionTokenService import SessionTokenService
+from zwpa.workflows.user.VerifiedCredentialCache import VerifiedCredentialCache
+from zwpa.workflows.utils.Principal import Principal, set_current_principal
+from zwpa.workflows.utils.RoleCache import RoleCache
+from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
 
 
 class UserTestCase(TestCaseWithDatabase):
@@ -147,6 +182,270 @@ class UserTestCase(TestCaseWithDatabase):
                 session_maker=self.session_maker
             ).authenticate_user(login=user_login, plain_text_password=user_password)
 
+    def test_repeated_authentication_is_served_from_credential_cache(self):
+        # given
+        user_login = "user"
+        user_password = "password123"
+        user_id = CreateUserWorkflow(session_maker=self.session_maker).create_user(
+            login=user_login, plain_text_password=user_password
+        )
+        credential_cache = VerifiedCredentialCache()
+        workflow = AuthenticateUserWorkflow(
+            session_maker=self.session_maker, credential_cache=credential_cache
+        )
+        workflow.authenticate_user(login=user_login, plain_text_password=user_password)
+
+        # when
+        result = workflow.authenticate_user(
+            login=user_login, plain_text_password=user_password
+        )
+
+        # then
+        self.assertEqual(user_id, result.user_id)
+        self.assertEqual(1, credential_cache.stats().hits)
+        self.assertEqual(1, credential_cache.stats().misses)
+
+    def test_failed_authentication_invalidates_credential_cache(self):
+        # given
+        user_login = "user"
+        user_password = "password123"
+        CreateUserWorkflow(session_maker=self.session_maker).create_user(
+            login=user_login, plain_text_password=user_password
+        )
+        credential_cache = VerifiedCredentialCache()
+        workflow = AuthenticateUserWorkflow(
+            session_maker=self.session_maker, credential_cache=credential_cache
+        )
+        workflow.authenticate_user(login=user_login, plain_text_password=user_password)
+
+        # when
+        with self.assertRaises(UserHasDifferentPassword):
+            workflow.authenticate_user(
+                login=user_login, plain_text_password="otherpassword"
+            )
+
+        # then
+        self.assertIsNone(
+            credential_cache.get_user_id(user_login, plain_text_password=user_password)
+        )
+
+    def test_buffered_authentication_log_is_drained_on_close(self):
+        # given
+        user_login = "user"
+        user_password = "password123"
+        CreateUserWorkflow(session_maker=self.session_maker).create_user(
+            login=user_login, plain_text_password=user_password
+        )
+        authentication_log_writer = BufferedAuthenticationLogWriter(
+            self.session_maker, flush_interval_in_seconds=60.0
+        )
+        authentication_log_writer.start()
+        workflow = AuthenticateUserWorkflow(
+            session_maker=self.session_maker,
+            authentication_log_writer=authentication_log_writer,
+        )
+        workflow.authenticate_user(login=user_login, plain_text_password=user_password)
+        with self.assertRaises(UserHasDifferentPassword):
+            workflow.authenticate_user(
+                login=user_login, plain_text_password="otherpassword"
+            )
+
+        # when
+        authentication_log_writer.close()
+
+        # then
+        with self.session_maker() as session:
+            records = session.scalars(select(UserAuthenticationLogRecord)).all()
+        self.assertCountEqual(
+            [True, False], [record.authenticated for record in records]
+        )
+
+    def test_buffered_authentication_log_retries_batch_that_failed_to_insert(self):
+        # given
+        session_maker_calls = []
+
+        def flaky_session_maker():
+            session_maker_calls.append(None)
+            if len(session_maker_calls) == 1:
+                raise ConnectionError("database is restarting")
+            return self.session_maker()
+
+        authentication_log_writer = BufferedAuthenticationLogWriter(
+            flaky_session_maker, flush_retry_backoff_in_seconds=0
+        )
+
+        # when
+        authentication_log_writer.write("user", authenticated=True)
+
+        # then
+        with self.session_maker() as session:
+            records = session.scalars(select(UserAuthenticationLogRecord)).all()
+        self.assertEqual(["user"], [record.login for record in records])
+        self.assertEqual(1, authentication_log_writer.flushed_records)
+        self.assertEqual(0, authentication_log_writer.dropped_records)
+
+    def test_user_can_authenticate_asynchronously(self):
+        # given
+        user_login = "user"
+        user_password = "password123"
+        password_hashing_executor = PasswordHashingExecutor(max_workers=1)
+        self.addCleanup(password_hashing_executor.shutdown)
+        user_id = asyncio.run(
+            CreateUserWorkflow(
+                session_maker=self.session_maker,
+                password_hashing_executor=password_hashing_executor,
+            ).create_user_async(login=user_login, plain_text_password=user_password)
+        )
+
+        # when
+        result = asyncio.run(
+            AuthenticateUserWorkflow(
+                session_maker=self.session_maker,
+                password_hashing_executor=password_hashing_executor,
+            ).authenticate_user_async(
+                login=user_login, plain_text_password=user_password
+            )
+        )
+
+        # then
+        self.assertTrue(result.authenticated)
+        self.assertEqual(user_id, result.user_id)
+
+    def test_overloaded_password_hashing_executor_rejects_work(self):
+        # given
+        password_hashing_executor = PasswordHashingExecutor(
+            max_workers=1, max_queue_size=0
+        )
+        self.addCleanup(password_hashing_executor.shutdown)
+
+        async def hash_burst():
+            return await asyncio.gather(
+                password_hashing_executor.hash_password_async("password123"),
+                password_hashing_executor.hash_password_async("password123"),
+                return_exceptions=True,
+            )
+
+        # when
+        results = asyncio.run(hash_burst())
+
+        # then
+        self.assertIsInstance(results[1], PasswordHashingOverloaded)
+
+    def test_bulk_password_hashing_does_not_overload_shared_executor(self):
+        # given
+        password_hashing_executor = PasswordHashingExecutor(
+            max_workers=2, max_queue_size=0
+        )
+        self.addCleanup(password_hashing_executor.shutdown)
+
+        # when
+        hashed_passwords = password_hashing_executor.hash_passwords(
+            ["password1", "password2", "password3"]
+        )
+
+        # then
+        self.assertEqual(3, len(hashed_passwords))
+        self.assertTrue(
+            password_hashing_executor.passwords_match("password3", hashed_passwords[2])
+        )
+        self.assertEqual(0, password_hashing_executor.rejected_count)
+
+    def test_throttled_login_is_rejected_before_reading_database(self):
+        # given
+        authenticate_user_workflow = AuthenticateUserWorkflow(
+            session_maker=self.session_maker,
+            login_throttle=LoginThrottle(
+                login_capacity=2, login_refill_per_second=0.001
+            ),
+        )
+        for _ in range(2):
+            with self.assertRaises(UserDoesNotExist):
+                authenticate_user_workflow.authenticate_user(
+                    login="user", plain_text_password="password123"
+                )
+
+        # when / then
+        with self.assertRaises(LoginThrottled):
+            authenticate_user_workflow.authenticate_user(
+                login="user", plain_text_password="password123"
+            )
+        with self.session_maker() as session:
+            log_records = session.scalars(select(UserAuthenticationLogRecord)).all()
+        self.assertEqual(2, len(log_records))
+
+    def test_login_throttle_limits_failures_per_client_address(self):
+        # given
+        now = [0.0]
+        login_throttle = LoginThrottle(
+            client_capacity=2, client_refill_per_second=1.0, clock=lambda: now[0]
+        )
+        login_throttle.record_failure("user_1", client_address="10.0.0.1")
+        login_throttle.record_failure("user_2", client_address="10.0.0.1")
+
+        # when / then
+        with self.assertRaises(LoginThrottled):
+            login_throttle.check("user_3", client_address="10.0.0.1")
+        login_throttle.check("user_3", client_address="10.0.0.2")
+        now[0] = 1.0
+        login_throttle.check("user_3", client_address="10.0.0.1")
+
+    def test_login_throttle_that_would_never_refill_is_rejected(self):
+        # when / then
+        with self.assertRaises(ValueError):
+            LoginThrottle(login_refill_per_second=0)
+        with self.assertRaises(ValueError):
+            LoginThrottle(client_refill_per_second=-1.0)
+
+    def test_role_checks_read_roles_of_current_principal(self):
+        # given
+        with self.session_maker() as session:
+            user_id = Fixtures.new_user_with_roles(
+                session, roles=[UserRole.CLIENT]
+            ).id
+            session.commit()
+        user_role_checker = UserRoleChecker(self.session_maker)
+
+        def check_roles_as_principal() -> bool:
+            set_current_principal(
+                Principal(user_id=user_id, roles=frozenset([UserRole.CLERK]))
+            )
+            return user_role_checker.is_user_of_role(user_id, role=UserRole.CLERK)
+
+        # when
+        principal_result = copy_context().run(check_roles_as_principal)
+        database_result = user_role_checker.is_user_of_role(
+            user_id, role=UserRole.CLERK
+        )
+
+        # then
+        self.assertTrue(principal_result)
+        self.assertFalse(database_result)
+
+    def test_role_modification_invalidates_role_caches_of_other_processes(self):
+        # given
+        with self.session_maker() as session:
+            user_id = Fixtures.new_user(session).id
+            session.commit()
+        other_process_role_checker = UserRoleChecker(
+            self.session_maker,
+            role_cache=RoleCache(
+                self.session_maker, version_check_interval_in_seconds=0.0
+            ),
+        )
+        self.assertFalse(
+            other_process_role_checker.is_user_of_role(user_id, role=UserRole.CLERK)
+        )
+
+        # when
+        ModifyUserRolesWorkflow(
+            self.session_maker, role_cache=RoleCache(self.session_maker)
+        ).modify_user_roles(user_id, roles=[UserRole.CLERK])
+
+        # then
+        self.assertTrue(
+            other_process_role_checker.is_user_of_role(user_id, role=UserRole.CLERK)
+        )
+
     def test_admin_can_modify_user_roles(self):
         # given
         with self.session_maker(expire_on_commit=False) as session:
@@ -234,3 +533,275 @@ class UserTestCase(TestCaseWithDatabase):
 
         # then
         self.assertEqual(expected, result)
+
+
+    def test_admin_can_list_users_of_role(self):
+        # given
+        with self.session_maker(expire_on_commit=False) as session:
+            caller = Fixtures.new_user(session, id=1, login="admin")
+            user_1 = Fixtures.new_user(session, id=2, login="clerk")
+            Fixtures.new_user(session, id=3, login="client")
+            session.commit()
+            Fixtures.new_role_assignment(
+                session, role=UserRole.ADMIN, user_id=caller.id
+            )
+            Fixtures.new_role_assignment(
+                session, role=UserRole.CLERK, user_id=user_1.id
+            )
+            session.commit()
+
+        # when
+        result = ListUserRolesWorkflow(self.session_maker).list_user_roles_workflow(
+            caller.id, role=UserRole.CLERK
+        )
+
+        # then
+        self.assertEqual([UserRolesView(id=2, is_clerk=True, login="clerk")], result)
+
+    def test_backfill_recomputes_role_masks_from_role_assignments(self):
+        # given
+        with self.session_maker(expire_on_commit=False) as session:
+            user = Fixtures.new_user(session)
+            session.commit()
+            session.add_all(
+                [
+                    UserRoleAssignment(role=UserRole.CLERK, user_id=user.id),
+                    UserRoleAssignment(role=UserRole.SUPPLIER, user_id=user.id),
+                ]
+            )
+            session.commit()
+
+        # when
+        BackfillUserRoleMaskWorkflow(self.session_maker).backfill()
+
+        # then
+        with self.session_maker() as session:
+            role_mask = session.execute(
+                select(User.role_mask).where(User.id == user.id)
+            ).scalar_one()
+        self.assertEqual(
+            frozenset([UserRole.CLERK, UserRole.SUPPLIER]), mask_to_roles(role_mask)
+        )
+        self.assertEqual(
+            frozenset([UserRole.CLERK, UserRole.SUPPLIER]),
+            UserRoleChecker(self.session_maker).get_user_roles(user.id),
+        )
+
+    def test_backfill_drops_index_on_whole_role_mask(self):
+        # given
+        with self.engine.begin() as connection:
+            connection.execute(
+                text("CREATE INDEX IF NOT EXISTS ix_users_role_mask ON users (role_mask)")
+            )
+
+        # when
+        BackfillUserRoleMaskWorkflow(self.session_maker).backfill()
+
+        # then
+        index_names = [index["name"] for index in inspect(self.engine).get_indexes("users")]
+        self.assertNotIn("ix_users_role_mask", index_names)
+
+    def test_bulk_user_import_reports_failed_rows_and_creates_the_rest(self):
+        # given
+        with self.session_maker() as session:
+            Fixtures.new_user(session, login="existing")
+            session.commit()
+        rows, parsing_failures = parse_bulk_user_rows(
+            "login,password,roles\n"
+            "carrier_1,password123,TRANSPORT\n"
+            "existing,password123,\n"
+            "carrier_2,password123,TRANSPORT;CLIENT\n"
+            "carrier_1,password123,\n"
+            "carrier_3,password123,DRIVER\n",
+            format=BulkUserFormat.CSV,
+        )
+
+        # when
+        result = BulkCreateUsersWorkflow(
+            self.session_maker,
+            hashing_workers=2,
+            hashing_executor_kind=PasswordHashingExecutorKind.THREAD,
+            batch_size=1,
+        ).create_users(rows)
+
+        # then
+        self.assertEqual([5], [failure.row_number for failure in parsing_failures])
+        self.assertEqual([2, 4], [failure.row_number for failure in result.failures])
+        self.assertEqual(
+            ["carrier_1", "carrier_2"], [created.login for created in result.created]
+        )
+        carrier_2_id = result.created[1].user_id
+        self.assertEqual(
+            frozenset([UserRole.TRANSPORT, UserRole.CLIENT]),
+            UserRoleChecker(self.session_maker).get_user_roles(carrier_2_id),
+        )
+        self.assertTrue(
+            AuthenticateUserWorkflow(self.session_maker)
+            .authenticate_user("carrier_2", "password123")
+            .authenticated
+        )
+
+
+class SessionTokenTestCase(TestCase):
+    def test_issued_session_token_can_be_verified(self):
+        # given
+        service = SessionTokenService(secret=b"secret")
+        token, _ = service.issue(1, roles=frozenset([UserRole.CLIENT]))
+
+        # when
+        session_token = service.verify(token)
+
+        # then
+        self.assertEqual(1, session_token.user_id)
+        self.assertEqual(frozenset([UserRole.CLIENT]), session_token.roles)
+
+    def test_tampered_session_token_is_rejected(self):
+        # given
+        service = SessionTokenService(secret=b"secret")
+        token, _ = service.issue(1, roles=frozenset([UserRole.CLIENT]))
+        _, signature = token.split(".")
+        forged_token, _ = SessionTokenService(secret=b"other").issue(
+            1, roles=frozenset(UserRole)
+        )
+
+        # when / then
+        with self.assertRaises(InvalidSessionToken):
+            service.verify(f"{forged_token.split('.')[0]}.{signature}")
+
+    def test_session_token_with_non_ascii_characters_is_rejected(self):
+        # given
+        service = SessionTokenService(secret=b"secret")
+
+        # when / then
+        for token in ("é.abc", "abc.é"):
+            with self.assertRaises(InvalidSessionToken):
+                service.verify(token)
+
+    def test_expired_session_token_is_rejected(self):
+        # given
+        now = [1000.0]
+        service = SessionTokenService(
+            secret=b"secret", ttl_in_seconds=60.0, clock=lambda: now[0]
+        )
+        token, _ = service.issue(1, roles=frozenset())
+        now[0] += 61.0
+
+        # when / then
+        with self.assertRaises(InvalidSessionToken):
+            service.verify(token)
+
+    def test_revoked_user_session_tokens_are_denied(self):
+        # given
+        service = SessionTokenService(secret=b"secret")
+        denylist = SessionTokenDenylist()
+        _, session_token = service.issue(1, roles=frozenset())
+
+        # when
+        denylist.revoke_user(1)
+
+        # then
+        self.assertTrue(denylist.is_revoked(session_token))
+
+
+class ProtectedRouteTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.environment = patch.dict(
+            os.environ,
+            {
+                "ZWPA_DATABASE_HOST": "localhost",
+                "ZWPA_DATABASE_PORT": "5432",
+                "ZWPA_DATABASE_DATABASE": "zwpa",
+                "ZWPA_DATABASE_LOGIN": "zwpa",
+                "ZWPA_DATABASE_PASSWORD": "zwpa",
+                "ZWPA_CART_MANAGER_HOST": "localhost",
+                "ZWPA_CART_MANAGER_PORT": "8000",
+                "ZWPA_CART_MANAGER_ACCESS_KEY": "test",
+                "ZWPA_SESSION_TOKEN_SECRET": "test",
+                "ZWPA_ADMIN_LOGIN": "admin",
+                "ZWPA_ADMIN_PASSWORD": "admin",
+            },
+        )
+        cls.environment.start()
+        from fastapi import Depends, FastAPI
+        from zwpa.routers import shared, user
+
+        app = FastAPI()
+        app.include_router(user.router)
+
+        @app.get("/me")
+        async def me(user_id: int = Depends(shared.get_current_user_id)) -> int:
+            return user_id
+
+        cls.shared = shared
+        cls.app = app
+        cls.client = TestClient(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.environment.stop()
+
+    def test_protected_route_accepts_bearer_session_token(self):
+        # given
+        token, _ = self.shared.session_token_service.issue(7, roles=frozenset())
+
+        # when
+        response = self.client.get("/me", headers={"Authorization": f"Bearer {token}"})
+
+        # then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(7, response.json())
+
+    def test_protected_route_accepts_session_token_cookie(self):
+        # given
+        token, _ = self.shared.session_token_service.issue(7, roles=frozenset())
+
+        client = TestClient(
+            self.app, cookies={self.shared.SESSION_TOKEN_COOKIE: token}
+        )
+
+        # when
+        response = client.get("/me")
+
+        # then
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(7, response.json())
+
+    def test_protected_route_rejects_invalid_session_token(self):
+        # given
+        token, _ = SessionTokenService(secret=b"other").issue(7, roles=frozenset())
+
+        # when
+        response = self.client.get("/me", headers={"Authorization": f"Bearer {token}"})
+
+        # then
+        self.assertEqual(401, response.status_code)
+
+    def test_protected_route_rejects_revoked_session_token(self):
+        # given
+        token, session_token = self.shared.session_token_service.issue(
+            8, roles=frozenset()
+        )
+        self.shared.session_token_denylist.revoke(session_token)
+
+        # when
+        response = self.client.get("/me", headers={"Authorization": f"Bearer {token}"})
+
+        # then
+        self.assertEqual(401, response.status_code)
+
+    def test_bulk_import_with_body_that_is_not_utf8_is_rejected(self):
+        # given
+        token, _ = self.shared.session_token_service.issue(
+            1, roles=frozenset([UserRole.ADMIN])
+        )
+
+        # when
+        response = self.client.post(
+            "/user/bulk",
+            headers={"Authorization": f"Bearer {token}"},
+            content=b"login,password,roles\n\xff,password123,\n",
+        )
+
+        # then
+        self.assertEqual(400, response.status_code)
@@ -1,5 +1,12 @@
 import os
-from pydantic import BaseModel
+import tempfile
+from pydantic import BaseModel, Field
+
+from zwpa.workflows.retail.CartManagerKind import CartManagerKind
+from zwpa.workflows.user.AuthenticationLogOverflowPolicy import (
+    AuthenticationLogOverflowPolicy,
+)
+from zwpa.workflows.user.PasswordHashingExecutorKind import PasswordHashingExecutorKind
 
 
 class DatabaseConfig(BaseModel):
@@ -21,20 +28,171 @@ class DatabaseConfig(BaseModel):
 
 
 class CartManagerConfig(BaseModel):
-    host: str
-    port: int
-    access_key: str
+    kind: CartManagerKind = CartManagerKind.REST
+    host: str = "localhost"
+    port: int = 8050
+    access_key: str = ""
+    unix_socket_path: str | None = None
+    session_expiration_time_in_seconds: float = 900.0
+    lock_path: str | None = None
+    shard_urls: list[str] = []
+    availability_poll_timeout_in_seconds: float = 25.0
+    shared_memory_names: list[str] = []
+    pool_size: int = 10
+    connect_timeout_in_seconds: float = 1.0
+    read_timeout_in_seconds: float = 5.0
+    max_retries: int = 2
+    retry_backoff_in_seconds: float = 0.05
 
     @property
     def url(self) -> str:
+        if self.unix_socket_path is not None:
+            # the host is only sent in the Host header, the socket is what connects
+            return "http://localhost"
         return f"http://{self.host}:{self.port}"
 
     @staticmethod
     def from_environmental_variables():
+        kind = CartManagerKind(os.environ.get("ZWPA_CART_MANAGER_KIND", "REST"))
+        if kind is CartManagerKind.IN_PROCESS:
+            # carts are kept by the main server itself, there is nothing to connect to
+            return CartManagerConfig(
+                kind=kind,
+                session_expiration_time_in_seconds=float(
+                    os.environ.get(
+                        "ZWPA_CART_MANAGER_SESSION_EXPIRATION_TIME_IN_SECONDS", "900"
+                    )
+                ),
+                lock_path=os.environ.get(
+                    "ZWPA_CART_MANAGER_LOCK_PATH",
+                    os.path.join(tempfile.gettempdir(), "zwpa-cart-manager.lock"),
+                ),
+                availability_poll_timeout_in_seconds=0,
+            )
+        unix_socket_path = os.environ.get("ZWPA_CART_MANAGER_UNIX_SOCKET_PATH")
+        address = (
+            dict(
+                host=os.environ["ZWPA_CART_MANAGER_HOST"],
+                port=int(os.environ["ZWPA_CART_MANAGER_PORT"]),
+            )
+            if unix_socket_path is None
+            else dict(unix_socket_path=unix_socket_path)
+        )
         return CartManagerConfig(
-            host=os.environ["ZWPA_CART_MANAGER_HOST"],
-            port=int(os.environ["ZWPA_CART_MANAGER_PORT"]),
+            kind=kind,
+            **address,
             access_key=os.environ["ZWPA_CART_MANAGER_ACCESS_KEY"],
+            shard_urls=[
+                url.strip()
+                for url in os.environ.get("ZWPA_CART_MANAGER_SHARD_URLS", "").split(",")
+                if url.strip()
+            ],
+            availability_poll_timeout_in_seconds=float(
+                os.environ.get("ZWPA_CART_MANAGER_AVAILABILITY_POLL_TIMEOUT_IN_SECONDS", "25")
+            ),
+            shared_memory_names=[
+                name.strip()
+                for name in os.environ.get(
+                    "ZWPA_CART_MANAGER_SHARED_MEMORY_NAMES", ""
+                ).split(",")
+                if name.strip()
+            ],
+            pool_size=int(os.environ.get("ZWPA_CART_MANAGER_POOL_SIZE", "10")),
+            connect_timeout_in_seconds=float(
+                os.environ.get("ZWPA_CART_MANAGER_CONNECT_TIMEOUT_IN_SECONDS", "1")
+            ),
+            read_timeout_in_seconds=float(
+                os.environ.get("ZWPA_CART_MANAGER_READ_TIMEOUT_IN_SECONDS", "5")
+            ),
+            max_retries=int(os.environ.get("ZWPA_CART_MANAGER_MAX_RETRIES", "2")),
+            retry_backoff_in_seconds=float(
+                os.environ.get("ZWPA_CART_MANAGER_RETRY_BACKOFF_IN_SECONDS", "0.05")
+            ),
+        )
+
+
+class AuthenticationConfig(BaseModel):
+    credential_cache_size: int = 1024
+    credential_cache_ttl_in_seconds: float = 60.0
+    audit_log_batch_size: int = 500
+    audit_log_flush_interval_in_seconds: float = 1.0
+    audit_log_queue_size: int = 10_000
+    audit_log_overflow_policy: AuthenticationLogOverflowPolicy = (
+        AuthenticationLogOverflowPolicy.DROP_NEWEST
+    )
+    audit_log_flush_attempts: int = Field(default=3, gt=0)
+    password_hashing_workers: int = 4
+    password_hashing_queue_size: int = 64
+    password_hashing_executor_kind: PasswordHashingExecutorKind = (
+        PasswordHashingExecutorKind.THREAD
+    )
+    session_token_secret: str
+    session_token_ttl_in_seconds: float = 900.0
+    role_cache_size: int = 100_000
+    role_cache_version_check_interval_in_seconds: float = 1.0
+    login_throttle_login_capacity: float = 5
+    login_throttle_login_refill_per_second: float = Field(default=0.1, gt=0)
+    login_throttle_client_capacity: float = 20
+    login_throttle_client_refill_per_second: float = Field(default=1.0, gt=0)
+    login_throttle_max_tracked_keys: int = 100_000
+
+    @staticmethod
+    def from_environmental_variables():
+        return AuthenticationConfig(
+            credential_cache_size=int(
+                os.environ.get("ZWPA_CREDENTIAL_CACHE_SIZE", "1024")
+            ),
+            credential_cache_ttl_in_seconds=float(
+                os.environ.get("ZWPA_CREDENTIAL_CACHE_TTL_IN_SECONDS", "60")
+            ),
+            audit_log_batch_size=int(
+                os.environ.get("ZWPA_AUDIT_LOG_BATCH_SIZE", "500")
+            ),
+            audit_log_flush_interval_in_seconds=float(
+                os.environ.get("ZWPA_AUDIT_LOG_FLUSH_INTERVAL_IN_SECONDS", "1")
+            ),
+            audit_log_queue_size=int(
+                os.environ.get("ZWPA_AUDIT_LOG_QUEUE_SIZE", "10000")
+            ),
+            audit_log_overflow_policy=AuthenticationLogOverflowPolicy(
+                os.environ.get("ZWPA_AUDIT_LOG_OVERFLOW_POLICY", "DROP_NEWEST")
+            ),
+            audit_log_flush_attempts=int(
+                os.environ.get("ZWPA_AUDIT_LOG_FLUSH_ATTEMPTS", "3")
+            ),
+            password_hashing_workers=int(
+                os.environ.get("ZWPA_PASSWORD_HASHING_WORKERS", "4")
+            ),
+            password_hashing_queue_size=int(
+                os.environ.get("ZWPA_PASSWORD_HASHING_QUEUE_SIZE", "64")
+            ),
+            password_hashing_executor_kind=PasswordHashingExecutorKind(
+                os.environ.get("ZWPA_PASSWORD_HASHING_EXECUTOR_KIND", "THREAD")
+            ),
+            # shared by every server process, each must verify tokens the others issued
+            session_token_secret=os.environ["ZWPA_SESSION_TOKEN_SECRET"],
+            session_token_ttl_in_seconds=float(
+                os.environ.get("ZWPA_SESSION_TOKEN_TTL_IN_SECONDS", "900")
+            ),
+            role_cache_size=int(os.environ.get("ZWPA_ROLE_CACHE_SIZE", "100000")),
+            role_cache_version_check_interval_in_seconds=float(
+                os.environ.get("ZWPA_ROLE_CACHE_VERSION_CHECK_INTERVAL_IN_SECONDS", "1")
+            ),
+            login_throttle_login_capacity=float(
+                os.environ.get("ZWPA_LOGIN_THROTTLE_LOGIN_CAPACITY", "5")
+            ),
+            login_throttle_login_refill_per_second=float(
+                os.environ.get("ZWPA_LOGIN_THROTTLE_LOGIN_REFILL_PER_SECOND", "0.1")
+            ),
+            login_throttle_client_capacity=float(
+                os.environ.get("ZWPA_LOGIN_THROTTLE_CLIENT_CAPACITY", "20")
+            ),
+            login_throttle_client_refill_per_second=float(
+                os.environ.get("ZWPA_LOGIN_THROTTLE_CLIENT_REFILL_PER_SECOND", "1")
+            ),
+            login_throttle_max_tracked_keys=int(
+                os.environ.get("ZWPA_LOGIN_THROTTLE_MAX_TRACKED_KEYS", "100000")
+            ),
         )
 
 
@@ -43,6 +201,7 @@ class Config(BaseModel):
     admin_password: str
     database: DatabaseConfig
     cart_manager_config: CartManagerConfig
+    authentication_config: AuthenticationConfig
     min_days_to_proceed: int = 5
 
     @staticmethod
@@ -52,4 +211,5 @@ class Config(BaseModel):
             admin_password=os.environ["ZWPA_ADMIN_PASSWORD"],
             database=DatabaseConfig.from_environmental_variables(),
             cart_manager_config=CartManagerConfig.from_environmental_variables(),
+            authentication_config=AuthenticationConfig.from_environmental_variables(),
         )
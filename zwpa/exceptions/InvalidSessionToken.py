@@ -0,0 +1,4 @@
+class InvalidSessionToken(Exception):
+    def __init__(self, reason: str) -> None:
+        self.reason = reason
+        super().__init__(f"Invalid session token ({reason=})")
@@ -0,0 +1,5 @@
+class LoginThrottled(Exception):
+    def __init__(self, key: str, retry_after_in_seconds: float) -> None:
+        self.key = key
+        self.retry_after_in_seconds = retry_after_in_seconds
+        super().__init__(f"Too many failed logins for {key}, retry after {retry_after_in_seconds:.1f}s")
@@ -0,0 +1,4 @@
+class PasswordHashingOverloaded(Exception):
+    def __init__(self, pending_count: int) -> None:
+        self.pending_count = pending_count
+        super().__init__(f"Password hashing executor overloaded ({pending_count=})")
@@ -0,0 +1,76 @@
+"""Creates users listed in a CSV or NDJSON file.
+
+    python -m zwpa.import_users partners.csv
+    python -m zwpa.import_users partners.ndjson --format NDJSON
+
+CSV files need a `login,password,roles` header, with roles separated by `;`.
+NDJSON lines are objects with `login`, `password` and a `roles` list.
+"""
+import argparse
+import sys
+
+from sqlalchemy import URL, create_engine
+from sqlalchemy.orm import sessionmaker
+
+from zwpa.config import DatabaseConfig
+from zwpa.workflows.user.BulkCreateUsersWorkflow import (
+    BulkCreateUsersWorkflow,
+    BulkUserFormat,
+    parse_bulk_user_rows,
+)
+from zwpa.workflows.user.PasswordHashingExecutor import PasswordHashingExecutor
+from zwpa.workflows.user.PasswordHashingExecutorKind import PasswordHashingExecutorKind
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--format", type=BulkUserFormat, choices=list(BulkUserFormat))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    format = args.format or (
+        BulkUserFormat.NDJSON
+        if args.path.endswith((".ndjson", ".jsonl"))
+        else BulkUserFormat.CSV
+    )
+    with open(args.path, encoding="utf-8") as file:
+        rows, failures = parse_bulk_user_rows(file.read(), format=format)
+
+    # only the database is needed, not the rest of the web app setup
+    database_config = DatabaseConfig.from_environmental_variables()
+    engine = create_engine(
+        URL.create(
+            "postgresql",
+            username=database_config.login,
+            password=database_config.password,
+            host=database_config.host,
+            database=database_config.database,
+            port=database_config.port,
+        )
+    )
+    password_hashing_executor = PasswordHashingExecutor(
+        max_workers=args.workers, kind=PasswordHashingExecutorKind.PROCESS
+    )
+    try:
+        result = BulkCreateUsersWorkflow(
+            sessionmaker(engine),
+            batch_size=args.batch_size,
+            password_hashing_executor=password_hashing_executor,
+        ).create_users(rows)
+    finally:
+        password_hashing_executor.shutdown()
+        engine.dispose()
+    failures = sorted(failures + result.failures, key=lambda failure: failure.row_number)
+
+    for created_user in result.created:
+        print(f"{created_user.row_number}: created {created_user.login} ({created_user.user_id})")
+    for failure in failures:
+        print(f"{failure.row_number}: failed {failure.login}: {failure.reason}", file=sys.stderr)
+    print(f"{len(result.created)} created, {len(failures)} failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,6 +8,9 @@ from zwpa.workflows.retail.InitializeCartManagerWorkflow import (
 )
 from zwpa.workflows.retail.RestCartManager import RestCartManager
 
+from zwpa.workflows.user.BackfillUserRoleMaskWorkflow import (
+    BackfillUserRoleMaskWorkflow,
+)
 from zwpa.workflows.user.CreateRootWorkflow import CreateRootWorkflow
 from zwpa.workflows.utils.SeedSystemWithData import SeedSystemWithDataWorkflow
 from .model import Base
@@ -17,7 +20,12 @@ from .routers.shared import (
     engine,
     templates,
     get_current_user_id,
-    rest_cart_manager,
+    cart_manager,
+    async_cart_manager,
+    in_process_cart_manager,
+    availability_mirror,
+    authentication_log_writer,
+    password_hashing_executor,
 )
 from .routers.user import (
     router as user_router,
@@ -39,18 +47,33 @@ create_root_workflow = CreateRootWorkflow(
     modify_user_roles_workflow=modify_user_roles_workflow,
 )
 seed_system_with_data_workflow = SeedSystemWithDataWorkflow(session_maker)
+backfill_user_role_mask_workflow = BackfillUserRoleMaskWorkflow(session_maker)
 initialize_cart_manager_workflow = InitializeCartManagerWorkflow(
-    session_maker, cart_manager=rest_cart_manager
+    session_maker, cart_manager=cart_manager
 )
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if in_process_cart_manager is not None:
+        # refuses to start next to another server process, before touching the database
+        in_process_cart_manager.start()
     Base.metadata.create_all(engine)
+    backfill_user_role_mask_workflow.backfill()
     create_root_workflow.create_root_user()
     seed_system_with_data_workflow.seed()
     initialize_cart_manager_workflow.initialize_cart_manager()
+    authentication_log_writer.start()
+    if availability_mirror is not None:
+        availability_mirror.start()
     yield
+    if availability_mirror is not None:
+        availability_mirror.close()
+    await async_cart_manager.close()
+    if in_process_cart_manager is not None:
+        in_process_cart_manager.close()
+    authentication_log_writer.close()
+    password_hashing_executor.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -11,6 +11,7 @@ from sqlalchemy import (
     Dialect,
     Float,
     ForeignKey,
+    Index,
     Integer,
     LargeBinary,
     MetaData,
@@ -19,9 +20,10 @@ from sqlalchemy import (
     Time,
     TypeDecorator,
 )
+from sqlalchemy.sql.expression import ColumnElement
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.dialects.postgresql import ENUM as pgEnum, MONEY
-from typing import Any, List, Optional
+from typing import Any, Iterable, List, Optional
 
 
 metadata = MetaData()
@@ -58,6 +60,7 @@ class User(Base):
     login: Mapped[str] = mapped_column(String, index=True)
     password: Mapped[McfHash] = mapped_column(LargeBinary)
     login_attempts_left: Mapped[int] = mapped_column(Integer)
+    role_mask: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
     permissions: Mapped[List["UserSectionPermissionRecord"]] = relationship(
         back_populates="user"
     )
@@ -170,6 +173,41 @@ class UserRole(str, Enum):
     TRANSPORT = "TRANSPORT"
 
 
+# Bits of `User.role_mask`; values are persisted, so never reorder them, only append
+USER_ROLE_BITS: dict[UserRole, int] = {
+    UserRole.ADMIN: 1 << 0,
+    UserRole.CLERK: 1 << 1,
+    UserRole.CLIENT: 1 << 2,
+    UserRole.SUPPLIER: 1 << 3,
+    UserRole.TRANSPORT: 1 << 4,
+}
+
+
+def roles_to_mask(roles: Iterable[UserRole]) -> int:
+    mask = 0
+    for role in roles:
+        mask |= USER_ROLE_BITS[role]
+    return mask
+
+
+def mask_to_roles(mask: int) -> frozenset[UserRole]:
+    return frozenset(role for role, bit in USER_ROLE_BITS.items() if mask & bit)
+
+
+def has_role_predicate(role: UserRole) -> ColumnElement[bool]:
+    return User.role_mask.op("&")(USER_ROLE_BITS[role]) != 0
+
+
+USER_ROLE_MASK_INDEXES = [
+    Index(
+        f"ix_users_with_role_{role.value.lower()}",
+        User.id,
+        postgresql_where=has_role_predicate(role),
+    )
+    for role in UserRole
+]
+
+
 UserRoleType: pgEnum = pgEnum(
     UserRole,
     name="user_role",
@@ -187,6 +225,13 @@ class UserRoleAssignment(Base):
     user: Mapped[User] = relationship(back_populates="roles")
 
 
+class UserRoleVersion(Base):
+    __tablename__ = "user_role_versions"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0)
+
+
 class UserSectionPermissionRecord(Base):
     __tablename__ = "user_section_permissions"
 
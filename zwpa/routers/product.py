@@ -9,14 +9,14 @@ from zwpa.workflows.product.HandleProductDetailsWorkflow import (
 from zwpa.workflows.product.ListProductsWorkflow import ListProductsWorkflow
 
 from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
-from .shared import get_current_user_id, session_maker, templates
+from .shared import get_current_user_id, role_cache, session_maker, templates
 
 
 router = APIRouter(
     prefix="/product",
     tags=["product"],
 )
-user_role_checker = UserRoleChecker(session_maker)
+user_role_checker = UserRoleChecker(session_maker, role_cache=role_cache)
 list_products_workflow = ListProductsWorkflow(session_maker)
 handle_product_details_workflow = HandleProductDetailsWorkflow(session_maker)
 
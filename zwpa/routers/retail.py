@@ -2,13 +2,18 @@ from dataclasses import asdict
 from decimal import Decimal
 from enum import Enum
 from typing import Annotated
-from fastapi import APIRouter, Depends, Form, Request
+from fastapi import APIRouter, Depends, Form, HTTPException, Request, status
 from fastapi.responses import RedirectResponse
 from zwpa.model import TransportStatus
 from zwpa.workflows.product.HandleProductDetailsWorkflow import (
     HandleProductDetailsWorkflow,
 )
 from zwpa.workflows.product.ListProductsWorkflow import ListProductsWorkflow
+from zwpa.workflows.retail.CartManager import (
+    InvalidCartChangeException,
+    NotEnoughProductCountAvailableException,
+    ProductNotFoundException,
+)
 from zwpa.workflows.retail.GetOrderViewsWorkflow import GetOrderViewsWorkflow
 from zwpa.workflows.retail.GetPersonalizedRetailProductViewsWorkflow import (
     GetPersonalizedRetailProductViewsWorkflow,
@@ -27,8 +32,11 @@ from .shared import (
     get_current_user_id,
     session_maker,
     templates,
-    rest_cart_manager,
+    cart_manager,
+    async_cart_manager,
+    availability_mirror,
     simple_retail_price_calculator,
+    role_cache,
 )
 
 
@@ -36,16 +44,23 @@ router = APIRouter(
     prefix="/retail",
     tags=["retail"],
 )
-user_role_checker = UserRoleChecker(session_maker)
+user_role_checker = UserRoleChecker(session_maker, role_cache=role_cache)
 list_products_workflow = ListProductsWorkflow(session_maker)
 handle_product_details_workflow = HandleProductDetailsWorkflow(session_maker)
 get_personalized_retail_product_views_workflow = (
-    GetPersonalizedRetailProductViewsWorkflow(session_maker, rest_cart_manager)
+    GetPersonalizedRetailProductViewsWorkflow(
+        session_maker,
+        cart_manager,
+        availability_mirror=availability_mirror,
+        async_cart_manager=async_cart_manager,
+    )
+)
+modify_car_workflow = ModifyCartWorkflow(
+    session_maker, cart_manager, async_cart_manager=async_cart_manager
 )
-modify_car_workflow = ModifyCartWorkflow(session_maker, rest_cart_manager)
 handle_checkout_workflow = HandleCheckoutWorkflow(
     session_maker,
-    cart_manager=rest_cart_manager,
+    cart_manager=cart_manager,
     retail_transport_price_calculator=simple_retail_price_calculator,
 )
 get_order_views_workflow = GetOrderViewsWorkflow(session_maker)
@@ -57,12 +72,12 @@ class RetailSection(str, Enum):
 
 
 @router.get("/")
-def get_product_list(
+async def get_product_list(
     request: Request,
     user_id: Annotated[int, Depends(get_current_user_id)],
     query: str = "",
 ):
-    products = get_personalized_retail_product_views_workflow.get_personalized_retail_product_views(
+    products = await get_personalized_retail_product_views_workflow.get_personalized_retail_product_views_async(
         user_id, query=query
     )
     return templates.TemplateResponse(
@@ -75,12 +90,17 @@ def get_product_list(
 
 
 @router.get("/cart/{product_id}/add")
-def get_add_item_into_cart(
+async def get_add_item_into_cart(
     user_id: Annotated[int, Depends(get_current_user_id)],
     product_id: int,
     previous_section: RetailSection = RetailSection.LIST,
 ):
-    modify_car_workflow.put_into_cart(user_id, product_id)
+    try:
+        await modify_car_workflow.put_into_cart_async(user_id, product_id)
+    except ProductNotFoundException:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    except NotEnoughProductCountAvailableException:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT)
     target_section = "/retail"
     if previous_section is RetailSection.CART:
         target_section += "/cart"
@@ -88,24 +108,44 @@ def get_add_item_into_cart(
 
 
 @router.get("/cart/{product_id}/remove")
-def get_remove_item_from_cart(
+async def get_remove_item_from_cart(
     user_id: Annotated[int, Depends(get_current_user_id)],
     product_id: int,
     previous_section: RetailSection = RetailSection.LIST,
 ):
-    modify_car_workflow.take_from_cart(user_id, product_id)
+    try:
+        await modify_car_workflow.take_from_cart_async(user_id, product_id)
+    except ProductNotFoundException:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
     target_section = "/retail"
     if previous_section is RetailSection.CART:
         target_section += "/cart"
     return RedirectResponse(url=target_section, status_code=303)
 
 
+@router.post("/cart/{product_id}/amount")
+async def post_set_amount_in_cart(
+    user_id: Annotated[int, Depends(get_current_user_id)],
+    product_id: int,
+    amount: Annotated[int, Form(ge=0)],
+):
+    try:
+        await modify_car_workflow.set_amount_in_cart_async(user_id, product_id, amount)
+    except ProductNotFoundException:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    except NotEnoughProductCountAvailableException:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT)
+    except InvalidCartChangeException:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    return RedirectResponse(url="/retail/cart", status_code=303)
+
+
 @router.get("/cart")
-def get_cart(
+async def get_cart(
     request: Request,
     user_id: Annotated[int, Depends(get_current_user_id)],
 ):
-    products = get_personalized_retail_product_views_workflow.get_personalized_retail_product_views(
+    products = await get_personalized_retail_product_views_workflow.get_personalized_retail_product_views_async(
         user_id, only_already_in_cart=True
     )
     return templates.TemplateResponse(
@@ -119,11 +159,11 @@ def get_cart(
 
 
 @router.get("/checkout")
-def get_checkout_form(
+async def get_checkout_form(
     request: Request,
     user_id: Annotated[int, Depends(get_current_user_id)],
 ):
-    products = get_personalized_retail_product_views_workflow.get_personalized_retail_product_views(
+    products = await get_personalized_retail_product_views_workflow.get_personalized_retail_product_views_async(
         user_id, only_already_in_cart=True
     )
     return templates.TemplateResponse(
@@ -143,13 +183,18 @@ def post_checkout(
     destination_longitude: Annotated[float, Form()],
     destination_latitude: Annotated[float, Form()],
 ):
-    handle_checkout_workflow.handle_checkout(
-        user_id=user_id,
-        first_name=first_name,
-        last_name=last_name,
-        destination_longitude=destination_longitude,
-        destination_latitude=destination_latitude,
-    )
+    try:
+        handle_checkout_workflow.handle_checkout(
+            user_id=user_id,
+            first_name=first_name,
+            last_name=last_name,
+            destination_longitude=destination_longitude,
+            destination_latitude=destination_latitude,
+        )
+    except ProductNotFoundException:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    except NotEnoughProductCountAvailableException:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT)
     return RedirectResponse(url=f"/retail/orders", status_code=303)
 
 
@@ -1,18 +1,50 @@
-from typing import Annotated
-from fastapi import Depends, HTTPException, status
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
+import asyncio
+import math
+from typing import TYPE_CHECKING, Annotated
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import (
+    HTTPAuthorizationCredentials,
+    HTTPBasic,
+    HTTPBasicCredentials,
+    HTTPBearer,
+)
 from fastapi.templating import Jinja2Templates
 from sqlalchemy import URL, create_engine
 from sqlalchemy.orm import sessionmaker
 from zwpa.config import Config
+from zwpa.exceptions.InvalidSessionToken import InvalidSessionToken
+from zwpa.exceptions.LoginThrottled import LoginThrottled
+from zwpa.exceptions.PasswordHashingOverloaded import PasswordHashingOverloaded
 from zwpa.exceptions.UserDoesNotExist import UserDoesNotExist
 from zwpa.exceptions.UserHasDifferentPassword import UserHasDifferentPassword
 from zwpa.exceptions.UserHasNoLoginAttemptsLeft import UserHasNoLoginAttemptsLeft
+from zwpa.workflows.retail.AsyncCartManager import AsyncCartManager
+from zwpa.workflows.retail.AsyncCartManagerClient import AsyncCartManagerClient
+from zwpa.workflows.retail.AsyncRestCartManager import AsyncRestCartManager
+from zwpa.workflows.retail.AvailabilityMirror import AvailabilityMirror
+from zwpa.workflows.retail.CartManager import CartManager
+from zwpa.workflows.retail.CartManagerKind import CartManagerKind
+from zwpa.workflows.retail.CartManagerClient import CartManagerClient
 from zwpa.workflows.retail.RestCartManager import RestCartManager
 from zwpa.workflows.retail.SimpleRetailTransportPriceCalculator import (
     SimpleRetailTransportPriceCalculator,
 )
 from zwpa.workflows.user.AuthenticateUserWorkflow import AuthenticateUserWorkflow
+from zwpa.workflows.user.BufferedAuthenticationLogWriter import (
+    BufferedAuthenticationLogWriter,
+)
+from zwpa.workflows.user.LoginThrottle import LoginThrottle
+from zwpa.workflows.user.PasswordHashingExecutor import PasswordHashingExecutor
+from zwpa.workflows.user.SessionTokenDenylist import SessionTokenDenylist
+from zwpa.workflows.user.SessionTokenService import SessionToken, SessionTokenService
+from zwpa.workflows.user.VerifiedCredentialCache import VerifiedCredentialCache
+from zwpa.workflows.utils.Principal import Principal, set_current_principal
+from zwpa.workflows.utils.RoleCache import RoleCache
+from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
+
+if TYPE_CHECKING:
+    from zwpa.workflows.retail.InProcessCartManager import InProcessCartManager
+    from zwpa.workflows.retail.SharedMemoryAvailability import SharedMemoryAvailability
 
 
 config = Config.from_environmental_variables()
@@ -28,25 +60,207 @@ engine = create_engine(
 )
 session_maker = sessionmaker(engine)
 security = HTTPBasic()
+optional_security = HTTPBasic(auto_error=False)
+bearer_security = HTTPBearer(auto_error=False)
+SESSION_TOKEN_COOKIE = "zwpa_session"
 templates = Jinja2Templates(directory="templates")
 simple_retail_price_calculator = SimpleRetailTransportPriceCalculator()
-rest_cart_manager = RestCartManager(
-    manager_url=config.cart_manager_config.url,
-    manager_access_key=config.cart_manager_config.access_key,
+cart_manager: CartManager
+async_cart_manager: AsyncCartManager
+in_process_cart_manager: "InProcessCartManager | None" = None
+availability_mirror: "AvailabilityMirror | SharedMemoryAvailability | None" = None
+if config.cart_manager_config.kind is CartManagerKind.IN_PROCESS:
+    # imported only here, as it needs the `cart_manager` package next to `zwpa`
+    from zwpa.workflows.retail.InProcessCartManager import (
+        AsyncInProcessCartManager,
+        InProcessCartManager,
+    )
+
+    in_process_cart_manager = InProcessCartManager(
+        session_expiration_time_in_seconds=config.cart_manager_config.session_expiration_time_in_seconds,
+        lock_path=config.cart_manager_config.lock_path,
+    )
+    cart_manager = in_process_cart_manager
+    async_cart_manager = AsyncInProcessCartManager(in_process_cart_manager)
+else:
+    rest_cart_manager = RestCartManager(
+        manager_url=config.cart_manager_config.url,
+        manager_access_key=config.cart_manager_config.access_key,
+        shard_urls=config.cart_manager_config.shard_urls,
+        client=CartManagerClient(
+            pool_size=config.cart_manager_config.pool_size,
+            connect_timeout_in_seconds=config.cart_manager_config.connect_timeout_in_seconds,
+            read_timeout_in_seconds=config.cart_manager_config.read_timeout_in_seconds,
+            max_retries=config.cart_manager_config.max_retries,
+            retry_backoff_in_seconds=config.cart_manager_config.retry_backoff_in_seconds,
+            unix_socket_path=config.cart_manager_config.unix_socket_path,
+        ),
+    )
+    cart_manager = rest_cart_manager
+    async_cart_manager = AsyncRestCartManager(
+        manager_url=config.cart_manager_config.url,
+        shard_urls=config.cart_manager_config.shard_urls,
+        client=AsyncCartManagerClient(
+            pool_size=config.cart_manager_config.pool_size,
+            connect_timeout_in_seconds=config.cart_manager_config.connect_timeout_in_seconds,
+            read_timeout_in_seconds=config.cart_manager_config.read_timeout_in_seconds,
+            max_retries=config.cart_manager_config.max_retries,
+            retry_backoff_in_seconds=config.cart_manager_config.retry_backoff_in_seconds,
+            unix_socket_path=config.cart_manager_config.unix_socket_path,
+        ),
+    )
+    if config.cart_manager_config.shared_memory_names:
+        # imported only here, as it needs the `cart_manager` package next to `zwpa`
+        from zwpa.workflows.retail.SharedMemoryAvailability import (
+            SharedMemoryAvailability,
+        )
+
+        availability_mirror = SharedMemoryAvailability(
+            config.cart_manager_config.shared_memory_names
+        )
+    elif config.cart_manager_config.availability_poll_timeout_in_seconds > 0:
+        availability_mirror = AvailabilityMirror(
+            rest_cart_manager,
+            poll_timeout_in_seconds=config.cart_manager_config.availability_poll_timeout_in_seconds,
+        )
+
+verified_credential_cache = VerifiedCredentialCache(
+    max_size=config.authentication_config.credential_cache_size,
+    ttl_in_seconds=config.authentication_config.credential_cache_ttl_in_seconds,
+)
+authentication_log_writer = BufferedAuthenticationLogWriter(
+    session_maker,
+    batch_size=config.authentication_config.audit_log_batch_size,
+    flush_interval_in_seconds=config.authentication_config.audit_log_flush_interval_in_seconds,
+    max_queue_size=config.authentication_config.audit_log_queue_size,
+    overflow_policy=config.authentication_config.audit_log_overflow_policy,
+    flush_attempts=config.authentication_config.audit_log_flush_attempts,
+)
+password_hashing_executor = PasswordHashingExecutor(
+    max_workers=config.authentication_config.password_hashing_workers,
+    max_queue_size=config.authentication_config.password_hashing_queue_size,
+    kind=config.authentication_config.password_hashing_executor_kind,
+)
+login_throttle = LoginThrottle(
+    login_capacity=config.authentication_config.login_throttle_login_capacity,
+    login_refill_per_second=config.authentication_config.login_throttle_login_refill_per_second,
+    client_capacity=config.authentication_config.login_throttle_client_capacity,
+    client_refill_per_second=config.authentication_config.login_throttle_client_refill_per_second,
+    max_tracked_keys=config.authentication_config.login_throttle_max_tracked_keys,
+)
+authenticate_user_workflow = AuthenticateUserWorkflow(
+    session_maker,
+    credential_cache=verified_credential_cache,
+    authentication_log_writer=authentication_log_writer,
+    password_hashing_executor=password_hashing_executor,
+    login_throttle=login_throttle,
+)
+session_token_service = SessionTokenService(
+    secret=config.authentication_config.session_token_secret.encode("utf-8"),
+    ttl_in_seconds=config.authentication_config.session_token_ttl_in_seconds,
+)
+session_token_denylist = SessionTokenDenylist(
+    max_token_ttl_in_seconds=config.authentication_config.session_token_ttl_in_seconds
 )
+role_cache = RoleCache(
+    session_maker,
+    max_size=config.authentication_config.role_cache_size,
+    version_check_interval_in_seconds=config.authentication_config.role_cache_version_check_interval_in_seconds,
+)
+principal_role_checker = UserRoleChecker(session_maker, role_cache=role_cache)
+
+
+def get_client_address(request: Request) -> str | None:
+    return request.client.host if request.client is not None else None
+
+
+def too_many_requests(exception: LoginThrottled) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": str(math.ceil(exception.retry_after_in_seconds))},
+    )
+
+
+def get_presented_session_token(
+    request: Request, credentials: HTTPAuthorizationCredentials | None
+) -> str | None:
+    return (
+        credentials.credentials
+        if credentials is not None
+        else request.cookies.get(SESSION_TOKEN_COOKIE)
+    )
 
-authenticate_user_workflow = AuthenticateUserWorkflow(session_maker)
+
+def verify_session_token(token: str) -> SessionToken | None:
+    try:
+        session_token = session_token_service.verify(token)
+    except InvalidSessionToken:
+        return None
+    if session_token_denylist.is_revoked(session_token):
+        return None
+    return session_token
 
 
-def get_current_user_id(
-    credentials: Annotated[HTTPBasicCredentials, Depends(security)]
-):
+async def get_current_principal(
+    request: Request,
+    bearer_credentials: Annotated[
+        HTTPAuthorizationCredentials | None, Depends(bearer_security)
+    ],
+    credentials: Annotated[HTTPBasicCredentials | None, Depends(optional_security)],
+) -> Principal:
+    """A valid session token (Bearer or cookie) is trusted as is, otherwise Basic
+    credentials are authenticated against the database."""
+    token = get_presented_session_token(request, bearer_credentials)
+    session_token = verify_session_token(token) if token is not None else None
+    if session_token is not None:
+        principal = Principal(user_id=session_token.user_id, roles=session_token.roles)
+        set_current_principal(principal)
+        return principal
+    if credentials is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            headers={"WWW-Authenticate": "Basic"},
+        )
     try:
-        result = authenticate_user_workflow.authenticate_user(
-            credentials.username, credentials.password
+        result = await authenticate_user_workflow.authenticate_user_async(
+            credentials.username,
+            credentials.password,
+            client_address=get_client_address(request),
         )
     except (UserDoesNotExist, UserHasNoLoginAttemptsLeft, UserHasDifferentPassword):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
-    if not result.authenticated:
+    except LoginThrottled as e:
+        raise too_many_requests(e)
+    except PasswordHashingOverloaded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": "1"},
+        )
+    if not result.authenticated or result.user_id is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
-    return result.user_id
+    roles = await asyncio.to_thread(principal_role_checker.get_user_roles, result.user_id)
+    principal = Principal(user_id=result.user_id, roles=roles)
+    set_current_principal(principal)
+    return principal
+
+
+async def get_current_user_id(
+    principal: Annotated[Principal, Depends(get_current_principal)]
+) -> int:
+    return principal.user_id
+
+
+async def get_current_session_token(
+    request: Request,
+    credentials: Annotated[
+        HTTPAuthorizationCredentials | None, Depends(bearer_security)
+    ],
+) -> SessionToken:
+    token = get_presented_session_token(request, credentials)
+    session_token = verify_session_token(token) if token is not None else None
+    if session_token is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return session_token
@@ -25,13 +25,13 @@ from zwpa.workflows.supplies.ListSupplyRequestsWorkflow import (
     ListSupplyRequestsWorkflow,
 )
 from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
-from .shared import get_current_user_id, session_maker, templates
+from .shared import get_current_user_id, role_cache, session_maker, templates
 
 router = APIRouter(
     prefix="/supply",
     tags=["supply"],
 )
-user_role_checker = UserRoleChecker(session_maker)
+user_role_checker = UserRoleChecker(session_maker, role_cache=role_cache)
 list_supply_requests_workflow = ListSupplyRequestsWorkflow(session_maker)
 handle_supply_request_form_workflow = HandleSupplyRequestFormWorkflow(session_maker)
 create_new_supply_request_workflow = CreateNewSupplyRequestWorkflow(session_maker)
@@ -23,14 +23,14 @@ from zwpa.workflows.transport.ListTransportsWorkflow import ListTransportWorkflo
 from zwpa.workflows.transport.TransportAccessChecker import TransportAccessChecker
 
 from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
-from .shared import get_current_user_id, session_maker, templates
+from .shared import get_current_user_id, role_cache, session_maker, templates
 
 
 router = APIRouter(
     prefix="/transport",
     tags=["transport"],
 )
-user_role_checker = UserRoleChecker(session_maker)
+user_role_checker = UserRoleChecker(session_maker, role_cache=role_cache)
 transport_access_checker = TransportAccessChecker(session_maker)
 list_transports_workflow = ListTransportWorkflow(session_maker)
 list_transport_requests_workflow = ListTransportRequestsWorkflow(session_maker)
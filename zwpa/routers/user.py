@@ -1,23 +1,66 @@
 
+import asyncio
 from dataclasses import asdict
 from typing import Annotated
-from fastapi import APIRouter, Depends, Form, Request
+from fastapi import APIRouter, Depends, Form, HTTPException, Request, Response, status
+from fastapi.security import HTTPBasicCredentials
+from zwpa.exceptions.LoginThrottled import LoginThrottled
+from zwpa.exceptions.PasswordHashingOverloaded import PasswordHashingOverloaded
+from zwpa.exceptions.UserDoesNotExist import UserDoesNotExist
+from zwpa.exceptions.UserHasDifferentPassword import UserHasDifferentPassword
+from zwpa.exceptions.UserHasNoLoginAttemptsLeft import UserHasNoLoginAttemptsLeft
+from zwpa.exceptions.UserLacksRoleException import UserLacksRoleException
 from zwpa.model import UserRole
-from zwpa.workflows.user.AuthenticateUserWorkflow import AuthenticateUserWorkflow
 
+from zwpa.workflows.user.BulkCreateUsersWorkflow import (
+    BulkCreateUsersWorkflow,
+    BulkUserFormat,
+    parse_bulk_user_rows,
+)
 from zwpa.workflows.user.CreateUserWorkflow import CreateUserWorkflow
+from zwpa.workflows.user.IssueSessionTokenWorkflow import IssueSessionTokenWorkflow
 from zwpa.workflows.user.ListUserRolesWorkflow import ListUserRolesWorkflow
 from zwpa.workflows.user.ModifyUserRolesWorkflow import ModifyUserRolesWorkflow
-from .shared import get_current_user_id, session_maker, templates
+from zwpa.workflows.user.SessionTokenService import SessionToken
+from .shared import (
+    SESSION_TOKEN_COOKIE,
+    authenticate_user_workflow,
+    get_client_address,
+    get_current_session_token,
+    get_current_user_id,
+    password_hashing_executor,
+    role_cache,
+    security,
+    session_maker,
+    session_token_denylist,
+    session_token_service,
+    templates,
+    too_many_requests,
+    verified_credential_cache,
+)
 
 router = APIRouter(
     prefix="/user",
     tags=["user"],
 )
-create_user_workflow = CreateUserWorkflow(session_maker)
-modify_user_roles_workflow = ModifyUserRolesWorkflow(session_maker)
-authenticate_user_workflow = AuthenticateUserWorkflow(session_maker)
+create_user_workflow = CreateUserWorkflow(
+    session_maker, password_hashing_executor=password_hashing_executor
+)
+modify_user_roles_workflow = ModifyUserRolesWorkflow(
+    session_maker,
+    credential_cache=verified_credential_cache,
+    session_token_denylist=session_token_denylist,
+    role_cache=role_cache,
+)
 list_user_roles_workflow = ListUserRolesWorkflow(session_maker)
+bulk_create_users_workflow = BulkCreateUsersWorkflow(
+    session_maker, password_hashing_executor=password_hashing_executor
+)
+issue_session_token_workflow = IssueSessionTokenWorkflow(
+    session_maker,
+    authenticate_user_workflow=authenticate_user_workflow,
+    session_token_service=session_token_service,
+)
 
 
 @router.get("/create")
@@ -29,16 +72,98 @@ def get_create_user(request: Request):
 
 
 @router.post("/create")
-def post_create_user(
+async def post_create_user(
     request: Request, login: Annotated[str, Form()], password: Annotated[str, Form()]
 ):
-    create_user_workflow.create_user(login, plain_text_password=password)
+    try:
+        await create_user_workflow.create_user_async(
+            login, plain_text_password=password
+        )
+    except PasswordHashingOverloaded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": "1"},
+        )
     return templates.TemplateResponse(
         "user/accountCreatedPage.html",
         {"request": request},
     )
 
 
+@router.post("/bulk")
+async def post_bulk_create_users(
+    request: Request,
+    user_id: Annotated[int, Depends(get_current_user_id)],
+    format: BulkUserFormat = BulkUserFormat.CSV,
+):
+    try:
+        body = (await request.body()).decode("utf-8")
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="body is not UTF-8"
+        )
+    rows, parsing_failures = parse_bulk_user_rows(body, format=format)
+    try:
+        result = await asyncio.to_thread(
+            bulk_create_users_workflow.create_users_as_admin, user_id, rows
+        )
+    except UserLacksRoleException:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    except PasswordHashingOverloaded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": "1"},
+        )
+    result.failures = sorted(
+        parsing_failures + result.failures, key=lambda failure: failure.row_number
+    )
+    return asdict(result)
+
+
+@router.post("/login")
+async def post_login(
+    request: Request,
+    response: Response,
+    credentials: Annotated[HTTPBasicCredentials, Depends(security)],
+):
+    try:
+        issued_session_token = await issue_session_token_workflow.issue_session_token(
+            credentials.username,
+            plain_text_password=credentials.password,
+            client_address=get_client_address(request),
+        )
+    except (UserDoesNotExist, UserHasNoLoginAttemptsLeft, UserHasDifferentPassword):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+    except LoginThrottled as e:
+        raise too_many_requests(e)
+    except PasswordHashingOverloaded:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": "1"},
+        )
+    response.set_cookie(
+        SESSION_TOKEN_COOKIE,
+        issued_session_token.token,
+        max_age=int(session_token_service.ttl_in_seconds),
+        httponly=True,
+        samesite="strict",
+    )
+    return {
+        "access_token": issued_session_token.token,
+        "token_type": "bearer",
+        "expires_at": issued_session_token.session_token.expires_at,
+    }
+
+
+@router.post("/logout", status_code=204)
+async def post_logout(
+    response: Response,
+    session_token: Annotated[SessionToken, Depends(get_current_session_token)],
+):
+    session_token_denylist.revoke(session_token)
+    response.delete_cookie(SESSION_TOKEN_COOKIE)
+
+
 @router.get("/roles")
 def get_user_roles(
     request: Request, user_id: Annotated[int, Depends(get_current_user_id)]
@@ -25,14 +25,14 @@ from zwpa.workflows.transport.TransportAccessChecker import TransportAccessCheck
 from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
 from zwpa.workflows.warehouse.GetWarehouseDetailsWorkflow import GetWarehouseDetailsWorkflow
 from zwpa.workflows.warehouse.ListAllWarehousesWorkflow import ListAllWarehousesWorkflow
-from .shared import get_current_user_id, session_maker, templates
+from .shared import get_current_user_id, role_cache, session_maker, templates
 
 
 router = APIRouter(
     prefix="/warehouse",
     tags=["warehouse"],
 )
-user_role_checker = UserRoleChecker(session_maker)
+user_role_checker = UserRoleChecker(session_maker, role_cache=role_cache)
 list_warehouses_workflow = ListAllWarehousesWorkflow(session_maker)
 get_warehouse_details_workflow = GetWarehouseDetailsWorkflow(session_maker)
 
@@ -9,7 +9,6 @@ from zwpa.model import (
     Transport,
     TransportRequest,
     TransportStatus,
-    User,
     UserRole,
     Warehouse,
     WarehouseProduct,
@@ -19,6 +18,7 @@ from zwpa.workflows.client_requests.AddNewClientRequestWorkflow import (
     TodayProvider,
 )
 from zwpa.exceptions.UserLacksRoleException import UserLacksRoleException
+from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
 
 
 class RequestAlreadyAccepted(Exception):
@@ -41,6 +41,7 @@ class AcceptClientRequestWorkflow:
     ) -> None:
         self.session_maker = session_maker
         self.today_provider = today_provider
+        self.user_role_checker = UserRoleChecker(self.session_maker)
 
     def accept_client_request(
         self,
@@ -52,7 +53,7 @@ class AcceptClientRequestWorkflow:
         price_for_transport: Decimal,
     ) -> None:
         with self.session_maker() as session:
-            if not self.__is_user_of_role(session, user_id, role=UserRole.CLERK):
+            if not self.__is_user_of_role(user_id, role=UserRole.CLERK):
                 raise UserLacksRoleException()
             self.__validate_request(session, client_request_id, warehouse_id)
             self.__add_new_transport_with_request(
@@ -71,11 +72,8 @@ class AcceptClientRequestWorkflow:
             )
             session.commit()
 
-    def __is_user_of_role(self, session: Session, user_id: int, role: UserRole) -> bool:
-        user_roles = [
-            assignment.role for assignment in session.get_one(User, user_id).roles
-        ]
-        return role in user_roles
+    def __is_user_of_role(self, user_id: int, role: UserRole) -> bool:
+        return self.user_role_checker.is_user_of_role(user_id, role=role)
 
     def __validate_request(self, session: Session, client_request_id: int, source_warehouse_id: int) -> None:
         client_request: ClientRequest = session.get_one(
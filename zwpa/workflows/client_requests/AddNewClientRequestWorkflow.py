@@ -4,7 +4,8 @@ from decimal import Decimal
 from typing import Protocol
 from sqlalchemy.orm import sessionmaker
 
-from zwpa.model import ClientRequest, Location, Product, TimeWindow, User, UserRole
+from zwpa.model import ClientRequest, Location, Product, TimeWindow, UserRole
+from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
 
 
 class ClientRequestValidationException(Exception):
@@ -37,6 +38,7 @@ class AddNewClientRequestWorkflow:
         self.session_maker = session_maker
         self.min_days_to_process = min_days_to_process
         self.today_provider = today_provider
+        self.user_role_checker = UserRoleChecker(self.session_maker)
 
     def add_new_client_request(
         self,
@@ -85,11 +87,7 @@ class AddNewClientRequestWorkflow:
             session.commit()
 
     def _user_is_client(self, user_id: int) -> bool:
-        with self.session_maker() as session:
-            user_roles = [
-                assignment.role for assignment in session.get_one(User, user_id).roles
-            ]
-            return UserRole.CLIENT in user_roles
+        return self.user_role_checker.is_user_of_role(user_id, role=UserRole.CLIENT)
 
     def _validate_user_input(
         self,
@@ -4,7 +4,8 @@ from decimal import Decimal
 
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy import select
-from zwpa.model import ClientRequest, User, UserRole
+from zwpa.model import ClientRequest, UserRole
+from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
 
 
 @dataclass(eq=True)
@@ -52,6 +53,7 @@ class GetClientRequestsWorkflow:
         session_maker: sessionmaker,
     ) -> None:
         self.session_maker = session_maker
+        self.user_role_checker = UserRoleChecker(self.session_maker)
 
     def get_all_client_requests_workflow(self, user_id: int) -> list[ClientRequestView]:
         if not self.__is_user_of_role(user_id=user_id, role=UserRole.CLERK):
@@ -74,11 +76,7 @@ class GetClientRequestsWorkflow:
             ]
 
     def __is_user_of_role(self, user_id: int, role: UserRole) -> bool:
-        with self.session_maker() as session:
-            user_roles = [
-                assignment.role for assignment in session.get_one(User, user_id).roles
-            ]
-            return role in user_roles
+        return self.user_role_checker.is_user_of_role(user_id, role=role)
 
     def __get_client_requests(
         self, session: Session, client_id: int | None = None
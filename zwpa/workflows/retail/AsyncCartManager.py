@@ -0,0 +1,47 @@
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from zwpa.workflows.retail.CartManager import Cart, CartChange, CartChangesResult
+
+
+class AsyncCartManager(ABC):
+    """The cart operations of `CartManager` that serve user requests, as coroutines.
+
+    Initialization and synchronization of product counts stay on the
+    blocking `CartManager`, as they only run outside of requests.
+    """
+
+    @abstractmethod
+    async def put_in_cart(self, product_id: int, user_id: int) -> None:
+        pass
+
+    @abstractmethod
+    async def remove_from_cart(self, product_id: int, user_id: int) -> None:
+        pass
+
+    @abstractmethod
+    async def get_cart(self, user_id: int) -> Cart:
+        pass
+
+    @abstractmethod
+    async def apply_cart_changes(
+        self, user_id: int, changes: list[CartChange]
+    ) -> CartChangesResult:
+        """Applies all changes atomically; raises and changes nothing if any of them fails."""
+        pass
+
+    @abstractmethod
+    async def checkout(self, user_id: int, idempotency_key: Optional[str] = None) -> None:
+        pass
+
+    @abstractmethod
+    async def get_current_product_counts(self) -> dict[int, int]:
+        pass
+
+    @abstractmethod
+    async def get_product_counts(self, product_ids: list[int]) -> dict[int, int]:
+        """Counts of the given products; products the cart manager does not know are left out."""
+        pass
+
+    async def close(self) -> None:
+        """Releases connections to the cart manager, if there are any."""
@@ -0,0 +1,142 @@
+import asyncio
+import random
+import time
+from typing import Any, Optional
+
+import httpx
+
+from zwpa.workflows.retail.CartManager import (
+    CartManagerResponseException,
+    CartManagerUnavailableException,
+)
+from zwpa.workflows.retail.CartManagerClient import (
+    IDEMPOTENT_METHODS,
+    RETRIED_STATUS_CODES,
+    OperationStatistics,
+)
+
+
+class AsyncCartManagerClient:
+    """Asynchronous counterpart of `CartManagerClient`, built on `httpx.AsyncClient`.
+
+    Pooling, timeouts, retries and statistics work the same way, except
+    that waiting for the cart manager does not hold a thread. The client
+    must only be used from one event loop. With `unix_socket_path`, requests
+    go to the cart manager listening on that Unix domain socket; `transport`
+    replaces the transport of httpx altogether.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        connect_timeout_in_seconds: float = 1.0,
+        read_timeout_in_seconds: float = 5.0,
+        max_retries: int = 2,
+        retry_backoff_in_seconds: float = 0.05,
+        unix_socket_path: Optional[str] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> None:
+        self.connect_timeout_in_seconds = connect_timeout_in_seconds
+        self.read_timeout_in_seconds = read_timeout_in_seconds
+        self.max_retries = max_retries
+        self.retry_backoff_in_seconds = retry_backoff_in_seconds
+        self.statistics: dict[str, OperationStatistics] = {}
+
+        limits = httpx.Limits(
+            max_connections=pool_size, max_keepalive_connections=pool_size
+        )
+        if transport is None and unix_socket_path is not None:
+            transport = httpx.AsyncHTTPTransport(uds=unix_socket_path, limits=limits)
+        self._client = httpx.AsyncClient(limits=limits, transport=transport)
+
+    async def request(
+        self,
+        operation: str,
+        method: str,
+        url: str,
+        params: Optional[dict[str, Any]] = None,
+        json: Any = None,
+        idempotent: Optional[bool] = None,
+        accepted_status_codes: frozenset[int] = frozenset(),
+        read_timeout_in_seconds: Optional[float] = None,
+    ) -> httpx.Response:
+        started_at = time.perf_counter()
+        failed = True
+        try:
+            response = await self._send(
+                operation,
+                method,
+                url,
+                params=params,
+                json=json,
+                idempotent=method in IDEMPOTENT_METHODS if idempotent is None else idempotent,
+                timeout=httpx.Timeout(
+                    read_timeout_in_seconds or self.read_timeout_in_seconds,
+                    connect=self.connect_timeout_in_seconds,
+                ),
+            )
+            if (
+                not response.is_success
+                and response.status_code not in accepted_status_codes
+            ):
+                raise CartManagerResponseException(
+                    operation, response.status_code, _detail(response)
+                )
+            failed = False
+            return response
+        finally:
+            self._record(operation, time.perf_counter() - started_at, failed)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    async def _send(
+        self,
+        operation: str,
+        method: str,
+        url: str,
+        params: Optional[dict[str, Any]],
+        json: Any,
+        idempotent: bool,
+        timeout: httpx.Timeout,
+    ) -> httpx.Response:
+        attempts = self.max_retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            is_last_attempt = attempt + 1 == attempts
+            if attempt > 0:
+                self._record_retry(operation)
+                # full jitter, so clients that failed together do not retry together
+                await asyncio.sleep(
+                    random.uniform(0, self.retry_backoff_in_seconds * 2 ** (attempt - 1))
+                )
+            try:
+                response = await self._client.request(
+                    method, url, params=params, json=json, timeout=timeout
+                )
+            except httpx.TransportError as e:
+                if is_last_attempt:
+                    raise CartManagerUnavailableException(f"{operation}: {e}") from e
+                continue
+            if response.status_code not in RETRIED_STATUS_CODES or is_last_attempt:
+                return response
+        raise AssertionError("every attempt either returns or raises")
+
+    def _record(self, operation: str, latency_in_seconds: float, failed: bool) -> None:
+        # every caller runs on the same event loop, so no lock is needed
+        statistics = self.statistics.setdefault(operation, OperationStatistics())
+        statistics.calls += 1
+        statistics.errors += failed
+        statistics.total_latency_in_seconds += latency_in_seconds
+        statistics.max_latency_in_seconds = max(
+            statistics.max_latency_in_seconds, latency_in_seconds
+        )
+
+    def _record_retry(self, operation: str) -> None:
+        self.statistics.setdefault(operation, OperationStatistics()).retries += 1
+
+
+def _detail(response: httpx.Response) -> str:
+    try:
+        return str(response.json()["detail"])
+    except (ValueError, KeyError, TypeError):
+        return response.text
@@ -0,0 +1,156 @@
+import asyncio
+from typing import Optional
+
+import httpx
+
+from zwpa.workflows.retail.AsyncCartManager import AsyncCartManager
+from zwpa.workflows.retail.AsyncCartManagerClient import AsyncCartManagerClient
+from zwpa.workflows.retail.CartManager import (
+    Cart,
+    CartChange,
+    CartChangesResult,
+    InvalidCartChangeException,
+    NotEnoughProductCountAvailableException,
+    ProductNotFoundException,
+)
+from zwpa.workflows.retail.RestCartManager import (
+    CART_ERROR_STATUS_CODES,
+    PRODUCT_IDS_PER_REQUEST,
+    RestCart,
+    RestCartChangesResult,
+    RestProductState,
+)
+
+
+class AsyncRestCartManager(AsyncCartManager):
+    """Asynchronous client of the cart manager, routing requests over shards
+    the same way `RestCartManager` does.
+
+    Product counts are read from all shards, and in chunks of product ids,
+    at the same time rather than one request after another.
+    """
+
+    def __init__(
+        self,
+        manager_url: str,
+        shard_urls: Optional[list[str]] = None,
+        client: Optional[AsyncCartManagerClient] = None,
+    ) -> None:
+        super().__init__()
+        self.manager_url = manager_url
+        self.shard_urls = shard_urls or [manager_url]
+        self.client = client or AsyncCartManagerClient()
+
+    def user_shard_url(self, user_id: int) -> str:
+        return self.shard_urls[hash(user_id) % len(self.shard_urls)]
+
+    async def put_in_cart(self, product_id: int, user_id: int) -> None:
+        self._raise_for_cart_error(
+            await self.client.request(
+                "put_in_cart",
+                "POST",
+                f"{self.user_shard_url(user_id)}/cart/{user_id}/{product_id}/increment",
+                accepted_status_codes=CART_ERROR_STATUS_CODES,
+            )
+        )
+
+    async def remove_from_cart(self, product_id: int, user_id: int) -> None:
+        self._raise_for_cart_error(
+            await self.client.request(
+                "remove_from_cart",
+                "POST",
+                f"{self.user_shard_url(user_id)}/cart/{user_id}/{product_id}/decrement",
+                accepted_status_codes=CART_ERROR_STATUS_CODES,
+            )
+        )
+
+    async def get_cart(self, user_id: int) -> Cart:
+        response = await self.client.request(
+            "get_cart", "GET", f"{self.user_shard_url(user_id)}/cart/{user_id}"
+        )
+        return RestCart(**response.json()).to_cart(user_id)
+
+    async def apply_cart_changes(
+        self, user_id: int, changes: list[CartChange]
+    ) -> CartChangesResult:
+        response = await self.client.request(
+            "apply_cart_changes",
+            "POST",
+            f"{self.user_shard_url(user_id)}/cart/{user_id}/batch",
+            json={"changes": [change.model_dump() for change in changes]},
+            accepted_status_codes=CART_ERROR_STATUS_CODES,
+        )
+        self._raise_for_cart_error(response)
+
+        result = RestCartChangesResult(**response.json())
+        available_count_by_product_id = {
+            product_id: product_state.total_count
+            for product_id, product_state in result.state_by_product.items()
+        }
+        if len(self.shard_urls) > 1:
+            available_count_by_product_id = await self._sum_product_counts(
+                list(available_count_by_product_id)
+            )
+        return CartChangesResult(
+            cart=result.cart.to_cart(user_id),
+            available_count_by_product_id=available_count_by_product_id,
+        )
+
+    async def checkout(self, user_id: int, idempotency_key: Optional[str] = None) -> None:
+        self._raise_for_cart_error(
+            await self.client.request(
+                "checkout",
+                "POST",
+                f"{self.user_shard_url(user_id)}/cart/{user_id}/checkout",
+                params={"idempotency_key": idempotency_key} if idempotency_key else None,
+                idempotent=idempotency_key is not None,
+                accepted_status_codes=CART_ERROR_STATUS_CODES,
+            )
+        )
+
+    async def get_current_product_counts(self) -> dict[int, int]:
+        return await self._sum_product_counts()
+
+    async def get_product_counts(self, product_ids: list[int]) -> dict[int, int]:
+        return await self._sum_product_counts(product_ids)
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    async def _sum_product_counts(
+        self, product_ids: Optional[list[int]] = None
+    ) -> dict[int, int]:
+        # product ids go in the query string, so long lists are sent in chunks
+        chunks = (
+            [None]
+            if product_ids is None
+            else [
+                {"product_ids": product_ids[start : start + PRODUCT_IDS_PER_REQUEST]}
+                for start in range(0, len(product_ids), PRODUCT_IDS_PER_REQUEST)
+            ]
+        )
+        responses = await asyncio.gather(
+            *(
+                self.client.request(
+                    "get_product_counts", "GET", f"{shard_url}/products", params=params
+                )
+                for shard_url in self.shard_urls
+                for params in chunks
+            )
+        )
+        total_count_by_product_id: dict[int, int] = {}
+        for response in responses:
+            for product_id, state in response.json().items():
+                total_count_by_product_id[int(product_id)] = (
+                    total_count_by_product_id.get(int(product_id), 0)
+                    + RestProductState(**state).total_count
+                )
+        return total_count_by_product_id
+
+    def _raise_for_cart_error(self, response: httpx.Response) -> None:
+        if response.status_code == 404:
+            raise ProductNotFoundException(response.json()["detail"])
+        if response.status_code == 409:
+            raise NotEnoughProductCountAvailableException(response.json()["detail"])
+        if response.status_code == 422:
+            raise InvalidCartChangeException(response.json()["detail"])
@@ -0,0 +1,110 @@
+from logging import getLogger
+import threading
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+from zwpa.workflows.retail.RestCartManager import RestCartManager
+
+
+class AvailabilityMirror:
+    """Local copy of product counts, kept current by long polling every cart manager shard.
+
+    Each shard is followed by its own background thread, which asks for
+    counts changed since the last version it saw. Counts of all shards are
+    summed up as they arrive, so reading them costs no network call. Until
+    every shard answered once, or after a shard could not be reached, the
+    mirror is not synchronized and must not be read from.
+    """
+
+    def __init__(
+        self,
+        cart_manager: RestCartManager,
+        poll_timeout_in_seconds: float = 25.0,
+        retry_interval_in_seconds: float = 1.0,
+    ) -> None:
+        self.cart_manager = cart_manager
+        self.poll_timeout_in_seconds = poll_timeout_in_seconds
+        self.retry_interval_in_seconds = retry_interval_in_seconds
+
+        shard_count = len(cart_manager.shard_urls)
+        self._versions: list[Optional[int]] = [None] * shard_count
+        self._count_by_product_id_by_shard: list[dict[int, int]] = [
+            {} for _ in range(shard_count)
+        ]
+        self._total_count_by_product_id: dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        self._workers: list[threading.Thread] = []
+        self._logger = getLogger("availability-mirror")
+
+    @property
+    def is_synchronized(self) -> bool:
+        return all(version is not None for version in self._versions)
+
+    def get_current_product_counts(self) -> Mapping[int, int]:
+        return MappingProxyType(self._total_count_by_product_id)
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._closing.clear()
+        self._workers = [
+            threading.Thread(
+                target=self._follow,
+                args=(shard_index,),
+                name=f"availability-mirror-{shard_index}",
+                daemon=True,
+            )
+            for shard_index in range(len(self._versions))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def close(self) -> None:
+        # workers notice it after their current poll at the latest; they are
+        # daemons, so they do not hold up the process either way
+        self._closing.set()
+        self._workers = []
+
+    def _follow(self, shard_index: int) -> None:
+        shard_url = self.cart_manager.shard_urls[shard_index]
+        while not self._closing.is_set():
+            try:
+                changes = self.cart_manager.poll_availability_changes(
+                    shard_url,
+                    since=self._versions[shard_index],
+                    timeout_in_seconds=self.poll_timeout_in_seconds,
+                )
+            except Exception as e:
+                self._logger.warning(f"Could not poll {shard_url}: {e}")
+                self._versions[shard_index] = None
+                self._closing.wait(self.retry_interval_in_seconds)
+                continue
+            self._apply(
+                shard_index,
+                changes.total_count_by_product_id,
+                complete=changes.complete,
+            )
+            self._versions[shard_index] = changes.version
+
+    def _apply(
+        self, shard_index: int, count_by_product_id: dict[int, int], complete: bool
+    ) -> None:
+        shard_counts = self._count_by_product_id_by_shard[shard_index]
+        with self._lock:
+            if complete:
+                for product_id in shard_counts.keys() - count_by_product_id.keys():
+                    self._add(product_id, -shard_counts.pop(product_id))
+                    if not any(
+                        product_id in counts
+                        for counts in self._count_by_product_id_by_shard
+                    ):
+                        del self._total_count_by_product_id[product_id]
+            for product_id, count in count_by_product_id.items():
+                self._add(product_id, count - shard_counts.get(product_id, 0))
+                shard_counts[product_id] = count
+
+    def _add(self, product_id: int, difference: int) -> None:
+        self._total_count_by_product_id[product_id] = (
+            self._total_count_by_product_id.get(product_id, 0) + difference
+        )
@@ -1,6 +1,8 @@
 
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
+from hashlib import blake2b
+from typing import Optional
 
 from pydantic import BaseModel
 
@@ -10,6 +12,28 @@ class Cart(BaseModel):
     amount_by_product_id: dict[int, int]
 
 
+class CartChange(BaseModel):
+    """Sets the amount of a product to `quantity` and/or moves it by `delta`."""
+
+    product_id: int
+    delta: int | None = None
+    quantity: int | None = None
+
+
+class CartChangesResult(BaseModel):
+    cart: Cart
+    available_count_by_product_id: dict[int, int]
+
+
+class CartManagerStateDigest(BaseModel):
+    """Checksums of every product's total count, by product id modulo the
+    number of checksums. `version` is opaque and changes with any count."""
+
+    version: str
+    product_count: int
+    checksums: list[int]
+
+
 class NotEnoughProductCountAvailableException(Exception):
     pass
 
@@ -17,6 +41,58 @@ class ProductNotFoundException(Exception):
     pass
 
 
+class InvalidCartChangeException(Exception):
+    pass
+
+
+class CartManagerStateChangedException(Exception):
+    pass
+
+
+class CartManagerUnavailableException(Exception):
+    pass
+
+
+class ProductCountsUnreadableException(Exception):
+    """Counts kept outside of the cart manager could not be read, and must
+    be asked of the cart manager instead."""
+
+
+class CartManagerResponseException(Exception):
+    def __init__(self, operation: str, status_code: int, detail: str) -> None:
+        super().__init__(f"{operation} failed with {status_code}: {detail}")
+        self.operation = operation
+        self.status_code = status_code
+        self.detail = detail
+
+
+CHECKSUM_MODULUS = 2**64
+
+
+def product_hash(product_id: int, salt: bytes) -> int:
+    # has to match the one in cart_manager/store.py
+    return int.from_bytes(
+        blake2b(
+            product_id.to_bytes(8, "little", signed=True), digest_size=8, person=salt
+        ).digest(),
+        "little",
+    )
+
+
+def availability_checksums(
+    total_count_by_product_id: dict[int, int], bucket_count: int
+) -> list[int]:
+    checksums = [0] * bucket_count
+    for product_id, total_count in total_count_by_product_id.items():
+        bucket = product_id % bucket_count
+        checksums[bucket] = (
+            checksums[bucket]
+            + total_count * product_hash(product_id, b"availability")
+            + product_hash(product_id, b"membership")
+        ) % CHECKSUM_MODULUS
+    return checksums
+
+
 class CartManager(ABC):
     @abstractmethod
     def initialize(self, available_count_by_product_id: dict[int, int]) -> None:
@@ -35,7 +111,19 @@ class CartManager(ABC):
         pass
 
     @abstractmethod
-    def checkout(self, user_id: int) -> None:
+    def apply_cart_changes(
+        self, user_id: int, changes: list[CartChange]
+    ) -> CartChangesResult:
+        """Applies all changes atomically; raises and changes nothing if any of them fails."""
+        pass
+
+    @abstractmethod
+    def checkout(self, user_id: int, idempotency_key: Optional[str] = None) -> None:
+        """Takes every entry of the cart out of stock, or raises and takes none.
+
+        A checkout repeated with the same `idempotency_key`, e.g. after a
+        timeout, takes nothing more.
+        """
         pass
 
     @abstractmethod
@@ -49,3 +137,32 @@ class CartManager(ABC):
     @abstractmethod
     def get_current_product_counts(self) -> dict[int, int]:
         pass
+
+    @abstractmethod
+    def get_product_counts(self, product_ids: list[int]) -> dict[int, int]:
+        """Counts of the given products; products the cart manager does not know are left out."""
+        pass
+
+    @abstractmethod
+    def get_state_digest(self, bucket_count: int) -> CartManagerStateDigest:
+        pass
+
+    @abstractmethod
+    def upsert_products(
+        self, total_count_by_product_id: dict[int, int], base_version: str
+    ) -> str:
+        """Sets total counts, adding unknown products, and returns the new version.
+
+        Raises `CartManagerStateChangedException` when the state is no longer at `base_version`.
+        """
+        pass
+
+    @abstractmethod
+    def apply_availability_deltas(
+        self, delta_by_product_id: dict[int, int], base_version: str
+    ) -> str:
+        """Moves total counts by the deltas and returns the new version.
+
+        Raises `CartManagerStateChangedException` when the state is no longer at `base_version`.
+        """
+        pass
@@ -0,0 +1,210 @@
+from dataclasses import dataclass
+import random
+import socket
+import threading
+import time
+from typing import Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from zwpa.workflows.retail.CartManager import (
+    CartManagerResponseException,
+    CartManagerUnavailableException,
+)
+
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE"})
+RETRIED_STATUS_CODES = frozenset({502, 503, 504})
+
+
+@dataclass
+class OperationStatistics:
+    calls: int = 0
+    errors: int = 0
+    retries: int = 0
+    total_latency_in_seconds: float = 0.0
+    max_latency_in_seconds: float = 0.0
+
+    @property
+    def mean_latency_in_seconds(self) -> float:
+        return self.total_latency_in_seconds / self.calls if self.calls else 0.0
+
+
+class CartManagerClient:
+    """HTTP client of the cart manager that keeps connections open between requests.
+
+    Connections are pooled per host, up to `pool_size` of them. Idempotent
+    requests that fail to connect, time out or get a 502, 503 or 504 are
+    retried up to `max_retries` times, after a random pause of up to
+    `retry_backoff_in_seconds` that doubles with every attempt. Any other
+    non-2xx response raises `CartManagerResponseException`, unless its status
+    is one of the `accepted_status_codes` of the request.
+
+    Every request is counted under its `operation` name in `statistics`.
+
+    With `unix_socket_path`, every `http://` request goes to the cart manager
+    listening on that Unix domain socket, whatever host the URL names.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        connect_timeout_in_seconds: float = 1.0,
+        read_timeout_in_seconds: float = 5.0,
+        max_retries: int = 2,
+        retry_backoff_in_seconds: float = 0.05,
+        unix_socket_path: Optional[str] = None,
+    ) -> None:
+        self.connect_timeout_in_seconds = connect_timeout_in_seconds
+        self.read_timeout_in_seconds = read_timeout_in_seconds
+        self.max_retries = max_retries
+        self.retry_backoff_in_seconds = retry_backoff_in_seconds
+        self.statistics: dict[str, OperationStatistics] = {}
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        if unix_socket_path is not None:
+            self._session.mount("http://", UnixSocketAdapter(unix_socket_path, pool_size))
+        self._statistics_lock = threading.Lock()
+
+    def request(
+        self,
+        operation: str,
+        method: str,
+        url: str,
+        params: Optional[dict[str, Any]] = None,
+        json: Any = None,
+        idempotent: Optional[bool] = None,
+        accepted_status_codes: frozenset[int] = frozenset(),
+        read_timeout_in_seconds: Optional[float] = None,
+    ) -> requests.Response:
+        started_at = time.perf_counter()
+        failed = True
+        try:
+            response = self._send(
+                operation,
+                method,
+                url,
+                params=params,
+                json=json,
+                idempotent=method in IDEMPOTENT_METHODS if idempotent is None else idempotent,
+                timeout=(
+                    self.connect_timeout_in_seconds,
+                    read_timeout_in_seconds or self.read_timeout_in_seconds,
+                ),
+            )
+            if not response.ok and response.status_code not in accepted_status_codes:
+                raise CartManagerResponseException(
+                    operation, response.status_code, _detail(response)
+                )
+            failed = False
+            return response
+        finally:
+            self._record(operation, time.perf_counter() - started_at, failed)
+
+    def close(self) -> None:
+        self._session.close()
+
+    def _send(
+        self,
+        operation: str,
+        method: str,
+        url: str,
+        params: Optional[dict[str, Any]],
+        json: Any,
+        idempotent: bool,
+        timeout: tuple[float, float],
+    ) -> requests.Response:
+        attempts = self.max_retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            is_last_attempt = attempt + 1 == attempts
+            if attempt > 0:
+                self._record_retry(operation)
+                # full jitter, so clients that failed together do not retry together
+                time.sleep(random.uniform(0, self.retry_backoff_in_seconds * 2 ** (attempt - 1)))
+            try:
+                response = self._session.request(
+                    method, url, params=params, json=json, timeout=timeout
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if is_last_attempt:
+                    raise CartManagerUnavailableException(f"{operation}: {e}") from e
+                continue
+            if response.status_code not in RETRIED_STATUS_CODES or is_last_attempt:
+                return response
+        raise AssertionError("every attempt either returns or raises")
+
+    def _record(self, operation: str, latency_in_seconds: float, failed: bool) -> None:
+        with self._statistics_lock:
+            statistics = self.statistics.setdefault(operation, OperationStatistics())
+            statistics.calls += 1
+            statistics.errors += failed
+            statistics.total_latency_in_seconds += latency_in_seconds
+            statistics.max_latency_in_seconds = max(
+                statistics.max_latency_in_seconds, latency_in_seconds
+            )
+
+    def _record_retry(self, operation: str) -> None:
+        with self._statistics_lock:
+            self.statistics.setdefault(operation, OperationStatistics()).retries += 1
+
+
+def _detail(response: requests.Response) -> str:
+    try:
+        return str(response.json()["detail"])
+    except (ValueError, KeyError, TypeError):
+        return response.text
+
+
+class UnixSocketConnection(HTTPConnection):
+    def __init__(self, *args: Any, socket_path: str, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+        except socket.timeout as e:
+            sock.close()
+            raise ConnectTimeoutError(
+                self, f"Connection to {self.socket_path} timed out"
+            ) from e
+        except OSError as e:
+            sock.close()
+            raise NewConnectionError(
+                self, f"Failed to establish a new connection: {e}"
+            ) from e
+        return sock
+
+
+class UnixSocketConnectionPool(HTTPConnectionPool):
+    ConnectionCls = UnixSocketConnection
+
+
+class UnixSocketAdapter(HTTPAdapter):
+    """Sends requests over a single pool of Unix domain socket connections."""
+
+    def __init__(self, socket_path: str, pool_size: int = 10) -> None:
+        super().__init__()
+        self._pool = UnixSocketConnectionPool(
+            "localhost", maxsize=pool_size, socket_path=socket_path
+        )
+
+    def get_connection(self, url: str, proxies: Optional[dict] = None):
+        return self._pool
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        # takes the place of `get_connection` since requests 2.32
+        return self._pool
+
+    def close(self) -> None:
+        super().close()
+        self._pool.close()
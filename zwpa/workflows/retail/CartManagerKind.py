@@ -0,0 +1,6 @@
+from enum import Enum
+
+
+class CartManagerKind(str, Enum):
+    REST = "REST"
+    IN_PROCESS = "IN_PROCESS"
@@ -1,16 +1,35 @@
+import asyncio
+from typing import TYPE_CHECKING, Iterable, Mapping, Optional
 from sqlalchemy.orm import sessionmaker, Session
 from zwpa.model import Product
-from zwpa.workflows.retail.CartManager import CartManager
+from zwpa.workflows.retail.AsyncCartManager import AsyncCartManager
+from zwpa.workflows.retail.AvailabilityMirror import AvailabilityMirror
+from zwpa.workflows.retail.CartManager import (
+    Cart,
+    CartManager,
+    ProductCountsUnreadableException,
+)
 from zwpa.workflows.retail.RetailProductView import PersonalizedRetailProductView
 from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
 
+if TYPE_CHECKING:
+    from zwpa.workflows.retail.SharedMemoryAvailability import SharedMemoryAvailability
+
 
 class GetPersonalizedRetailProductViewsWorkflow:
     def __init__(
-        self, session_maker: sessionmaker[Session], cart_manager: CartManager
+        self,
+        session_maker: sessionmaker[Session],
+        cart_manager: CartManager,
+        availability_mirror: Optional[
+            "AvailabilityMirror | SharedMemoryAvailability"
+        ] = None,
+        async_cart_manager: Optional[AsyncCartManager] = None,
     ) -> None:
         self.session_maker = session_maker
         self.cart_manager = cart_manager
+        self.availability_mirror = availability_mirror
+        self.async_cart_manager = async_cart_manager
 
         self.user_role_checker = UserRoleChecker(self.session_maker)
 
@@ -18,23 +37,97 @@ class GetPersonalizedRetailProductViewsWorkflow:
         self, user_id: int, query: str = "", only_already_in_cart: bool = False
     ) -> list[PersonalizedRetailProductView]:
         # TODO: Check for permissions
+        user_cart = self.cart_manager.get_cart(user_id)
+        products = self._get_products(
+            query,
+            user_cart.amount_by_product_id.keys() if only_already_in_cart else None,
+        )
+        current_product_counts = (
+            self.availability_mirror.get_current_product_counts()
+            if self._is_mirror_readable()
+            else self.cart_manager.get_current_product_counts()
+        )
+        try:
+            return self._to_views(products, user_cart, current_product_counts)
+        except ProductCountsUnreadableException:
+            return self._to_views(
+                products, user_cart, self.cart_manager.get_current_product_counts()
+            )
+
+    async def get_personalized_retail_product_views_async(
+        self, user_id: int, query: str = "", only_already_in_cart: bool = False
+    ) -> list[PersonalizedRetailProductView]:
+        """Same as `get_personalized_retail_product_views`, with the cart, the
+        product counts and the products read at the same time.
+
+        Only products already in the cart depend on the cart, so the query
+        for them waits for it and runs alongside reading the counts. Without
+        an asynchronous cart manager, the blocking workflow runs in a thread.
+        """
+        if self.async_cart_manager is None:
+            return await asyncio.to_thread(
+                self.get_personalized_retail_product_views,
+                user_id,
+                query=query,
+                only_already_in_cart=only_already_in_cart,
+            )
+        if only_already_in_cart:
+            user_cart = await self.async_cart_manager.get_cart(user_id)
+            products, current_product_counts = await asyncio.gather(
+                asyncio.to_thread(
+                    self._get_products, query, list(user_cart.amount_by_product_id)
+                ),
+                self._get_current_product_counts_async(),
+            )
+        else:
+            user_cart, products, current_product_counts = await asyncio.gather(
+                self.async_cart_manager.get_cart(user_id),
+                asyncio.to_thread(self._get_products, query, None),
+                self._get_current_product_counts_async(),
+            )
+        try:
+            return self._to_views(products, user_cart, current_product_counts)
+        except ProductCountsUnreadableException:
+            return self._to_views(
+                products,
+                user_cart,
+                await self.async_cart_manager.get_current_product_counts(),
+            )
+
+    async def _get_current_product_counts_async(self) -> Mapping[int, int]:
+        if self._is_mirror_readable():
+            return self.availability_mirror.get_current_product_counts()
+        return await self.async_cart_manager.get_current_product_counts()
+
+    def _is_mirror_readable(self) -> bool:
+        return (
+            self.availability_mirror is not None
+            and self.availability_mirror.is_synchronized
+        )
+
+    def _get_products(
+        self, query: str, product_ids: Optional[Iterable[int]]
+    ) -> list[Product]:
         with self.session_maker() as session:
-            user_cart = self.cart_manager.get_cart(user_id)
             sql_query = session.query(Product).where(Product.label.like(f"%{query}%"))
-            if only_already_in_cart:
-                sql_query = sql_query.where(
-                    Product.id.in_(user_cart.amount_by_product_id.keys())
-                )
-            products = sql_query.all()
-            current_product_counts = self.cart_manager.get_current_product_counts()
-            return [
-                PersonalizedRetailProductView(
-                    id=product.id,
-                    label=product.label,
-                    price=product.retail_price,
-                    unit=product.unit,
-                    already_in_cart=user_cart.amount_by_product_id.get(product.id, 0),
-                    available=current_product_counts[product.id],
-                )
-                for product in products
-            ]
+            if product_ids is not None:
+                sql_query = sql_query.where(Product.id.in_(product_ids))
+            return sql_query.all()
+
+    def _to_views(
+        self,
+        products: list[Product],
+        user_cart: Cart,
+        current_product_counts: Mapping[int, int],
+    ) -> list[PersonalizedRetailProductView]:
+        return [
+            PersonalizedRetailProductView(
+                id=product.id,
+                label=product.label,
+                price=product.retail_price,
+                unit=product.unit,
+                already_in_cart=user_cart.amount_by_product_id.get(product.id, 0),
+                available=current_product_counts.get(product.id, 0),
+            )
+            for product in products
+        ]
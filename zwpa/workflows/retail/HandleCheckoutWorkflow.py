@@ -1,4 +1,5 @@
 from datetime import time, timedelta
+from uuid import uuid4
 from sqlalchemy.orm import sessionmaker, Session
 from zwpa.model import (
     Location,
@@ -71,7 +72,8 @@ class HandleCheckoutWorkflow:
                     order,
                     amount_from_warehouse_by_warehouse_product_id,
                 )
-            self.cart_manager.checkout(user_id)
+            # nothing is committed unless the whole cart was checked out
+            self.cart_manager.checkout(user_id, idempotency_key=uuid4().hex)
             session.commit()
 
     def reduce_product_amount_in_warehouses(
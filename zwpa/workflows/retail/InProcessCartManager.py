@@ -0,0 +1,305 @@
+from contextlib import contextmanager
+import fcntl
+from logging import INFO, getLogger
+import threading
+import time
+from typing import Optional
+
+from cart_manager import store as cart_store
+from cart_manager.store import (
+    CartEntryHandler,
+    CartStore,
+    ProductId,
+    UserId,
+    decrement_count,
+    increment_count,
+)
+from zwpa.workflows.retail.AsyncCartManager import AsyncCartManager
+from zwpa.workflows.retail.CartManager import (
+    CHECKSUM_MODULUS,
+    Cart,
+    CartChange,
+    CartChangesResult,
+    CartManager,
+    CartManagerStateChangedException,
+    CartManagerStateDigest,
+    InvalidCartChangeException,
+    NotEnoughProductCountAvailableException,
+    ProductNotFoundException,
+)
+
+
+class InProcessCartManager(CartManager):
+    """Cart manager kept in the memory of the main server, for single node deployments.
+
+    Carts and product counts live in the same `CartStore` the standalone
+    cart manager uses, so reservations follow exactly the same rules, only
+    without serialization or a network hop. Every operation holds one lock
+    for the few microseconds it takes. Nothing is persisted: after a restart
+    carts are empty and product counts are initialized from the warehouse.
+
+    Carts not changed for `session_expiration_time_in_seconds` are discarded
+    by a background thread, started with `start`.
+
+    Each server process would keep carts of its own and sell the same units
+    again, so with `lock_path` set `start` takes an exclusive lock on that
+    file and refuses to start when another process on the host holds it.
+    """
+
+    def __init__(
+        self,
+        session_expiration_time_in_seconds: float = 900.0,
+        session_refresh_interval_in_seconds: float = 30.0,
+        lock_path: Optional[str] = None,
+    ) -> None:
+        self.session_expiration_time_in_seconds = session_expiration_time_in_seconds
+        self.session_refresh_interval_in_seconds = session_refresh_interval_in_seconds
+        self.lock_path = lock_path
+        self.store = CartStore()
+
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+        self._lock_file = None
+        self._logger = getLogger("in-process-cart-manager")
+        self._logger.setLevel(INFO)
+
+    def start(self) -> None:
+        if self._sweeper is not None:
+            return
+        if self.lock_path is not None:
+            self._acquire_single_process_lock(self.lock_path)
+        self._closing.clear()
+        self._sweeper = threading.Thread(
+            target=self._discard_old_carts_periodically,
+            name="in-process-cart-manager-sweeper",
+            daemon=True,
+        )
+        self._sweeper.start()
+
+    def close(self) -> None:
+        self._closing.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+        if self._lock_file is not None:
+            # closing the file releases the lock
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _acquire_single_process_lock(self, lock_path: str) -> None:
+        lock_file = open(lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise RuntimeError(
+                f"{lock_path} is locked by another server process; "
+                "the in-process cart manager needs a single server process "
+                "(uvicorn --workers 1)"
+            )
+        self._lock_file = lock_file
+
+    def initialize(self, available_count_by_product_id: dict[int, int]) -> None:
+        with self._lock:
+            self.store.load(
+                {
+                    "state_by_product": {
+                        product_id: {"product_id": product_id, "total_count": total_count}
+                        for product_id, total_count in available_count_by_product_id.items()
+                    }
+                }
+            )
+
+    def put_in_cart(self, product_id: int, user_id: int) -> None:
+        self._modify_cart_entry(user_id, product_id, increment_count)
+
+    def remove_from_cart(self, product_id: int, user_id: int) -> None:
+        self._modify_cart_entry(user_id, product_id, decrement_count)
+
+    def get_cart(self, user_id: int) -> Cart:
+        with self._lock:
+            cart = self.store.cart_by_user_id.get(UserId(user_id))
+            return Cart(
+                user_id=user_id,
+                amount_by_product_id=dict(cart.unit_count_by_product_id)
+                if cart is not None
+                else {},
+            )
+
+    def apply_cart_changes(
+        self, user_id: int, changes: list[CartChange]
+    ) -> CartChangesResult:
+        with self._lock, _translated_store_exceptions():
+            unit_count_by_product_id = self.store.resolve_cart_changes(
+                UserId(user_id),
+                [
+                    (ProductId(change.product_id), change.delta, change.quantity)
+                    for change in changes
+                ],
+            )
+            self.store.apply_cart_changes(
+                UserId(user_id), unit_count_by_product_id, now=time.time()
+            )
+            return CartChangesResult(
+                cart=Cart(
+                    user_id=user_id,
+                    amount_by_product_id=dict(
+                        self.store.cart_by_user_id[UserId(user_id)].unit_count_by_product_id
+                    ),
+                ),
+                available_count_by_product_id={
+                    product_id: self.store.product_by_id[product_id].total_count
+                    for product_id in unit_count_by_product_id
+                },
+            )
+
+    def checkout(self, user_id: int, idempotency_key: Optional[str] = None) -> None:
+        with self._lock, _translated_store_exceptions():
+            if (
+                idempotency_key is not None
+                and self.store.completed_checkout(UserId(user_id), idempotency_key)
+                is not None
+            ):
+                return
+            unit_count_by_product_id = self.store.prepare_checkout(UserId(user_id))
+            self.store.commit_checkout(
+                UserId(user_id), unit_count_by_product_id, idempotency_key
+            )
+
+    def reduce_available_count(self, product_id: int, amount: int) -> None:
+        with self._lock, _translated_store_exceptions():
+            self.store.reduce_total_count(ProductId(product_id), amount)
+
+    def increase_available_count(self, product_id: int, amount: int) -> None:
+        with self._lock:
+            self.store.increase_total_count(ProductId(product_id), amount)
+
+    def get_current_product_counts(self) -> dict[int, int]:
+        with self._lock:
+            return {
+                product_id: product.total_count
+                for product_id, product in self.store.product_by_id.items()
+            }
+
+    def get_product_counts(self, product_ids: list[int]) -> dict[int, int]:
+        with self._lock:
+            return {
+                product_id: self.store.product_by_id[ProductId(product_id)].total_count
+                for product_id in product_ids
+                if product_id in self.store.product_by_id
+            }
+
+    def get_state_digest(self, bucket_count: int) -> CartManagerStateDigest:
+        with self._lock:
+            availability_checksums, membership_checksums = self.store.checksums(
+                bucket_count
+            )
+            return CartManagerStateDigest(
+                version=str(self.store.version),
+                product_count=len(self.store.product_by_id),
+                checksums=[
+                    (availability_checksum + membership_checksum) % CHECKSUM_MODULUS
+                    for availability_checksum, membership_checksum in zip(
+                        availability_checksums, membership_checksums
+                    )
+                ],
+            )
+
+    def upsert_products(
+        self, total_count_by_product_id: dict[int, int], base_version: str
+    ) -> str:
+        with self._lock:
+            self._ensure_base_version(base_version)
+            for product_id, total_count in total_count_by_product_id.items():
+                self.store.upsert_product(ProductId(product_id), total_count)
+            return str(self.store.version)
+
+    def apply_availability_deltas(
+        self, delta_by_product_id: dict[int, int], base_version: str
+    ) -> str:
+        with self._lock:
+            self._ensure_base_version(base_version)
+            for product_id, delta in delta_by_product_id.items():
+                self.store.increase_total_count(ProductId(product_id), delta)
+            return str(self.store.version)
+
+    def discard_old_carts(self, now: float) -> None:
+        oldest_allowed_timestamp = now - self.session_expiration_time_in_seconds
+        with self._lock:
+            for user_id in self.store.expiry_index.pop_expired(
+                oldest_allowed_timestamp, self.store.cart_by_user_id
+            ):
+                self._logger.info(f"Removing session data for {user_id=}")
+                self.store.discard_cart(user_id)
+            if self.store.expiry_index.needs_compaction(len(self.store.cart_by_user_id)):
+                self.store.expiry_index.rebuild(self.store.cart_by_user_id)
+
+    def _discard_old_carts_periodically(self) -> None:
+        while not self._closing.wait(self.session_refresh_interval_in_seconds):
+            self.discard_old_carts(time.time())
+
+    def _modify_cart_entry(
+        self, user_id: int, product_id: int, handler: CartEntryHandler
+    ) -> None:
+        with self._lock, _translated_store_exceptions():
+            self.store.modify_cart_entry(
+                UserId(user_id), ProductId(product_id), handler, now=time.time()
+            )
+
+    def _ensure_base_version(self, base_version: str) -> None:
+        if int(base_version) != self.store.version:
+            raise CartManagerStateChangedException(
+                f"State is at version {self.store.version}, not {base_version}"
+            )
+
+
+@contextmanager
+def _translated_store_exceptions():
+    # the store raises its own exceptions, callers expect the ones raised by
+    # every other cart manager, with the same messages
+    try:
+        yield
+    except cart_store.ProductNotFoundException as e:
+        raise ProductNotFoundException(f"Product {e.product_id} not found") from e
+    except cart_store.NotEnoughProductCountAvailableException as e:
+        raise NotEnoughProductCountAvailableException(
+            f"Not enough units of product {e.product_id}"
+        ) from e
+    except ValueError as e:
+        raise InvalidCartChangeException(str(e)) from e
+
+
+class AsyncInProcessCartManager(AsyncCartManager):
+    """Serves the asynchronous cart operations straight from an `InProcessCartManager`.
+
+    Its operations never wait on anything but its lock, briefly, so they
+    are called on the event loop rather than handed over to a thread.
+    """
+
+    def __init__(self, cart_manager: InProcessCartManager) -> None:
+        super().__init__()
+        self.cart_manager = cart_manager
+
+    async def put_in_cart(self, product_id: int, user_id: int) -> None:
+        self.cart_manager.put_in_cart(product_id=product_id, user_id=user_id)
+
+    async def remove_from_cart(self, product_id: int, user_id: int) -> None:
+        self.cart_manager.remove_from_cart(product_id=product_id, user_id=user_id)
+
+    async def get_cart(self, user_id: int) -> Cart:
+        return self.cart_manager.get_cart(user_id)
+
+    async def apply_cart_changes(
+        self, user_id: int, changes: list[CartChange]
+    ) -> CartChangesResult:
+        return self.cart_manager.apply_cart_changes(user_id, changes)
+
+    async def checkout(self, user_id: int, idempotency_key: Optional[str] = None) -> None:
+        self.cart_manager.checkout(user_id, idempotency_key)
+
+    async def get_current_product_counts(self) -> dict[int, int]:
+        return self.cart_manager.get_current_product_counts()
+
+    async def get_product_counts(self, product_ids: list[int]) -> dict[int, int]:
+        return self.cart_manager.get_product_counts(product_ids)
@@ -1,16 +1,47 @@
 from sqlalchemy import func, select
 from sqlalchemy.orm import sessionmaker, Session
 from zwpa.model import Product, WarehouseProduct
-from zwpa.workflows.retail.CartManager import CartManager
+from zwpa.workflows.retail.CartManager import (
+    CartManager,
+    CartManagerStateChangedException,
+    availability_checksums,
+)
 from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
 
 
 class InitializeCartManagerWorkflow:
-    def __init__(self, session_maker: sessionmaker[Session], cart_manager: CartManager) -> None:
+    """Brings product counts of the cart manager in line with the warehouse.
+
+    An empty cart manager gets the whole state at once. One that already
+    holds state, e.g. when only the main server was redeployed, keeps its
+    carts: only products in buckets whose checksums differ are read back,
+    and only the differences are sent, guarded by the state version.
+    """
+
+    def __init__(
+        self,
+        session_maker: sessionmaker[Session],
+        cart_manager: CartManager,
+        bucket_count: int = 1024,
+        max_attempts: int = 3,
+    ) -> None:
         self.cart_manager = cart_manager
         self.session_maker = session_maker
+        self.bucket_count = bucket_count
+        self.max_attempts = max_attempts
 
     def initialize_cart_manager(self) -> None:
+        available_count_by_product_id = self._get_available_count_by_product_id()
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self._synchronize(available_count_by_product_id)
+                return
+            except CartManagerStateChangedException:
+                # counts changed between reading and writing them, e.g. a checkout
+                if attempt == self.max_attempts:
+                    raise
+
+    def _get_available_count_by_product_id(self) -> dict[int, int]:
         with self.session_maker() as session:
             query = (
                 select(
@@ -22,9 +53,42 @@ class InitializeCartManagerWorkflow:
                 .join(WarehouseProduct, isouter=True)
                 .group_by(Product.id)
             )
-            self.cart_manager.initialize(
-                available_count_by_product_id={
-                    product_id: available_count
-                    for product_id, available_count in session.execute(query).all()
-                }
-            )
+            return {
+                product_id: available_count
+                for product_id, available_count in session.execute(query).all()
+            }
+
+    def _synchronize(self, available_count_by_product_id: dict[int, int]) -> None:
+        digest = self.cart_manager.get_state_digest(self.bucket_count)
+        if digest.product_count == 0:
+            self.cart_manager.initialize(available_count_by_product_id)
+            return
+        expected_checksums = availability_checksums(
+            available_count_by_product_id, self.bucket_count
+        )
+        outdated_product_ids = [
+            product_id
+            for product_id in available_count_by_product_id
+            if expected_checksums[product_id % self.bucket_count]
+            != digest.checksums[product_id % self.bucket_count]
+        ]
+        if not outdated_product_ids:
+            return
+        current_count_by_product_id = self.cart_manager.get_product_counts(
+            outdated_product_ids
+        )
+        version = digest.version
+        missing_products = {
+            product_id: available_count_by_product_id[product_id]
+            for product_id in outdated_product_ids
+            if product_id not in current_count_by_product_id
+        }
+        if missing_products:
+            version = self.cart_manager.upsert_products(missing_products, version)
+        deltas = {
+            product_id: available_count_by_product_id[product_id] - current_count
+            for product_id, current_count in current_count_by_product_id.items()
+            if available_count_by_product_id[product_id] != current_count
+        }
+        if deltas:
+            self.cart_manager.apply_availability_deltas(deltas, version)
@@ -1,17 +1,23 @@
-from typing import Callable
+import asyncio
+from typing import Callable, Optional
 from sqlalchemy.orm import sessionmaker, Session
 from zwpa.model import Product
-from zwpa.workflows.retail.CartManager import CartManager
+from zwpa.workflows.retail.AsyncCartManager import AsyncCartManager
+from zwpa.workflows.retail.CartManager import CartChange, CartManager
 from zwpa.workflows.retail.RetailProductView import PersonalizedRetailProductView
 from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
 
 
 class ModifyCartWorkflow:
     def __init__(
-        self, session_maker: sessionmaker[Session], cart_manager: CartManager
+        self,
+        session_maker: sessionmaker[Session],
+        cart_manager: CartManager,
+        async_cart_manager: Optional[AsyncCartManager] = None,
     ) -> None:
         self.session_maker = session_maker
         self.cart_manager = cart_manager
+        self.async_cart_manager = async_cart_manager
 
         self.user_role_checker = UserRoleChecker(self.session_maker)
 
@@ -20,3 +26,31 @@ class ModifyCartWorkflow:
 
     def take_from_cart(self, user_id: int, product_id: int) -> None:
         self.cart_manager.remove_from_cart(product_id=product_id, user_id=user_id)
+
+    def set_amount_in_cart(self, user_id: int, product_id: int, amount: int) -> None:
+        self.cart_manager.apply_cart_changes(
+            user_id, changes=[CartChange(product_id=product_id, quantity=amount)]
+        )
+
+    async def put_into_cart_async(self, user_id: int, product_id: int) -> None:
+        if self.async_cart_manager is None:
+            return await asyncio.to_thread(self.put_into_cart, user_id, product_id)
+        await self.async_cart_manager.put_in_cart(product_id=product_id, user_id=user_id)
+
+    async def take_from_cart_async(self, user_id: int, product_id: int) -> None:
+        if self.async_cart_manager is None:
+            return await asyncio.to_thread(self.take_from_cart, user_id, product_id)
+        await self.async_cart_manager.remove_from_cart(
+            product_id=product_id, user_id=user_id
+        )
+
+    async def set_amount_in_cart_async(
+        self, user_id: int, product_id: int, amount: int
+    ) -> None:
+        if self.async_cart_manager is None:
+            return await asyncio.to_thread(
+                self.set_amount_in_cart, user_id, product_id, amount
+            )
+        await self.async_cart_manager.apply_cart_changes(
+            user_id, changes=[CartChange(product_id=product_id, quantity=amount)]
+        )
@@ -1,8 +1,26 @@
 from dataclasses import asdict
 from datetime import datetime
+from typing import Optional
 from pydantic import BaseModel
-import requests
-from zwpa.workflows.retail.CartManager import Cart, CartManager
+from requests import Response
+from zwpa.workflows.retail.CartManager import (
+    CHECKSUM_MODULUS,
+    Cart,
+    CartChange,
+    CartChangesResult,
+    CartManager,
+    CartManagerStateChangedException,
+    CartManagerStateDigest,
+    InvalidCartChangeException,
+    NotEnoughProductCountAvailableException,
+    ProductNotFoundException,
+)
+from zwpa.workflows.retail.CartManagerClient import CartManagerClient
+
+
+PRODUCT_IDS_PER_REQUEST = 500
+POLL_TIMEOUT_MARGIN_IN_SECONDS = 5
+CART_ERROR_STATUS_CODES = frozenset({404, 409, 422})
 
 
 class RestCartEntry(BaseModel):
@@ -13,6 +31,15 @@ class RestCart(BaseModel):
     entries_by_product_id: dict[int, RestCartEntry]
     last_update: datetime
 
+    def to_cart(self, user_id: int) -> Cart:
+        return Cart(
+            user_id=user_id,
+            amount_by_product_id={
+                product_id: entry.unit_count
+                for product_id, entry in self.entries_by_product_id.items()
+            },
+        )
+
 
 class RestProductState(BaseModel):
     product_id: int
@@ -20,62 +47,322 @@ class RestProductState(BaseModel):
     already_put: int = 0
 
 
+class RestCartChangesResult(BaseModel):
+    cart: RestCart
+    state_by_product: dict[int, RestProductState]
+
+
+class RestAvailabilityChanges(BaseModel):
+    version: int
+    complete: bool
+    total_count_by_product_id: dict[int, int]
+
+
+class RestStateDigest(BaseModel):
+    version: int
+    product_count: int
+    availability_checksums: list[int]
+    membership_checksums: list[int]
+
+
 class RestCartManager(CartManager):
-    def __init__(self, manager_url: str, manager_access_key: str) -> None:
+    """Client of the cart manager, or of a sharded cart manager when given
+    more than one shard URL.
+
+    Carts are partitioned over shards by user id hash, so every cart
+    request goes to a single shard. Each shard holds a slice of every
+    product's total count and borrows units from the others when its slice
+    runs out, so product counts are split on initialization and summed up
+    when read.
+    """
+
+    def __init__(
+        self,
+        manager_url: str,
+        manager_access_key: str,
+        shard_urls: Optional[list[str]] = None,
+        client: Optional[CartManagerClient] = None,
+    ) -> None:
         super().__init__()
         self.manager_url = manager_url
         self.manager_access_key = manager_access_key
+        self.shard_urls = shard_urls or [manager_url]
+        self.client = client or CartManagerClient()
+
+    def user_shard_url(self, user_id: int) -> str:
+        return self.shard_urls[hash(user_id) % len(self.shard_urls)]
+
+    def product_shard_url(self, product_id: int) -> str:
+        return self.shard_urls[hash(product_id) % len(self.shard_urls)]
 
     def initialize(self, available_count_by_product_id: dict[int, int]) -> None:
-        requests.put(
-            f"{self.manager_url}/state",
-            json={
-                "cart_by_user_id": {},
-                "state_by_product": {
-                    product_id: {
-                        "product_id": product_id,
-                        "total_count": total_count,
-                        "already_put": 0,
-                    }
-                    for product_id, total_count in available_count_by_product_id.items()
+        shard_count = len(self.shard_urls)
+        for shard_index, shard_url in enumerate(self.shard_urls):
+            self.client.request(
+                "initialize",
+                "PUT",
+                f"{shard_url}/state",
+                json={
+                    "cart_by_user_id": {},
+                    "state_by_product": {
+                        product_id: {
+                            "product_id": product_id,
+                            "total_count": total_count // shard_count
+                            + (1 if shard_index < total_count % shard_count else 0),
+                            "already_put": 0,
+                        }
+                        for product_id, total_count in available_count_by_product_id.items()
+                    },
                 },
-            },
-        )
+            )
 
     def put_in_cart(self, product_id: int, user_id: int) -> None:
-        requests.post(f"{self.manager_url}/cart/{user_id}/{product_id}/increment")
+        self._raise_for_cart_error(
+            self.client.request(
+                "put_in_cart",
+                "POST",
+                f"{self.user_shard_url(user_id)}/cart/{user_id}/{product_id}/increment",
+                accepted_status_codes=CART_ERROR_STATUS_CODES,
+            )
+        )
 
     def remove_from_cart(self, product_id: int, user_id: int) -> None:
-        requests.post(f"{self.manager_url}/cart/{user_id}/{product_id}/decrement")
+        self._raise_for_cart_error(
+            self.client.request(
+                "remove_from_cart",
+                "POST",
+                f"{self.user_shard_url(user_id)}/cart/{user_id}/{product_id}/decrement",
+                accepted_status_codes=CART_ERROR_STATUS_CODES,
+            )
+        )
 
     def get_cart(self, user_id: int) -> Cart:
-        response = requests.get(f"{self.manager_url}/cart/{user_id}")
-        rest_cart = RestCart(**response.json())
-        return Cart(
-            user_id=user_id,
-            amount_by_product_id={
-                product_id: entry.unit_count
-                for product_id, entry in rest_cart.entries_by_product_id.items()
-            },
+        response = self.client.request(
+            "get_cart", "GET", f"{self.user_shard_url(user_id)}/cart/{user_id}"
         )
+        return RestCart(**response.json()).to_cart(user_id)
 
-    def checkout(self, user_id: int) -> None:
-        requests.post(f"{self.manager_url}/cart/{user_id}/checkout")
+    def apply_cart_changes(
+        self, user_id: int, changes: list[CartChange]
+    ) -> CartChangesResult:
+        response = self.client.request(
+            "apply_cart_changes",
+            "POST",
+            f"{self.user_shard_url(user_id)}/cart/{user_id}/batch",
+            json={"changes": [change.model_dump() for change in changes]},
+            accepted_status_codes=CART_ERROR_STATUS_CODES,
+        )
+        self._raise_for_cart_error(response)
+
+        result = RestCartChangesResult(**response.json())
+        available_count_by_product_id = {
+            product_id: product_state.total_count
+            for product_id, product_state in result.state_by_product.items()
+        }
+        if len(self.shard_urls) > 1:
+            available_count_by_product_id = self._sum_product_counts(
+                list(available_count_by_product_id)
+            )
+        return CartChangesResult(
+            cart=result.cart.to_cart(user_id),
+            available_count_by_product_id=available_count_by_product_id,
+        )
+
+    def checkout(self, user_id: int, idempotency_key: Optional[str] = None) -> None:
+        # with a key, a checkout that went through is not repeated by a retry
+        self._raise_for_cart_error(
+            self.client.request(
+                "checkout",
+                "POST",
+                f"{self.user_shard_url(user_id)}/cart/{user_id}/checkout",
+                params={"idempotency_key": idempotency_key} if idempotency_key else None,
+                idempotent=idempotency_key is not None,
+                accepted_status_codes=CART_ERROR_STATUS_CODES,
+            )
+        )
 
     def reduce_available_count(self, product_id: int, amount: int) -> None:
-        requests.post(f"{self.manager_url}/product/{product_id}/reduce?amount={amount}")
+        if len(self.shard_urls) == 1:
+            self.client.request(
+                "reduce_available_count",
+                "POST",
+                f"{self.manager_url}/product/{product_id}/reduce",
+                params={"amount": amount},
+            )
+            return
+        # units in no cart are taken from any shard first, whatever is left is
+        # taken from the product's home shard, as in the unsharded cart manager
+        for shard_url in self.shard_urls:
+            if amount <= 0:
+                return
+            response = self.client.request(
+                "release_escrowed_count",
+                "POST",
+                f"{shard_url}/product/{product_id}/escrow/release",
+                params={"amount": amount},
+            )
+            amount -= response.json()["released"]
+        if amount > 0:
+            self.client.request(
+                "reduce_available_count",
+                "POST",
+                f"{self.product_shard_url(product_id)}/product/{product_id}/reduce",
+                params={"amount": amount},
+            )
 
     def increase_available_count(self, product_id: int, amount: int) -> None:
-        requests.post(
-            f"{self.manager_url}/product/{product_id}/increase?amount={amount}"
-        )
+        # every shard has to know the product, the other ones borrow from its
+        # home shard once they need any units of it
+        for shard_url in self.shard_urls:
+            shard_amount = amount if shard_url == self.product_shard_url(product_id) else 0
+            self.client.request(
+                "increase_available_count",
+                "POST",
+                f"{shard_url}/product/{product_id}/increase",
+                params={"amount": shard_amount},
+            )
 
     def get_current_product_counts(self) -> dict[int, int]:
-        response = requests.get(f"{self.manager_url}/products")
-        if not response.ok:
-            raise RuntimeError()
+        return self._sum_product_counts()
 
-        return {
-            int(product_id): RestProductState(**state).total_count
-            for product_id, state in response.json().items()
-        }
+    def get_product_counts(self, product_ids: list[int]) -> dict[int, int]:
+        return self._sum_product_counts(product_ids)
+
+    def poll_availability_changes(
+        self, shard_url: str, since: Optional[int], timeout_in_seconds: float
+    ) -> RestAvailabilityChanges:
+        """Waits up to `timeout_in_seconds` for counts on one shard to change after `since`."""
+        response = self.client.request(
+            "poll_availability_changes",
+            "GET",
+            f"{shard_url}/products/changes",
+            params={"since": since, "timeout_in_seconds": timeout_in_seconds},
+            read_timeout_in_seconds=timeout_in_seconds + POLL_TIMEOUT_MARGIN_IN_SECONDS,
+        )
+        return RestAvailabilityChanges(**response.json())
+
+    def get_state_digest(self, bucket_count: int) -> CartManagerStateDigest:
+        shard_digests = []
+        for shard_url in self.shard_urls:
+            response = self.client.request(
+                "get_state_digest",
+                "GET",
+                f"{shard_url}/state/digest",
+                params={"bucket_count": bucket_count},
+            )
+            shard_digests.append(RestStateDigest(**response.json()))
+        checksums = []
+        for bucket in range(bucket_count):
+            membership_checksums = {
+                digest.membership_checksums[bucket] for digest in shard_digests
+            }
+            if len(membership_checksums) > 1:
+                # shards do not know the same products, which never matches
+                checksums.append(-1)
+                continue
+            checksums.append(
+                (
+                    sum(digest.availability_checksums[bucket] for digest in shard_digests)
+                    + membership_checksums.pop()
+                )
+                % CHECKSUM_MODULUS
+            )
+        return CartManagerStateDigest(
+            version=",".join(str(digest.version) for digest in shard_digests),
+            product_count=max(digest.product_count for digest in shard_digests),
+            checksums=checksums,
+        )
+
+    def upsert_products(
+        self, total_count_by_product_id: dict[int, int], base_version: str
+    ) -> str:
+        shard_count = len(self.shard_urls)
+        return self._post_to_shards(
+            "upsert_products",
+            "products/upsert",
+            base_version,
+            [
+                {
+                    "total_count_by_product_id": {
+                        product_id: total_count // shard_count
+                        + (1 if shard_index < total_count % shard_count else 0)
+                        for product_id, total_count in total_count_by_product_id.items()
+                    }
+                }
+                for shard_index in range(shard_count)
+            ],
+        )
+
+    def apply_availability_deltas(
+        self, delta_by_product_id: dict[int, int], base_version: str
+    ) -> str:
+        # the other shards borrow from a product's home shard when they need to
+        return self._post_to_shards(
+            "apply_availability_deltas",
+            "products/deltas",
+            base_version,
+            [
+                {
+                    "delta_by_product_id": {
+                        product_id: delta
+                        for product_id, delta in delta_by_product_id.items()
+                        if self.product_shard_url(product_id) == shard_url
+                    }
+                }
+                for shard_url in self.shard_urls
+            ],
+        )
+
+    def _post_to_shards(
+        self, operation: str, path: str, base_version: str, body_by_shard: list[dict]
+    ) -> str:
+        versions = base_version.split(",")
+        for shard_index, (shard_url, body) in enumerate(zip(self.shard_urls, body_by_shard)):
+            if not any(body.values()):
+                continue
+            # retrying is safe, a write that went through fails the base version check
+            response = self.client.request(
+                operation,
+                "POST",
+                f"{shard_url}/{path}",
+                json={**body, "base_version": int(versions[shard_index])},
+                idempotent=True,
+                accepted_status_codes=frozenset({409}),
+            )
+            if response.status_code == 409:
+                raise CartManagerStateChangedException(response.json()["detail"])
+            versions[shard_index] = str(response.json()["version"])
+        return ",".join(versions)
+
+    def _sum_product_counts(
+        self, product_ids: Optional[list[int]] = None
+    ) -> dict[int, int]:
+        # product ids go in the query string, so long lists are sent in chunks
+        chunks = (
+            [None]
+            if product_ids is None
+            else [
+                {"product_ids": product_ids[start : start + PRODUCT_IDS_PER_REQUEST]}
+                for start in range(0, len(product_ids), PRODUCT_IDS_PER_REQUEST)
+            ]
+        )
+        total_count_by_product_id: dict[int, int] = {}
+        for shard_url in self.shard_urls:
+            for params in chunks:
+                response = self.client.request(
+                    "get_product_counts", "GET", f"{shard_url}/products", params=params
+                )
+                for product_id, state in response.json().items():
+                    total_count_by_product_id[int(product_id)] = (
+                        total_count_by_product_id.get(int(product_id), 0)
+                        + RestProductState(**state).total_count
+                    )
+        return total_count_by_product_id
+
+    def _raise_for_cart_error(self, response: Response) -> None:
+        if response.status_code == 404:
+            raise ProductNotFoundException(response.json()["detail"])
+        if response.status_code == 409:
+            raise NotEnoughProductCountAvailableException(response.json()["detail"])
+        if response.status_code == 422:
+            raise InvalidCartChangeException(response.json()["detail"])
@@ -0,0 +1,116 @@
+import threading
+import time
+from typing import Iterator, Mapping, Optional
+
+from cart_manager.shared_counters import (
+    OPEN,
+    SharedAvailabilityCountersReader,
+    TornSlotError,
+)
+from zwpa.workflows.retail.CartManager import ProductCountsUnreadableException
+
+
+class SharedMemoryAvailability:
+    """Product counts read straight from the shared memory segments that cart
+    managers on the same host publish them into, one segment per shard.
+
+    Reading them costs no network call and copies nothing but the counts of
+    the products asked for. A segment is usable while its cart manager keeps
+    its heartbeat fresh; otherwise, e.g. after the cart manager restarted
+    into a new segment, it is attached again at most every
+    `reattach_interval_in_seconds`, and counts must not be read until then.
+    A cart manager that dies while writing a count leaves it unreadable
+    before its heartbeat goes stale; reading it then raises
+    `ProductCountsUnreadableException`.
+    """
+
+    def __init__(
+        self,
+        segment_names: list[str],
+        max_heartbeat_age_in_seconds: float = 5.0,
+        reattach_interval_in_seconds: float = 1.0,
+    ) -> None:
+        self.segment_names = segment_names
+        self.max_heartbeat_age_in_seconds = max_heartbeat_age_in_seconds
+        self.reattach_interval_in_seconds = reattach_interval_in_seconds
+
+        self._readers: list[Optional[SharedAvailabilityCountersReader]] = [
+            None for _ in segment_names
+        ]
+        self._last_attach_attempt = float("-inf")
+        self._lock = threading.Lock()
+
+    @property
+    def is_synchronized(self) -> bool:
+        if all(self._is_usable(reader) for reader in self._readers):
+            return True
+        self._reattach()
+        return all(self._is_usable(reader) for reader in self._readers)
+
+    def get_current_product_counts(self) -> Mapping[int, int]:
+        return _SummedTotalCounts(
+            [reader for reader in self._readers if reader is not None]
+        )
+
+    def start(self) -> None:
+        self._reattach()
+
+    def close(self) -> None:
+        with self._lock:
+            for index, reader in enumerate(self._readers):
+                if reader is not None:
+                    reader.close()
+                self._readers[index] = None
+
+    def _is_usable(self, reader: Optional[SharedAvailabilityCountersReader]) -> bool:
+        return (
+            reader is not None
+            and reader.state == OPEN
+            and time.time() - reader.heartbeat <= self.max_heartbeat_age_in_seconds
+        )
+
+    def _reattach(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_attach_attempt < self.reattach_interval_in_seconds:
+                return
+            self._last_attach_attempt = now
+            for index, name in enumerate(self.segment_names):
+                reader = self._readers[index]
+                if self._is_usable(reader):
+                    continue
+                # a stale reader is dropped rather than closed, as counts read
+                # from it may still be in use; it is closed once they are not
+                self._readers[index] = None
+                try:
+                    self._readers[index] = SharedAvailabilityCountersReader(name)
+                except (FileNotFoundError, ValueError):
+                    pass
+
+
+class _SummedTotalCounts(Mapping[int, int]):
+    """Total counts of products summed over segments, read when asked for."""
+
+    def __init__(self, readers: list[SharedAvailabilityCountersReader]) -> None:
+        self._readers = readers
+
+    def __getitem__(self, product_id: int) -> int:
+        total_count = None
+        for reader in self._readers:
+            try:
+                counts = reader.read(product_id)
+            except TornSlotError as error:
+                raise ProductCountsUnreadableException(str(error)) from error
+            if counts is not None:
+                total_count = (total_count or 0) + counts[0]
+        if total_count is None:
+            raise KeyError(product_id)
+        return total_count
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(
+            {product_id for reader in self._readers for product_id in reader.product_ids()}
+        )
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
@@ -1,56 +1,137 @@
 from zwpa.model import User
 from zwpa.types import McfHash
-from zwpa.model import UserAuthenticationLogRecord
 from zwpa.UserAuthenticationResult import UserAuthenticationResult
 from zwpa.exceptions.UserDoesNotExist import UserDoesNotExist
 from zwpa.exceptions.UserHasDifferentPassword import UserHasDifferentPassword
 from zwpa.exceptions.UserHasNoLoginAttemptsLeft import UserHasNoLoginAttemptsLeft
 from zwpa.model import LOGIN_ATTEMPTS
+from zwpa.workflows.user.AuthenticationLogWriter import AuthenticationLogWriter
+from zwpa.workflows.user.LoginThrottle import LoginThrottle
+from zwpa.workflows.user.PasswordHashingExecutor import PasswordHashingExecutor, passwords_match
+from zwpa.workflows.user.SynchronousAuthenticationLogWriter import SynchronousAuthenticationLogWriter
+from zwpa.workflows.user.VerifiedCredentialCache import VerifiedCredentialCache
 
 
-import bcrypt
-from sqlalchemy import select
+import asyncio
+from contextlib import contextmanager
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session, sessionmaker
 
 
-from typing import Optional
+from typing import Iterator, Optional
 
 
 class AuthenticateUserWorkflow:
-    def __init__(self, session_maker: sessionmaker) -> None:
+    def __init__(
+        self,
+        session_maker: sessionmaker,
+        credential_cache: Optional[VerifiedCredentialCache] = None,
+        authentication_log_writer: Optional[AuthenticationLogWriter] = None,
+        password_hashing_executor: Optional[PasswordHashingExecutor] = None,
+        login_throttle: Optional[LoginThrottle] = None,
+    ) -> None:
         self.session_maker = session_maker
+        self.credential_cache = credential_cache
+        self.password_hashing_executor = password_hashing_executor
+        self.login_throttle = login_throttle
+        self.authentication_log_writer = (
+            authentication_log_writer
+            if authentication_log_writer is not None
+            else SynchronousAuthenticationLogWriter(session_maker)
+        )
 
-    def authenticate_user(self, login: str, plain_text_password: str) -> UserAuthenticationResult:
-        authenticated = False
-        try:
-            with self.session_maker() as session:
-                user = self._get_user(session, login=login)
+    def authenticate_user(self, login: str, plain_text_password: str, client_address: Optional[str] = None) -> UserAuthenticationResult:
+        cached_result = self._authenticate_from_cache(login, plain_text_password, client_address)
+        if cached_result is not None:
+            return cached_result
+        user_id, hashed_password = self._get_user_credentials(login, client_address)
+        password_matches = self._passwords_match(plain_text_password=plain_text_password, hashed_password=hashed_password)
+        return self._complete_authentication(login, plain_text_password, client_address, user_id, password_matches)
 
-                if user is None:
-                    raise UserDoesNotExist(user_login=login)
+    async def authenticate_user_async(self, login: str, plain_text_password: str, client_address: Optional[str] = None) -> UserAuthenticationResult:
+        """Same steps as `authenticate_user`, with the database ones on a worker thread
+        and the password check on the hashing executor, so none blocks the event loop."""
+        cached_result = await asyncio.to_thread(self._authenticate_from_cache, login, plain_text_password, client_address)
+        if cached_result is not None:
+            return cached_result
+        user_id, hashed_password = await asyncio.to_thread(self._get_user_credentials, login, client_address)
+        password_matches = await self._passwords_match_async(plain_text_password=plain_text_password, hashed_password=hashed_password)
+        return await asyncio.to_thread(self._complete_authentication, login, plain_text_password, client_address, user_id, password_matches)
 
-                if user.login_attempts_left < 1:
-                    raise UserHasNoLoginAttemptsLeft(user_login=user.login, authentication_result=UserAuthenticationResult(authenticated=False))
+    def _authenticate_from_cache(self, login: str, plain_text_password: str, client_address: Optional[str]) -> Optional[UserAuthenticationResult]:
+        self._check_login_throttle(login, client_address)
+        if self.credential_cache is None:
+            return None
+        cached_user_id = self.credential_cache.get_user_id(login, plain_text_password)
+        if cached_user_id is None:
+            return None
+        self._log_authentication(login, authenticated=True)
+        return UserAuthenticationResult(authenticated=True, user_id=cached_user_id)
 
-                if not self._passwords_match(plain_text_password=plain_text_password, hashed_password=user.password):
-                    user.login_attempts_left -= 1
-                    session.commit()
-                    raise UserHasDifferentPassword(user_login=user.login, authentication_result=UserAuthenticationResult(authenticated=False))
+    def _get_user_credentials(self, login: str, client_address: Optional[str]) -> tuple[int, McfHash]:
+        with self._failed_attempt_recorded(login, client_address), self.session_maker() as session:
+            user = self._get_user(session, login=login)
 
-                user.login_attempts_left = LOGIN_ATTEMPTS
-                session.commit()
+            if user is None:
+                raise UserDoesNotExist(user_login=login)
+
+            if user.login_attempts_left < 1:
+                raise UserHasNoLoginAttemptsLeft(user_login=user.login, authentication_result=UserAuthenticationResult(authenticated=False))
 
-                authenticated = True
-                return UserAuthenticationResult(authenticated=True, user_id=user.id)
-        finally:
-            # Extremaly risky, since finally will overwrite the exception if raises
-            with self.session_maker() as session:
-                session.add(UserAuthenticationLogRecord(login=login, authenticated=authenticated))
+            return user.id, user.password
+
+    def _complete_authentication(self, login: str, plain_text_password: str, client_address: Optional[str], user_id: int, password_matches: bool) -> UserAuthenticationResult:
+        with self._failed_attempt_recorded(login, client_address), self.session_maker() as session:
+            if not password_matches:
+                session.execute(update(User).where(User.id == user_id).values(login_attempts_left=User.login_attempts_left - 1))
                 session.commit()
+                raise UserHasDifferentPassword(user_login=login, authentication_result=UserAuthenticationResult(authenticated=False))
+
+            session.execute(update(User).where(User.id == user_id).values(login_attempts_left=LOGIN_ATTEMPTS))
+            session.commit()
+
+        self._log_authentication(login, authenticated=True)
+        if self.credential_cache is not None:
+            self.credential_cache.store(login, plain_text_password, user_id=user_id)
+        return UserAuthenticationResult(authenticated=True, user_id=user_id)
 
+    @contextmanager
+    def _failed_attempt_recorded(self, login: str, client_address: Optional[str]) -> Iterator[None]:
+        try:
+            yield
+        except (UserDoesNotExist, UserHasNoLoginAttemptsLeft, UserHasDifferentPassword):
+            self._invalidate_cached_credentials(login)
+            self._record_failed_attempt(login, client_address)
+            self._log_authentication(login, authenticated=False)
+            raise
+        except Exception:
+            self._log_authentication(login, authenticated=False)
+            raise
+
+    def _check_login_throttle(self, login: str, client_address: Optional[str]) -> None:
+        if self.login_throttle is not None:
+            self.login_throttle.check(login, client_address=client_address)
+
+    def _record_failed_attempt(self, login: str, client_address: Optional[str]) -> None:
+        if self.login_throttle is not None:
+            self.login_throttle.record_failure(login, client_address=client_address)
+
+    def _log_authentication(self, login: str, authenticated: bool) -> None:
+        self.authentication_log_writer.write(login, authenticated=authenticated)
+
+    def _invalidate_cached_credentials(self, login: str) -> None:
+        if self.credential_cache is not None:
+            self.credential_cache.invalidate_login(login)
 
     def _get_user(self, session: Session, login: str) -> Optional[User]:
         return session.scalars(select(User).filter_by(login=login)).one_or_none()
 
     def _passwords_match(self, plain_text_password: str, hashed_password: McfHash) -> bool:
-        return bcrypt.checkpw(password=plain_text_password.encode("utf-8"), hashed_password=hashed_password)
\ No newline at end of file
+        if self.password_hashing_executor is None:
+            return passwords_match(plain_text_password, hashed_password)
+        return self.password_hashing_executor.passwords_match(plain_text_password, hashed_password)
+
+    async def _passwords_match_async(self, plain_text_password: str, hashed_password: McfHash) -> bool:
+        if self.password_hashing_executor is None:
+            return await asyncio.to_thread(passwords_match, plain_text_password, hashed_password)
+        return await self.password_hashing_executor.passwords_match_async(plain_text_password, hashed_password)
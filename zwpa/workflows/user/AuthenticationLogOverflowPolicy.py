@@ -0,0 +1,7 @@
+from enum import Enum
+
+
+class AuthenticationLogOverflowPolicy(str, Enum):
+    BLOCK = "BLOCK"
+    DROP_NEWEST = "DROP_NEWEST"
+    DROP_OLDEST = "DROP_OLDEST"
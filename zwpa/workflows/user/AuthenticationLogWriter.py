@@ -0,0 +1,13 @@
+from abc import ABC, abstractmethod
+
+
+class AuthenticationLogWriter(ABC):
+    @abstractmethod
+    def write(self, login: str, authenticated: bool) -> None:
+        pass
+
+    def start(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,52 @@
+from sqlalchemy import case, func, select, text, update
+from sqlalchemy.orm import sessionmaker, Session
+
+from zwpa.model import (
+    USER_ROLE_BITS,
+    USER_ROLE_MASK_INDEXES,
+    User,
+    UserRoleAssignment,
+)
+
+
+class BackfillUserRoleMaskWorkflow:
+    def __init__(self, session_maker: sessionmaker[Session]) -> None:
+        self.session_maker = session_maker
+
+    def backfill(self) -> None:
+        with self.session_maker() as session:
+            self._ensure_role_mask_column(session)
+            self._recompute_role_masks(session)
+            session.commit()
+
+    def _ensure_role_mask_column(self, session: Session) -> None:
+        # `create_all` does not add columns to already existing tables
+        session.execute(
+            text(
+                "ALTER TABLE users ADD COLUMN IF NOT EXISTS role_mask INTEGER NOT NULL DEFAULT 0"
+            )
+        )
+        # a plain index on the whole mask cannot serve bit tests, the partial
+        # per-role indexes below do; databases created earlier still have it
+        session.execute(text("DROP INDEX IF EXISTS ix_users_role_mask"))
+        for index in USER_ROLE_MASK_INDEXES:
+            index.create(session.connection(), checkfirst=True)
+
+    def _recompute_role_masks(self, session: Session) -> None:
+        role_bit = case(
+            *[
+                (UserRoleAssignment.role == role, bit)
+                for role, bit in USER_ROLE_BITS.items()
+            ],
+            else_=0,
+        )
+        user_mask = (
+            select(func.coalesce(func.bit_or(role_bit), 0))
+            .where(UserRoleAssignment.user_id == User.id)
+            .scalar_subquery()
+        )
+        session.execute(
+            update(User)
+            .where(User.role_mask != user_mask)
+            .values(role_mask=user_mask)
+        )
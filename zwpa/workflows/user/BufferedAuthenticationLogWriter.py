@@ -0,0 +1,143 @@
+from logging import getLogger
+import queue
+import threading
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from zwpa.model import UserAuthenticationLogRecord
+from zwpa.workflows.user.AuthenticationLogOverflowPolicy import (
+    AuthenticationLogOverflowPolicy,
+)
+from zwpa.workflows.user.AuthenticationLogWriter import AuthenticationLogWriter
+
+
+_CLOSING_POLL_INTERVAL_IN_SECONDS = 0.1
+
+
+class BufferedAuthenticationLogWriter(AuthenticationLogWriter):
+    """Queues authentication log records and inserts them in bulk from a background thread.
+
+    A batch is flushed once it reaches `batch_size` records or once
+    `flush_interval_in_seconds` has passed, whichever comes first. A batch
+    that fails to insert is tried up to `flush_attempts` times, with a
+    growing pause in between, before it is dropped and counted.
+    """
+
+    def __init__(
+        self,
+        session_maker: sessionmaker,
+        batch_size: int = 500,
+        flush_interval_in_seconds: float = 1.0,
+        max_queue_size: int = 10_000,
+        overflow_policy: AuthenticationLogOverflowPolicy = AuthenticationLogOverflowPolicy.DROP_NEWEST,
+        flush_attempts: int = 3,
+        flush_retry_backoff_in_seconds: float = 0.1,
+    ) -> None:
+        super().__init__()
+        self.session_maker = session_maker
+        self.batch_size = batch_size
+        self.flush_interval_in_seconds = flush_interval_in_seconds
+        self.overflow_policy = overflow_policy
+        self.flush_attempts = flush_attempts
+        self.flush_retry_backoff_in_seconds = flush_retry_backoff_in_seconds
+        self.dropped_records = 0
+        self.flushed_records = 0
+
+        self._queue: queue.Queue[dict] = queue.Queue(maxsize=max_queue_size)
+        self._closing = threading.Event()
+        self._worker: threading.Thread | None = None
+        self._logger = getLogger("authentication-log-writer")
+
+    @property
+    def is_running(self) -> bool:
+        return self._worker is not None and self._worker.is_alive()
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        self._closing.clear()
+        self._worker = threading.Thread(
+            target=self._run, name="authentication-log-writer", daemon=True
+        )
+        self._worker.start()
+
+    def close(self, timeout_in_seconds: float | None = None) -> None:
+        self._closing.set()
+        if self._worker is not None:
+            self._worker.join(timeout_in_seconds)
+            self._worker = None
+
+    def write(self, login: str, authenticated: bool) -> None:
+        record = {"login": login, "authenticated": authenticated}
+        if not self.is_running:
+            self._flush([record])
+            return
+
+        if self.overflow_policy is AuthenticationLogOverflowPolicy.BLOCK:
+            self._queue.put(record)
+            return
+        while True:
+            try:
+                self._queue.put_nowait(record)
+                return
+            except queue.Full:
+                if self.overflow_policy is AuthenticationLogOverflowPolicy.DROP_NEWEST:
+                    self.dropped_records += 1
+                    return
+                try:
+                    self._queue.get_nowait()
+                    self.dropped_records += 1
+                except queue.Empty:
+                    pass
+
+    def _run(self) -> None:
+        while not (self._closing.is_set() and self._queue.empty()):
+            batch = self._collect_batch()
+            if batch:
+                self._flush(batch)
+
+    def _collect_batch(self) -> list[dict]:
+        batch: list[dict] = []
+        deadline = time.monotonic() + self.flush_interval_in_seconds
+        while len(batch) < self.batch_size:
+            if self._closing.is_set():
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+                continue
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(
+                    self._queue.get(
+                        timeout=min(timeout, _CLOSING_POLL_INTERVAL_IN_SECONDS)
+                    )
+                )
+            except queue.Empty:
+                continue
+        return batch
+
+    def _flush(self, batch: list[dict]) -> None:
+        for attempt in range(1, self.flush_attempts + 1):
+            try:
+                with self.session_maker() as session:
+                    session.execute(insert(UserAuthenticationLogRecord), batch)
+                    session.commit()
+                self.flushed_records += len(batch)
+                return
+            except Exception:
+                if attempt == self.flush_attempts:
+                    self.dropped_records += len(batch)
+                    self._logger.exception(
+                        f"Failed to flush {len(batch)} authentication log records, dropping them"
+                    )
+                    return
+                self._logger.warning(
+                    f"Failed to flush {len(batch)} authentication log records, retrying",
+                    exc_info=True,
+                )
+            time.sleep(self.flush_retry_backoff_in_seconds * 2 ** (attempt - 1))
@@ -0,0 +1,276 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import csv
+from dataclasses import dataclass, field
+from enum import Enum
+import io
+import json
+from typing import Iterable, Optional
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+
+from zwpa.exceptions.UserLacksRoleException import UserLacksRoleException
+from zwpa.model import LOGIN_ATTEMPTS, User, UserRole, UserRoleAssignment, roles_to_mask
+from zwpa.types import McfHash
+from zwpa.workflows.user.PasswordHashingExecutor import (
+    PasswordHashingExecutor,
+    hash_password,
+)
+from zwpa.workflows.user.PasswordHashingExecutorKind import PasswordHashingExecutorKind
+from zwpa.workflows.utils.RoleCache import bump_role_version
+from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
+
+
+class BulkUserFormat(str, Enum):
+    CSV = "CSV"
+    NDJSON = "NDJSON"
+
+
+@dataclass
+class BulkUserRow:
+    row_number: int
+    login: str
+    password: str
+    roles: list[UserRole] = field(default_factory=list)
+
+
+@dataclass
+class BulkUserRowFailure:
+    row_number: int
+    login: Optional[str]
+    reason: str
+
+
+@dataclass
+class BulkCreatedUser:
+    row_number: int
+    login: str
+    user_id: int
+
+
+@dataclass
+class BulkCreateUsersResult:
+    created: list[BulkCreatedUser] = field(default_factory=list)
+    failures: list[BulkUserRowFailure] = field(default_factory=list)
+
+
+def _read_csv_records(content: str) -> Iterable[dict]:
+    for record in csv.DictReader(io.StringIO(content)):
+        roles = (record.get("roles") or "").split(";")
+        yield {**record, "roles": [role.strip() for role in roles if role.strip()]}
+
+
+def _read_ndjson_records(content: str) -> Iterable[dict | ValueError]:
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield e
+
+
+def parse_bulk_user_rows(
+    content: str, format: BulkUserFormat
+) -> tuple[list[BulkUserRow], list[BulkUserRowFailure]]:
+    """Parses `login,password,roles` CSV (roles separated with `;`) or NDJSON
+    objects with `login`, `password` and a `roles` list.
+
+    Rows that cannot be parsed are reported as failures instead of aborting
+    the whole import. Row numbers are 1-based and count data rows only.
+    """
+    rows: list[BulkUserRow] = []
+    failures: list[BulkUserRowFailure] = []
+    records = (
+        _read_csv_records(content)
+        if format is BulkUserFormat.CSV
+        else _read_ndjson_records(content)
+    )
+    for row_number, record in enumerate(records, start=1):
+        login = None
+        try:
+            if not isinstance(record, dict):
+                raise ValueError(f"malformed row: {record}")
+            login, password = record.get("login"), record.get("password")
+            if not login or not password:
+                raise ValueError("login and password are required")
+            rows.append(
+                BulkUserRow(
+                    row_number=row_number,
+                    login=login,
+                    password=password,
+                    roles=[UserRole(role) for role in record.get("roles") or []],
+                )
+            )
+        except (ValueError, TypeError) as e:
+            failures.append(
+                BulkUserRowFailure(row_number=row_number, login=login, reason=str(e))
+            )
+    return rows, failures
+
+
+class BulkCreateUsersWorkflow:
+    """Creates many users at once.
+
+    Existing logins are looked up with a single query, passwords are hashed in
+    parallel and users with their role assignments are inserted in batches.
+    A row that fails is reported and skipped, the rest of the import goes on.
+
+    Passwords are hashed on `password_hashing_executor` when given, as the
+    server does, and otherwise on a pool created for the import.
+    """
+
+    def __init__(
+        self,
+        session_maker: sessionmaker,
+        hashing_workers: int = 4,
+        hashing_executor_kind: PasswordHashingExecutorKind = PasswordHashingExecutorKind.PROCESS,
+        batch_size: int = 500,
+        password_hashing_executor: Optional[PasswordHashingExecutor] = None,
+    ) -> None:
+        self.session_maker = session_maker
+        self.password_hashing_executor = password_hashing_executor
+        self.hashing_workers = hashing_workers
+        self.hashing_executor_kind = hashing_executor_kind
+        self.batch_size = batch_size
+        self.user_role_checker = UserRoleChecker(self.session_maker)
+
+    def create_users_as_admin(
+        self, admin_id: int, rows: list[BulkUserRow]
+    ) -> BulkCreateUsersResult:
+        if not self.user_role_checker.is_user_of_role(admin_id, role=UserRole.ADMIN):
+            raise UserLacksRoleException()
+        return self.create_users(rows)
+
+    def create_users(self, rows: list[BulkUserRow]) -> BulkCreateUsersResult:
+        result = BulkCreateUsersResult()
+        rows = self._reject_duplicated_logins(rows, result)
+        rows = self._reject_existing_logins(rows, result)
+        hashed_passwords = self._hash_passwords([row.password for row in rows])
+        for start in range(0, len(rows), self.batch_size):
+            self._insert_batch(
+                rows[start : start + self.batch_size],
+                hashed_passwords[start : start + self.batch_size],
+                result,
+            )
+        if result.created:
+            with self.session_maker() as session:
+                bump_role_version(session)
+                session.commit()
+        result.failures.sort(key=lambda failure: failure.row_number)
+        return result
+
+    def _reject_duplicated_logins(
+        self, rows: list[BulkUserRow], result: BulkCreateUsersResult
+    ) -> list[BulkUserRow]:
+        seen_logins: set[str] = set()
+        unique_rows = []
+        for row in rows:
+            if row.login in seen_logins:
+                result.failures.append(
+                    BulkUserRowFailure(row.row_number, row.login, "duplicated login")
+                )
+                continue
+            seen_logins.add(row.login)
+            unique_rows.append(row)
+        return unique_rows
+
+    def _reject_existing_logins(
+        self, rows: list[BulkUserRow], result: BulkCreateUsersResult
+    ) -> list[BulkUserRow]:
+        if not rows:
+            return rows
+        with self.session_maker() as session:
+            existing_logins = set(
+                session.scalars(
+                    select(User.login).where(User.login.in_([row.login for row in rows]))
+                )
+            )
+        for row in rows:
+            if row.login in existing_logins:
+                result.failures.append(
+                    BulkUserRowFailure(row.row_number, row.login, "user already exists")
+                )
+        return [row for row in rows if row.login not in existing_logins]
+
+    def _hash_passwords(self, plain_text_passwords: list[str]) -> list[McfHash]:
+        if not plain_text_passwords:
+            return []
+        if self.password_hashing_executor is not None:
+            return self.password_hashing_executor.hash_passwords(plain_text_passwords)
+        with self._create_hashing_executor() as executor:
+            return list(
+                executor.map(
+                    hash_password,
+                    plain_text_passwords,
+                    chunksize=max(len(plain_text_passwords) // (self.hashing_workers * 4), 1),
+                )
+            )
+
+    def _create_hashing_executor(self) -> Executor:
+        if self.hashing_executor_kind is PasswordHashingExecutorKind.PROCESS:
+            return ProcessPoolExecutor(max_workers=self.hashing_workers)
+        return ThreadPoolExecutor(
+            max_workers=self.hashing_workers, thread_name_prefix="bulk-password-hashing"
+        )
+
+    def _insert_batch(
+        self,
+        rows: list[BulkUserRow],
+        hashed_passwords: list[McfHash],
+        result: BulkCreateUsersResult,
+    ) -> None:
+        with self.session_maker() as session:
+            try:
+                result.created.extend(self._insert_users(session, rows, hashed_passwords))
+                session.commit()
+                return
+            except IntegrityError:
+                session.rollback()
+        # retry row by row, so only the offending rows are reported
+        for row, hashed_password in zip(rows, hashed_passwords):
+            with self.session_maker() as session:
+                try:
+                    result.created.extend(
+                        self._insert_users(session, [row], [hashed_password])
+                    )
+                    session.commit()
+                except IntegrityError as e:
+                    session.rollback()
+                    result.failures.append(
+                        BulkUserRowFailure(row.row_number, row.login, str(e.orig))
+                    )
+
+    def _insert_users(
+        self,
+        session: Session,
+        rows: list[BulkUserRow],
+        hashed_passwords: list[McfHash],
+    ) -> list[BulkCreatedUser]:
+        user_ids_by_login = {
+            login: user_id
+            for user_id, login in session.execute(
+                insert(User).returning(User.id, User.login),
+                [
+                    {
+                        "login": row.login,
+                        "password": hashed_password,
+                        "login_attempts_left": LOGIN_ATTEMPTS,
+                        "role_mask": roles_to_mask(row.roles),
+                    }
+                    for row, hashed_password in zip(rows, hashed_passwords)
+                ],
+            )
+        }
+        role_assignments = [
+            {"user_id": user_ids_by_login[row.login], "role": role}
+            for row in rows
+            for role in dict.fromkeys(row.roles)
+        ]
+        if role_assignments:
+            session.execute(insert(UserRoleAssignment), role_assignments)
+        return [
+            BulkCreatedUser(row.row_number, row.login, user_ids_by_login[row.login])
+            for row in rows
+        ]
@@ -2,16 +2,21 @@ from zwpa.model import User
 from zwpa.types import McfHash
 from zwpa.exceptions.UserAlreadyExistsException import UserAlreadyExistsException
 from zwpa.model import LOGIN_ATTEMPTS
+from zwpa.workflows.user.PasswordHashingExecutor import PasswordHashingExecutor, hash_password
 
 
-import bcrypt
+import asyncio
 from sqlalchemy import select
 from sqlalchemy.orm import Session, sessionmaker
 
 
+from typing import Optional
+
+
 class CreateUserWorkflow:
-    def __init__(self, session_maker: sessionmaker) -> None:
+    def __init__(self, session_maker: sessionmaker, password_hashing_executor: Optional[PasswordHashingExecutor] = None) -> None:
         self.session_maker = session_maker
+        self.password_hashing_executor = password_hashing_executor
 
     def create_user(self, login: str, plain_text_password: str) -> int:
         with self.session_maker() as session:
@@ -28,8 +33,39 @@ class CreateUserWorkflow:
             user_id = user.id
         return user_id
 
+    async def create_user_async(self, login: str, plain_text_password: str) -> int:
+        await asyncio.to_thread(self._assert_user_does_not_exist, login)
+        hashed_password = await self._hash_password_async(plain_text_password)
+        return await asyncio.to_thread(self._insert_user, login, hashed_password)
+
+    def _assert_user_does_not_exist(self, login: str) -> None:
+        with self.session_maker() as session:
+            if self._user_exists(session, login=login):
+                raise UserAlreadyExistsException(login)
+
+    def _insert_user(self, login: str, hashed_password: McfHash) -> int:
+        with self.session_maker() as session:
+            if self._user_exists(session, login=login):
+                raise UserAlreadyExistsException(login)
+
+            user = User(
+                login=login,
+                password=hashed_password,
+                login_attempts_left=LOGIN_ATTEMPTS
+            )
+            session.add(user)
+            session.commit()
+            return user.id
+
     def _user_exists(self, session: Session, login: str) -> bool:
         return session.scalars(select(User).filter_by(login=login)).first() is not None
 
     def _hash_password(self, plain_text_password: str) -> McfHash:
-        return McfHash(bcrypt.hashpw(plain_text_password.encode(encoding="utf-8"), salt=bcrypt.gensalt()))
\ No newline at end of file
+        if self.password_hashing_executor is None:
+            return hash_password(plain_text_password)
+        return self.password_hashing_executor.hash_password(plain_text_password)
+
+    async def _hash_password_async(self, plain_text_password: str) -> McfHash:
+        if self.password_hashing_executor is None:
+            return await asyncio.to_thread(hash_password, plain_text_password)
+        return await self.password_hashing_executor.hash_password_async(plain_text_password)
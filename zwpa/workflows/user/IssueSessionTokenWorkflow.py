@@ -0,0 +1,43 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Optional
+from sqlalchemy.orm import sessionmaker
+
+from zwpa.workflows.user.AuthenticateUserWorkflow import AuthenticateUserWorkflow
+from zwpa.workflows.user.SessionTokenService import SessionToken, SessionTokenService
+from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
+
+
+@dataclass
+class IssuedSessionToken:
+    token: str
+    session_token: SessionToken
+
+
+class IssueSessionTokenWorkflow:
+    def __init__(
+        self,
+        session_maker: sessionmaker,
+        authenticate_user_workflow: AuthenticateUserWorkflow,
+        session_token_service: SessionTokenService,
+    ) -> None:
+        self.session_maker = session_maker
+        self.authenticate_user_workflow = authenticate_user_workflow
+        self.session_token_service = session_token_service
+        self.user_role_checker = UserRoleChecker(self.session_maker)
+
+    async def issue_session_token(
+        self, login: str, plain_text_password: str, client_address: Optional[str] = None
+    ) -> IssuedSessionToken:
+        result = await self.authenticate_user_workflow.authenticate_user_async(
+            login, plain_text_password, client_address=client_address
+        )
+        assert result.user_id is not None
+        roles = await asyncio.to_thread(
+            self.user_role_checker.get_user_roles, result.user_id
+        )
+        token, session_token = self.session_token_service.issue(
+            result.user_id, roles=roles
+        )
+        return IssuedSessionToken(token=token, session_token=session_token)
+
@@ -3,7 +3,8 @@ from sqlalchemy import select
 from sqlalchemy.orm import Session, sessionmaker
 from zwpa.exceptions.UserLacksRoleException import UserLacksRoleException
 
-from zwpa.model import User, UserRole
+from zwpa.model import User, UserRole, has_role_predicate, mask_to_roles
+from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
 
 
 @dataclass(eq=True)
@@ -20,38 +21,37 @@ class UserRolesView:
 class ListUserRolesWorkflow:
     def __init__(self, session_maker: sessionmaker) -> None:
         self.session_maker = session_maker
+        self.user_role_checker = UserRoleChecker(self.session_maker)
 
     def get_single_user_role_view_workflow(self, admin_id: int, user_id: int) -> UserRolesView:
         with self.session_maker() as session:
-            if not self.__is_user_of_role(
-                session, user_id=admin_id, role=UserRole.ADMIN
-            ):
+            if not self.__is_user_of_role(user_id=admin_id, role=UserRole.ADMIN):
                 raise UserLacksRoleException()
-            user = session.get_one(User, user_id)
-            return self.__map_user_to_user_roles_view(user)
+            user_id, login, role_mask = session.execute(
+                select(User.id, User.login, User.role_mask).where(User.id == user_id)
+            ).one()
+            return self.__map_user_to_user_roles_view(user_id, login, role_mask)
         
-    def list_user_roles_workflow(self, admin_id: int) -> list[UserRolesView]:
+    def list_user_roles_workflow(self, admin_id: int, role: UserRole | None = None) -> list[UserRolesView]:
         with self.session_maker() as session:
-            if not self.__is_user_of_role(
-                session, user_id=admin_id, role=UserRole.ADMIN
-            ):
+            if not self.__is_user_of_role(user_id=admin_id, role=UserRole.ADMIN):
                 raise UserLacksRoleException()
+            query = select(User.id, User.login, User.role_mask)
+            if role is not None:
+                query = query.where(has_role_predicate(role))
             return [
-                self.__map_user_to_user_roles_view(user)
-                for user in session.execute(select(User)).scalars()
+                self.__map_user_to_user_roles_view(user_id, login, role_mask)
+                for user_id, login, role_mask in session.execute(query).all()
             ]
 
-    def __is_user_of_role(self, session: Session, user_id: int, role: UserRole) -> bool:
-        user_roles = [
-            assignment.role for assignment in session.get_one(User, user_id).roles
-        ]
-        return role in user_roles
+    def __is_user_of_role(self, user_id: int, role: UserRole) -> bool:
+        return self.user_role_checker.is_user_of_role(user_id, role=role)
 
-    def __map_user_to_user_roles_view(self, user: User) -> UserRolesView:
-        user_roles = [assignment.role for assignment in user.roles]
+    def __map_user_to_user_roles_view(self, user_id: int, login: str, role_mask: int) -> UserRolesView:
+        user_roles = mask_to_roles(role_mask)
         return UserRolesView(
-            id=user.id,
-            login=user.login,
+            id=user_id,
+            login=login,
             is_admin=UserRole.ADMIN in user_roles,
             is_clerk=UserRole.CLERK in user_roles,
             is_client=UserRole.CLIENT in user_roles,
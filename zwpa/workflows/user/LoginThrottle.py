@@ -0,0 +1,110 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import threading
+import time
+from typing import Callable, Optional
+
+from zwpa.exceptions.LoginThrottled import LoginThrottled
+
+
+@dataclass
+class _TokenBucket:
+    tokens: float
+    updated_at: float
+
+
+class _TokenBucketRegistry:
+    def __init__(
+        self,
+        capacity: float,
+        refill_per_second: float,
+        max_tracked_keys: int,
+        clock: Callable[[], float],
+    ) -> None:
+        if refill_per_second <= 0:
+            # a bucket that never refills would lock a login out for good
+            raise ValueError("refill_per_second has to be positive")
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_tracked_keys = max_tracked_keys
+        self.clock = clock
+
+        self._buckets: OrderedDict[str, _TokenBucket] = OrderedDict()
+
+    def retry_after(self, key: str) -> float:
+        bucket = self._refill(key)
+        if bucket is None or bucket.tokens >= 1:
+            return 0.0
+        return (1 - bucket.tokens) / self.refill_per_second
+
+    def take(self, key: str) -> None:
+        bucket = self._refill(key)
+        if bucket is None:
+            bucket = _TokenBucket(tokens=self.capacity, updated_at=self.clock())
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.max_tracked_keys:
+                # evicted buckets come back full, which only ever loosens the limit
+                self._buckets.popitem(last=False)
+        bucket.tokens = max(bucket.tokens - 1, 0.0)
+        self._buckets.move_to_end(key)
+
+    def _refill(self, key: str) -> Optional[_TokenBucket]:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return None
+        now = self.clock()
+        bucket.tokens = min(
+            self.capacity,
+            bucket.tokens + (now - bucket.updated_at) * self.refill_per_second,
+        )
+        bucket.updated_at = now
+        if bucket.tokens >= self.capacity:
+            del self._buckets[key]
+            return None
+        return bucket
+
+
+class LoginThrottle:
+    """Token buckets per login and per client address, kept in memory.
+
+    Only failed attempts take a token, so users who keep sending correct
+    credentials on every request are never slowed down. Once a bucket is empty
+    attempts are rejected before the database or bcrypt is involved.
+    """
+
+    def __init__(
+        self,
+        login_capacity: float = 5,
+        login_refill_per_second: float = 0.1,
+        client_capacity: float = 20,
+        client_refill_per_second: float = 1.0,
+        max_tracked_keys: int = 100_000,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._login_buckets = _TokenBucketRegistry(
+            login_capacity, login_refill_per_second, max_tracked_keys, clock
+        )
+        self._client_buckets = _TokenBucketRegistry(
+            client_capacity, client_refill_per_second, max_tracked_keys, clock
+        )
+        self._lock = threading.Lock()
+        self.rejected_attempts = 0
+
+    def check(self, login: str, client_address: Optional[str] = None) -> None:
+        with self._lock:
+            retry_after = self._login_buckets.retry_after(login)
+            key = f"login {login}"
+            if client_address is not None:
+                client_retry_after = self._client_buckets.retry_after(client_address)
+                if client_retry_after > retry_after:
+                    retry_after = client_retry_after
+                    key = f"client {client_address}"
+            if retry_after > 0:
+                self.rejected_attempts += 1
+                raise LoginThrottled(key, retry_after_in_seconds=retry_after)
+
+    def record_failure(self, login: str, client_address: Optional[str] = None) -> None:
+        with self._lock:
+            self._login_buckets.take(login)
+            if client_address is not None:
+                self._client_buckets.take(client_address)
@@ -1,17 +1,33 @@
+from typing import Optional
+from sqlalchemy import update
 from sqlalchemy.orm import sessionmaker, Session
 from zwpa.exceptions.UserLacksRoleException import UserLacksRoleException
-from zwpa.model import User, UserRole, UserRoleAssignment
+from zwpa.model import User, UserRole, UserRoleAssignment, roles_to_mask
+from zwpa.workflows.user.SessionTokenDenylist import SessionTokenDenylist
+from zwpa.workflows.user.VerifiedCredentialCache import VerifiedCredentialCache
+from zwpa.workflows.utils.RoleCache import RoleCache, bump_role_version
+from zwpa.workflows.utils.UserRoleChecker import UserRoleChecker
 
 
 class ModifyUserRolesWorkflow:
-    def __init__(self, session_maker: sessionmaker) -> None:
+    def __init__(
+        self,
+        session_maker: sessionmaker,
+        credential_cache: Optional[VerifiedCredentialCache] = None,
+        session_token_denylist: Optional[SessionTokenDenylist] = None,
+        role_cache: Optional[RoleCache] = None,
+    ) -> None:
         self.session_maker = session_maker
+        self.credential_cache = credential_cache
+        self.session_token_denylist = session_token_denylist
+        self.role_cache = role_cache
+        self.user_role_checker = UserRoleChecker(self.session_maker, role_cache=role_cache)
 
     def modify_user_roles_as_admin(
         self, admin_id: int, user_id: int, roles: list[UserRole]
     ) -> None:
         with self.session_maker() as session:
-            if not self.__is_user_of_role(session, admin_id, UserRole.ADMIN):
+            if not self.__is_user_of_role(admin_id, UserRole.ADMIN):
                 raise UserLacksRoleException()
             self.modify_user_roles(user_id, roles)
             session.commit()
@@ -20,15 +36,27 @@ class ModifyUserRolesWorkflow:
         with self.session_maker() as session:
             for role in roles:
                 self.__grant_role_to_user(session, user_id, role)
+            self.__add_roles_to_role_mask(session, user_id, roles)
+            bump_role_version(session)
             session.commit()
+        if self.role_cache is not None:
+            self.role_cache.invalidate()
+        if self.credential_cache is not None:
+            self.credential_cache.invalidate_user(user_id)
+        if self.session_token_denylist is not None:
+            self.session_token_denylist.revoke_user(user_id)
             
 
-    def __is_user_of_role(self, session: Session, user_id: int, role: UserRole) -> bool:
-        user_roles = [
-            assignment.role for assignment in session.get_one(User, user_id).roles
-        ]
-        return role in user_roles
+    def __is_user_of_role(self, user_id: int, role: UserRole) -> bool:
+        return self.user_role_checker.is_user_of_role(user_id, role=role)
     
     def __grant_role_to_user(self, session: Session, user_id: int, role: UserRole) -> None:
         user_role_assignment = UserRoleAssignment(role=role, user_id=user_id)
         session.add(user_role_assignment)
+
+    def __add_roles_to_role_mask(self, session: Session, user_id: int, roles: list[UserRole]) -> None:
+        session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(role_mask=User.role_mask.op("|")(roles_to_mask(roles)))
+        )
@@ -0,0 +1,111 @@
+import asyncio
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+import threading
+from typing import Any, Callable
+
+import bcrypt
+
+from zwpa.exceptions.PasswordHashingOverloaded import PasswordHashingOverloaded
+from zwpa.types import McfHash
+from zwpa.workflows.user.PasswordHashingExecutorKind import PasswordHashingExecutorKind
+
+
+def hash_password(plain_text_password: str) -> McfHash:
+    return McfHash(
+        bcrypt.hashpw(plain_text_password.encode(encoding="utf-8"), salt=bcrypt.gensalt())
+    )
+
+
+def passwords_match(plain_text_password: str, hashed_password: McfHash) -> bool:
+    return bcrypt.checkpw(
+        password=plain_text_password.encode("utf-8"), hashed_password=hashed_password
+    )
+
+
+class PasswordHashingExecutor:
+    """Runs bcrypt on a dedicated pool, so it never occupies the event loop or request threads.
+
+    At most `max_workers` hashes run at once and at most `max_queue_size` more
+    wait for a worker. Anything above that is rejected straight away with
+    PasswordHashingOverloaded, instead of piling up until the client times out.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        max_queue_size: int = 64,
+        kind: PasswordHashingExecutorKind = PasswordHashingExecutorKind.THREAD,
+    ) -> None:
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.kind = kind
+        self.rejected_count = 0
+
+        self._executor: Executor = (
+            ProcessPoolExecutor(max_workers=max_workers)
+            if kind is PasswordHashingExecutorKind.PROCESS
+            else ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="password-hashing"
+            )
+        )
+        self._pending_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending_count(self) -> int:
+        return self._pending_count
+
+    def hash_password(self, plain_text_password: str) -> McfHash:
+        return self._submit(hash_password, plain_text_password).result()
+
+    def passwords_match(self, plain_text_password: str, hashed_password: McfHash) -> bool:
+        return self._submit(
+            passwords_match, plain_text_password, hashed_password
+        ).result()
+
+    def hash_passwords(self, plain_text_passwords: list[str]) -> list[McfHash]:
+        """Hashes `max_workers` passwords at a time, so a bulk import never fills
+        the queue interactive logins wait in."""
+        hashed_passwords: list[McfHash] = []
+        for start in range(0, len(plain_text_passwords), self.max_workers):
+            futures = [
+                self._submit(hash_password, plain_text_password)
+                for plain_text_password in plain_text_passwords[
+                    start : start + self.max_workers
+                ]
+            ]
+            hashed_passwords.extend(future.result() for future in futures)
+        return hashed_passwords
+
+    async def hash_password_async(self, plain_text_password: str) -> McfHash:
+        return await asyncio.wrap_future(
+            self._submit(hash_password, plain_text_password)
+        )
+
+    async def passwords_match_async(
+        self, plain_text_password: str, hashed_password: McfHash
+    ) -> bool:
+        return await asyncio.wrap_future(
+            self._submit(passwords_match, plain_text_password, hashed_password)
+        )
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _submit(self, function: Callable[..., Any], *args: Any) -> Future:
+        with self._lock:
+            if self._pending_count >= self.max_workers + self.max_queue_size:
+                self.rejected_count += 1
+                raise PasswordHashingOverloaded(pending_count=self._pending_count)
+            self._pending_count += 1
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _release(self) -> None:
+        with self._lock:
+            self._pending_count -= 1
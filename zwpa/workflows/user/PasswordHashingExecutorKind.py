@@ -0,0 +1,6 @@
+from enum import Enum
+
+
+class PasswordHashingExecutorKind(str, Enum):
+    THREAD = "THREAD"
+    PROCESS = "PROCESS"
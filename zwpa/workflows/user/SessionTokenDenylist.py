@@ -0,0 +1,54 @@
+import threading
+import time
+from typing import Callable
+
+from zwpa.workflows.user.SessionTokenService import SessionToken
+
+
+class SessionTokenDenylist:
+    """In-memory record of revoked session tokens.
+
+    Single tokens are remembered until they would have expired anyway. Revoking
+    a user rejects every token issued to them up to that moment.
+    """
+
+    def __init__(
+        self,
+        max_token_ttl_in_seconds: float = 900.0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.max_token_ttl_in_seconds = max_token_ttl_in_seconds
+        self.clock = clock
+
+        self._expires_at_by_token_id: dict[str, float] = {}
+        self._revoked_before_by_user_id: dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def revoke(self, session_token: SessionToken) -> None:
+        with self._lock:
+            self._discard_expired_entries()
+            self._expires_at_by_token_id[session_token.token_id] = session_token.expires_at
+
+    def revoke_user(self, user_id: int) -> None:
+        with self._lock:
+            self._discard_expired_entries()
+            self._revoked_before_by_user_id[user_id] = self.clock()
+
+    def is_revoked(self, session_token: SessionToken) -> bool:
+        if session_token.token_id in self._expires_at_by_token_id:
+            return True
+        revoked_before = self._revoked_before_by_user_id.get(session_token.user_id)
+        return revoked_before is not None and session_token.issued_at <= revoked_before
+
+    def _discard_expired_entries(self) -> None:
+        now = self.clock()
+        self._expires_at_by_token_id = {
+            token_id: expires_at
+            for token_id, expires_at in self._expires_at_by_token_id.items()
+            if expires_at > now
+        }
+        self._revoked_before_by_user_id = {
+            user_id: revoked_before
+            for user_id, revoked_before in self._revoked_before_by_user_id.items()
+            if revoked_before + self.max_token_ttl_in_seconds > now
+        }
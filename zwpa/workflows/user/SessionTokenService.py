@@ -0,0 +1,96 @@
+import base64
+from dataclasses import dataclass
+import hashlib
+import hmac
+import json
+import secrets
+import time
+from typing import Callable
+
+from zwpa.exceptions.InvalidSessionToken import InvalidSessionToken
+from zwpa.model import UserRole
+
+
+@dataclass(frozen=True)
+class SessionToken:
+    token_id: str
+    user_id: int
+    roles: frozenset[UserRole]
+    issued_at: float
+    expires_at: float
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class SessionTokenService:
+    """Issues and verifies HMAC-signed session tokens.
+
+    A token is `<payload>.<signature>`, both base64url encoded, so it can be
+    verified with the secret alone, without touching the database.
+    """
+
+    def __init__(
+        self,
+        secret: bytes,
+        ttl_in_seconds: float = 900.0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.secret = secret
+        self.ttl_in_seconds = ttl_in_seconds
+        self.clock = clock
+
+    def issue(self, user_id: int, roles: frozenset[UserRole]) -> tuple[str, SessionToken]:
+        issued_at = self.clock()
+        session_token = SessionToken(
+            token_id=secrets.token_urlsafe(16),
+            user_id=user_id,
+            roles=roles,
+            issued_at=issued_at,
+            expires_at=issued_at + self.ttl_in_seconds,
+        )
+        payload = _encode(
+            json.dumps(
+                {
+                    "jti": session_token.token_id,
+                    "sub": session_token.user_id,
+                    "roles": sorted(role.value for role in session_token.roles),
+                    "iat": session_token.issued_at,
+                    "exp": session_token.expires_at,
+                },
+                separators=(",", ":"),
+            ).encode("utf-8")
+        )
+        return f"{payload}.{self._sign(payload)}", session_token
+
+    def verify(self, token: str) -> SessionToken:
+        payload, separator, signature = token.partition(".")
+        # issued tokens are base64url only; anything else could not even be signed
+        if not separator or not token.isascii():
+            raise InvalidSessionToken("malformed")
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            raise InvalidSessionToken("bad signature")
+        try:
+            claims = json.loads(_decode(payload))
+            session_token = SessionToken(
+                token_id=claims["jti"],
+                user_id=int(claims["sub"]),
+                roles=frozenset(UserRole(role) for role in claims["roles"]),
+                issued_at=float(claims["iat"]),
+                expires_at=float(claims["exp"]),
+            )
+        except (ValueError, KeyError, TypeError):
+            raise InvalidSessionToken("malformed")
+        if session_token.expires_at <= self.clock():
+            raise InvalidSessionToken("expired")
+        return session_token
+
+    def _sign(self, payload: str) -> str:
+        return _encode(
+            hmac.new(self.secret, payload.encode("ascii"), hashlib.sha256).digest()
+        )
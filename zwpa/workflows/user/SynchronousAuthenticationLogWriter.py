@@ -0,0 +1,17 @@
+from sqlalchemy.orm import sessionmaker
+
+from zwpa.model import UserAuthenticationLogRecord
+from zwpa.workflows.user.AuthenticationLogWriter import AuthenticationLogWriter
+
+
+class SynchronousAuthenticationLogWriter(AuthenticationLogWriter):
+    def __init__(self, session_maker: sessionmaker) -> None:
+        super().__init__()
+        self.session_maker = session_maker
+
+    def write(self, login: str, authenticated: bool) -> None:
+        with self.session_maker() as session:
+            session.add(
+                UserAuthenticationLogRecord(login=login, authenticated=authenticated)
+            )
+            session.commit()
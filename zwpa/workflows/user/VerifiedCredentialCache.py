@@ -0,0 +1,113 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import hmac
+import os
+import threading
+import time
+from typing import Callable
+
+
+@dataclass
+class VerifiedCredentialCacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+
+
+@dataclass
+class _VerifiedCredential:
+    user_id: int
+    password_digest: bytes
+    expires_at: float
+
+
+class VerifiedCredentialCache:
+    """Bounded LRU of recently verified (login, password digest) pairs.
+
+    Plain text passwords are never stored, only their HMAC under a key that
+    lives as long as the process does.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl_in_seconds: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl_in_seconds = ttl_in_seconds
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._digest_key = os.urandom(32)
+        self._credentials_by_login: OrderedDict[str, _VerifiedCredential] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_user_id(self, login: str, plain_text_password: str) -> int | None:
+        password_digest = self._digest(plain_text_password)
+        with self._lock:
+            credential = self._credentials_by_login.get(login)
+            if credential is None:
+                self.misses += 1
+                return None
+            if credential.expires_at <= self.clock():
+                del self._credentials_by_login[login]
+                self.misses += 1
+                return None
+            if not hmac.compare_digest(credential.password_digest, password_digest):
+                self.misses += 1
+                return None
+            self._credentials_by_login.move_to_end(login)
+            self.hits += 1
+            return credential.user_id
+
+    def store(self, login: str, plain_text_password: str, user_id: int) -> None:
+        if self.max_size < 1 or self.ttl_in_seconds <= 0:
+            return
+        credential = _VerifiedCredential(
+            user_id=user_id,
+            password_digest=self._digest(plain_text_password),
+            expires_at=self.clock() + self.ttl_in_seconds,
+        )
+        with self._lock:
+            self._credentials_by_login[login] = credential
+            self._credentials_by_login.move_to_end(login)
+            while len(self._credentials_by_login) > self.max_size:
+                self._credentials_by_login.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_login(self, login: str) -> None:
+        with self._lock:
+            self._credentials_by_login.pop(login, None)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            logins = [
+                login
+                for login, credential in self._credentials_by_login.items()
+                if credential.user_id == user_id
+            ]
+            for login in logins:
+                del self._credentials_by_login[login]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._credentials_by_login.clear()
+
+    def stats(self) -> VerifiedCredentialCacheStats:
+        with self._lock:
+            return VerifiedCredentialCacheStats(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                size=len(self._credentials_by_login),
+            )
+
+    def _digest(self, plain_text_password: str) -> bytes:
+        return hmac.new(
+            self._digest_key, plain_text_password.encode("utf-8"), hashlib.sha256
+        ).digest()
@@ -0,0 +1,30 @@
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from zwpa.model import UserRole
+
+
+@dataclass(frozen=True)
+class Principal:
+    user_id: int
+    roles: frozenset[UserRole]
+
+    def has_role(self, role: UserRole) -> bool:
+        return role in self.roles
+
+
+_current_principal: ContextVar[Principal | None] = ContextVar(
+    "current_principal", default=None
+)
+
+
+def set_current_principal(principal: Principal) -> None:
+    _current_principal.set(principal)
+
+
+def get_current_principal_of(user_id: int) -> Principal | None:
+    """Returns the principal resolved for the ongoing request, if it is `user_id`."""
+    principal = _current_principal.get()
+    if principal is None or principal.user_id != user_id:
+        return None
+    return principal
@@ -0,0 +1,95 @@
+import threading
+import time
+from typing import Callable
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import sessionmaker, Session
+
+from zwpa.model import UserRole, UserRoleVersion
+
+
+ROLE_VERSION_ID = 1
+
+
+def bump_role_version(session: Session) -> None:
+    """Marks every cached role set in every process as stale. Commit is left to the caller."""
+    session.execute(
+        pg_insert(UserRoleVersion)
+        .values(id=ROLE_VERSION_ID, version=1)
+        .on_conflict_do_update(
+            index_elements=[UserRoleVersion.id],
+            set_={"version": UserRoleVersion.version + 1},
+        )
+    )
+
+
+class RoleCache:
+    """Process-local `user_id -> roles` map, dropped whenever the global role version changes.
+
+    The version is read from the database at most once per
+    `version_check_interval_in_seconds`, so in between lookups are plain
+    dictionary hits and role changes made by other processes become visible
+    after at most that long.
+    """
+
+    def __init__(
+        self,
+        session_maker: sessionmaker[Session],
+        max_size: int = 100_000,
+        version_check_interval_in_seconds: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.session_maker = session_maker
+        self.max_size = max_size
+        self.version_check_interval_in_seconds = version_check_interval_in_seconds
+        self.clock = clock
+
+        self._roles_by_user_id: dict[int, frozenset[UserRole]] = {}
+        self._version: int | None = None
+        self._next_version_check_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> int | None:
+        return self._version
+
+    def get(self, user_id: int) -> frozenset[UserRole] | None:
+        self._refresh_version_if_due()
+        return self._roles_by_user_id.get(user_id)
+
+    def put(self, user_id: int, roles: frozenset[UserRole], version: int | None) -> None:
+        """Stores roles loaded while the cache was at `version`, unless it has moved on since."""
+        with self._lock:
+            if version is None or version != self._version:
+                return
+            if len(self._roles_by_user_id) >= self.max_size:
+                del self._roles_by_user_id[next(iter(self._roles_by_user_id))]
+            self._roles_by_user_id[user_id] = roles
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._roles_by_user_id.clear()
+            self._version = None
+            self._next_version_check_at = 0.0
+
+    def _refresh_version_if_due(self) -> None:
+        if self.clock() < self._next_version_check_at:
+            return
+        with self._lock:
+            now = self.clock()
+            if now < self._next_version_check_at:
+                return
+            self._next_version_check_at = now + self.version_check_interval_in_seconds
+            version = self._read_version()
+            if version != self._version:
+                self._roles_by_user_id.clear()
+                self._version = version
+
+    def _read_version(self) -> int:
+        with self.session_maker() as session:
+            version = session.scalar(
+                select(UserRoleVersion.version).where(
+                    UserRoleVersion.id == ROLE_VERSION_ID
+                )
+            )
+            return version if version is not None else 0
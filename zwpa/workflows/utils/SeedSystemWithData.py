@@ -2,7 +2,7 @@ from datetime import timedelta
 from decimal import Decimal
 import random
 from faker import Faker
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.orm import sessionmaker, Session
 from zwpa.model import *
 
@@ -173,6 +173,11 @@ class SeedSystemWithDataWorkflow:
             UserRoleAssignment(role=role, user_id=user_id) for user_id in user_ids
         ]
         session.add_all(role_assignments)
+        session.execute(
+            update(User)
+            .where(User.id.in_(user_ids))
+            .values(role_mask=User.role_mask.op("|")(USER_ROLE_BITS[role]))
+        )
         session.commit()
         return user_ids
 
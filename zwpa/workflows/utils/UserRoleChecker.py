@@ -1,23 +1,56 @@
+from typing import Optional
+from sqlalchemy import select
 from sqlalchemy.orm import sessionmaker, Session
 from zwpa.exceptions.UserLacksRoleException import UserLacksRoleException
 
-from zwpa.model import User, UserRole
+from zwpa.model import User, UserRole, has_role_predicate, mask_to_roles
+from zwpa.workflows.utils.Principal import get_current_principal_of
+from zwpa.workflows.utils.RoleCache import RoleCache
 
 
 class UserRoleChecker:
-    def __init__(self, session_maker: sessionmaker[Session]) -> None:
+    def __init__(
+        self,
+        session_maker: sessionmaker[Session],
+        role_cache: Optional[RoleCache] = None,
+    ) -> None:
         self.session_maker = session_maker
+        self.role_cache = role_cache
+
+    def get_user_roles(self, user_id: int) -> frozenset[UserRole]:
+        principal = get_current_principal_of(user_id)
+        if principal is not None:
+            return principal.roles
+        if self.role_cache is None:
+            return self._load_user_roles(user_id)
+
+        roles = self.role_cache.get(user_id)
+        if roles is None:
+            version = self.role_cache.version
+            roles = self._load_user_roles(user_id)
+            self.role_cache.put(user_id, roles, version=version)
+        return roles
 
     def is_user_of_role(self, user_id: int, role: UserRole) -> bool:
-        with self.session_maker() as session:
-            user_roles = [
-                assignment.role for assignment in session.get_one(User, user_id).roles
-            ]
-            return role in user_roles
+        return role in self.get_user_roles(user_id)
 
     def assert_user_of_role(self, user_id: int, role: UserRole):
         self.assert_user_with_one_of_roles(user_id, [role])
 
     def assert_user_with_one_of_roles(self, user_id: int, roles: list[UserRole]):
-        if not any(self.is_user_of_role(user_id, role) for role in roles):
+        user_roles = self.get_user_roles(user_id)
+        if not any(role in user_roles for role in roles):
             raise UserLacksRoleException
+
+    def list_users_with_role(self, role: UserRole) -> list[int]:
+        with self.session_maker() as session:
+            return list(
+                session.scalars(select(User.id).where(has_role_predicate(role)))
+            )
+
+    def _load_user_roles(self, user_id: int) -> frozenset[UserRole]:
+        with self.session_maker() as session:
+            role_mask = session.scalar(
+                select(User.role_mask).where(User.id == user_id)
+            )
+            return mask_to_roles(role_mask or 0)